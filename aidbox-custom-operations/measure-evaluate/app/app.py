@@ -9,12 +9,21 @@ Aidbox (SQLQuery Libraries installed from the FHIR package); this adapter holds
 row -> MeasureReport shaping.
 """
 
-import json
+import atexit
+import base64
+import contextvars
 import os
+import queue
 import sys
+import threading
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from urllib.parse import urlencode
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 
 # Import core logic from evaluate_measure.py
 # In Docker: /app/app/evaluate_measure.py; locally: same directory
@@ -22,49 +31,192 @@ REPO_ROOT = os.environ.get('REPO_ROOT', os.path.dirname(os.path.dirname(os.path.
 sys.path.insert(0, os.path.join(REPO_ROOT, 'app'))
 from evaluate_measure import (
     MEASURES,
-    build_measure_report,
+    MeasureReportTemplate,
+    _sanitize_patient_id,
     build_summary_report,
 )
+import http_pool
+import metrics
+import report_json
 import sqlquery_transport as sqt
+from persist_queue import WriteBehindQueue
+
+
+class _JSONProvider(DefaultJSONProvider):
+    """jsonify / app.json.dumps through report_json.dumps (JSON_ENCODER); indented
+    debug output stays with the stdlib."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs.get('indent') is not None:
+            return super().dumps(obj, **kwargs)
+        return report_json.dumps(obj)
+
 
 app = Flask(__name__)
+app.json = _JSONProvider(app)
 
 AIDBOX_URL = os.environ.get('AIDBOX_URL', 'http://localhost:8888')
 AIDBOX_USER = os.environ.get('AIDBOX_USER', 'root')
 AIDBOX_PASS = os.environ.get('AIDBOX_PASS', 'secret')
 
-# Cache for Measure resource metadata (read from Aidbox once)
+# Bounded pool the service owns for upstream Aidbox calls. One request fans its
+# independent round trips (metadata, $sqlquery-run, reporter Organization) out here;
+# the cap keeps a burst of requests from opening unbounded upstream connections.
+UPSTREAM_WORKERS = int(os.environ.get('UPSTREAM_WORKERS', 16))
+# Per-call deadlines (seconds) a request waits on a fanned-out call.
+METADATA_DEADLINE = float(os.environ.get('METADATA_DEADLINE', 10))
+SQL_DEADLINE = float(os.environ.get('SQL_DEADLINE', 120))
+# subject-list responses are streamed entry by entry (set to 0 to build the whole
+# Bundle in memory and jsonify it, the pre-streaming behavior).
+STREAM_SUBJECT_LIST = os.environ.get('STREAM_SUBJECT_LIST', '1') != '0'
+# Set to 1 to write POST-persisted MeasureReports behind the response in batched
+# transaction Bundles (persist_queue.py). The client then gets the report before it is
+# stored, and a report whose batch keeps failing is dropped (GET /persist, /metrics);
+# by default each one is written before responding.
+PERSIST_WRITE_BEHIND = os.environ.get('PERSIST_WRITE_BEHIND', '0') != '0'
+# Largest patient panel (Group members or explicit subject list) one request may
+# evaluate; the panel is sent to Aidbox as a single :subjects parameter.
+MAX_PANEL_SIZE = int(os.environ.get('MAX_PANEL_SIZE', 5000))
+# Largest subject-list page (`_count`) one request returns; a larger _count is cut to it.
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 10000))
+# Base URL clients reach the operation at, for the self/next links of a paged Bundle.
+PUBLIC_BASE_URL = os.environ.get('PUBLIC_BASE_URL', AIDBOX_URL)
+
+_upstream_pool = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS,
+                                    thread_name_prefix='aidbox-upstream')
+
+_NO_DEFAULT = object()
+
+
+def _submit(fn, *args, **kwargs):
+    """Schedule an upstream call on the service pool; returns its Future. The call
+    runs in a copy of the caller's context, so it records into the caller's metrics."""
+    return _upstream_pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def _await(future, deadline, default=_NO_DEFAULT):
+    """Wait up to `deadline` seconds for a fanned-out call.
+
+    With a default, a timeout or failure yields the default (best-effort calls);
+    without one the exception propagates (a missed deadline raises TimeoutError).
+    """
+    try:
+        return future.result(timeout=deadline)
+    except Exception:
+        future.cancel()
+        if default is _NO_DEFAULT:
+            raise
+        return default
+
+
+# Cache for Measure resource metadata. Every registry measure is fetched at startup
+# (prewarm_measure_metadata); entries then live METADATA_TTL seconds. A failed fetch
+# is cached too (negative caching), retried after METADATA_RETRY_BASE seconds doubling
+# per consecutive failure up to METADATA_RETRY_MAX, so requests made while Aidbox is
+# unhealthy do not each wait out the fetch timeout. A failure after a success keeps
+# serving the last good metadata until the retry succeeds.
+METADATA_TTL = float(os.environ.get('METADATA_TTL', 3600))
+METADATA_RETRY_BASE = float(os.environ.get('METADATA_RETRY_BASE', 5))
+METADATA_RETRY_MAX = float(os.environ.get('METADATA_RETRY_MAX', 300))
+
+# measure_id -> {'meta': dict | None, 'expires': monotonic, 'failures': int}
 _measure_metadata_cache = {}
+_metadata_lock = threading.Lock()
+
+
+metadata_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def cached_measure_metadata(measure_id: str):
+    """(True, meta) for a live cache entry (meta may be None: negative entry),
+    else (False, None)."""
+    entry = _measure_metadata_cache.get(measure_id)
+    if entry and time.monotonic() < entry['expires']:
+        metadata_cache_stats['hits'] += 1
+        return True, entry['meta']
+    metadata_cache_stats['misses'] += 1
+    return False, None
 
 
-def fetch_measure_metadata(measure_id: str) -> dict | None:
+def store_measure_metadata(measure_id: str, meta: dict | None) -> dict | None:
+    """Record a fetch outcome (meta=None for a failure); returns the metadata to use."""
+    with _metadata_lock:
+        entry = _measure_metadata_cache.get(measure_id) or {'meta': None, 'failures': 0}
+        if meta is not None:
+            entry.update(meta=meta, failures=0, expires=time.monotonic() + METADATA_TTL)
+        else:
+            entry['failures'] += 1
+            backoff = min(METADATA_RETRY_BASE * 2 ** (entry['failures'] - 1), METADATA_RETRY_MAX)
+            entry['expires'] = time.monotonic() + backoff
+        _measure_metadata_cache[measure_id] = entry
+        return entry['meta']
+
+
+def fetch_measure_metadata(measure_id: str, refresh: bool = False) -> dict | None:
     """Fetch Measure resource from Aidbox and extract DEQM-relevant metadata.
 
     Returns dict with: version, scoring, improvementNotation, publisher, group_id.
-    Caches results to avoid repeated Aidbox calls.
+    Served from the TTL/negative cache unless `refresh` forces a re-fetch.
     """
-    if measure_id in _measure_metadata_cache:
-        return _measure_metadata_cache[measure_id]
+    if not refresh:
+        hit, meta = cached_measure_metadata(measure_id)
+        if hit:
+            return meta
 
-    measure_info = MEASURES.get(measure_id, {})
-    # Derive FHIR Measure resource ID from canonical URL
-    canonical = measure_info.get('canonical', '')
-    fhir_id = canonical.rsplit('/', 1)[-1] if '/' in canonical else None
+    fhir_id = measure_fhir_id(measure_id)
     if not fhir_id:
         return None
 
     try:
-        import urllib.request
-        import base64
-        creds = base64.b64encode(f"{AIDBOX_USER}:{AIDBOX_PASS}".encode()).decode()
-        req = urllib.request.Request(f"{AIDBOX_URL}/fhir/Measure/{fhir_id}")
-        req.add_header('Authorization', f'Basic {creds}')
-        resp = urllib.request.urlopen(req, timeout=10)
-        m = json.loads(resp.read())
+        with metrics.span('metadata'):
+            m = http_pool.request('GET', f"{AIDBOX_URL}/fhir/Measure/{fhir_id}",
+                                  AIDBOX_USER, AIDBOX_PASS, timeout=METADATA_DEADLINE)
     except Exception:
+        m = None
+    return store_measure_metadata(measure_id, parse_measure_metadata(m))
+
+
+def prewarm_measure_metadata(measure_ids=None) -> dict:
+    """(Re-)fetch metadata for the given measures (default: the whole registry) in
+    parallel on the upstream pool. Returns {measure_id: version or None}."""
+    measure_ids = list(measure_ids or MEASURES)
+    futures = {mid: _submit(fetch_measure_metadata, mid, refresh=True) for mid in measure_ids}
+    return {mid: (_await(f, METADATA_DEADLINE, default=None) or {}).get('version')
+            for mid, f in futures.items()}
+
+
+def prewarm_library_ids() -> int | None:
+    """Resolve every registry measure's Library ids in one batched search.
+
+    Returns the number found by search, or None if the search failed (lookups then
+    happen lazily, one search per Library)."""
+    try:
+        return sqt.resolve_library_ids(sqt.library_variant_ids(MEASURES),
+                                       AIDBOX_URL, AIDBOX_USER, AIDBOX_PASS)
+    except Exception as e:
+        app.logger.warning(f"Batched Library resolution failed: {e}")
         return None
 
-    if m.get('resourceType') != 'Measure':
+
+def metadata_status() -> dict:
+    """Per-measure cache state for the /metadata endpoint."""
+    now = time.monotonic()
+    return {mid: {'version': (e['meta'] or {}).get('version'),
+                  'cached': e['meta'] is not None,
+                  'failures': e['failures'],
+                  'expires_in': round(max(e['expires'] - now, 0), 1)}
+            for mid, e in sorted(_measure_metadata_cache.items())}
+
+
+def measure_fhir_id(measure_id: str) -> str | None:
+    """FHIR Measure resource ID, derived from the registry's canonical URL."""
+    canonical = MEASURES.get(measure_id, {}).get('canonical', '')
+    return canonical.rsplit('/', 1)[-1] if '/' in canonical else None
+
+
+def parse_measure_metadata(m: dict | None) -> dict | None:
+    """Measure resource -> metadata dict (None if `m` is not a Measure)."""
+    if not m or m.get('resourceType') != 'Measure':
         return None
 
     # Extract metadata from Measure resource
@@ -91,11 +243,17 @@ def fetch_measure_metadata(measure_id: str) -> dict | None:
         elif 'improvementnotation' in url.lower():
             meta['improvementNotation'] = ext.get('valueCodeableConcept')
 
-    _measure_metadata_cache[measure_id] = meta
     return meta
 
 
 _reporter_org_created = False
+REPORTER_ORG = {
+    "resourceType": "Organization",
+    "id": "sql-measure-engine",
+    "name": "Aidbox SQL Measure Engine",
+    "type": [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/organization-type",
+                           "code": "other", "display": "Other"}]}],
+}
 
 
 def _ensure_reporter_org():
@@ -104,22 +262,8 @@ def _ensure_reporter_org():
     if _reporter_org_created:
         return
     try:
-        import urllib.request
-        import base64
-        org = json.dumps({
-            "resourceType": "Organization",
-            "id": "sql-measure-engine",
-            "name": "Aidbox SQL Measure Engine",
-            "type": [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/organization-type",
-                                   "code": "other", "display": "Other"}]}],
-        }).encode()
-        creds = base64.b64encode(f"{AIDBOX_USER}:{AIDBOX_PASS}".encode()).decode()
-        req = urllib.request.Request(
-            f"{AIDBOX_URL}/fhir/Organization/sql-measure-engine",
-            method="PUT", data=org)
-        req.add_header("Authorization", f"Basic {creds}")
-        req.add_header("Content-Type", "application/json")
-        urllib.request.urlopen(req, timeout=10)
+        http_pool.request("PUT", f"{AIDBOX_URL}/fhir/Organization/sql-measure-engine",
+                          AIDBOX_USER, AIDBOX_PASS, payload=REPORTER_ORG, timeout=10)
         _reporter_org_created = True
     except Exception:
         pass
@@ -128,12 +272,16 @@ def _ensure_reporter_org():
 DEQM_INDV_PROFILE = "http://hl7.org/fhir/us/davinci-deqm/StructureDefinition/indv-measurereport-deqm"
 
 
-def enrich_measure_report(report: dict, measure_id: str) -> dict:
+def enrich_measure_report(report: dict, measure_id: str, meta=_NO_DEFAULT,
+                          ensure_reporter=True) -> dict:
     """Enrich MeasureReport with DEQM-required fields from Measure resource.
 
     Adds: measure version, reporter, scoring extension, improvementNotation, group.id.
+    Callers that already fetched the metadata and upserted the reporter Organization
+    pass `meta` and ensure_reporter=False, which keeps this free of upstream I/O.
     """
-    meta = fetch_measure_metadata(measure_id)
+    if meta is _NO_DEFAULT:
+        meta = fetch_measure_metadata(measure_id)
     if not meta:
         return report
 
@@ -148,7 +296,8 @@ def enrich_measure_report(report: dict, measure_id: str) -> dict:
 
     # 2. Reporter (required 1..1 in DEQM) -- Organization that generated the report
     if 'reporter' not in report:
-        _ensure_reporter_org()
+        if ensure_reporter:
+            _ensure_reporter_org()
         report['reporter'] = {
             'reference': 'Organization/sql-measure-engine',
             'display': 'Aidbox SQL Measure Engine',
@@ -188,6 +337,8 @@ def handle_operation():
     if operation_id in ('measure-evaluate', 'measure-evaluate-get'):
         persist = (operation_id == 'measure-evaluate')  # POST persists, GET does not
         return measure_evaluate(body, persist=persist)
+    if operation_id in ('measure-evaluate-batch', 'measure-evaluate-batch-get'):
+        return measure_evaluate_batch(body, persist=(operation_id == 'measure-evaluate-batch'))
 
     return jsonify({
         'resourceType': 'OperationOutcome',
@@ -196,27 +347,186 @@ def handle_operation():
     }), 400
 
 
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    """$sqlquery-run result cache counters (hits, misses, evictions, size), coalesced
+    executions and the upstream connection pool's reuse counters."""
+    return jsonify({**sqt.result_cache.stats(), 'single_flight': sqt.single_flight.stats(),
+                    'http_pool': http_pool.pool.stats()})
+
+
+@app.route('/cache/invalidate', methods=['POST'])
+def cache_invalidate():
+    """Drop cached results: all of them, or one Library variant via ?variant=<id>."""
+    dropped = sqt.invalidate_results(request.args.get('variant'))
+    return jsonify({'invalidated': dropped})
+
+
+@app.route('/metadata', methods=['GET'])
+def metadata_cache():
+    """Measure metadata cache state (version, failures, seconds to expiry) per measure."""
+    return jsonify(metadata_status())
+
+
+@app.route('/metadata/refresh', methods=['POST'])
+def metadata_refresh():
+    """Re-fetch Measure metadata now: every registry measure, or one via ?measure=<id>."""
+    measure = request.args.get('measure')
+    if measure and measure not in MEASURES:
+        return jsonify(_outcome('not-found', f'Unknown measure: {measure}')), 404
+    return jsonify(prewarm_measure_metadata([measure] if measure else None))
+
+
+@app.route('/libraries', methods=['GET'])
+def library_ids():
+    """Resolved SQLQuery Library ids (canonical url -> runtime id) and resolution timings."""
+    return jsonify(library_status())
+
+
+def library_status():
+    return {'resolution': sqt.library_resolution_stats(), 'ids': sqt.library_ids()}
+
+
+@app.route('/membership', methods=['GET'])
+def membership_snapshots():
+    """Membership snapshot builds (sof.measure_membership_build) with their freshness,
+    and how often snapshots were served vs. fell back to the Libraries."""
+    creds = (AIDBOX_URL, AIDBOX_USER, AIDBOX_PASS)
+    return jsonify(sqt.snapshot_status(sqt.data_version(*creds), sqt.snapshot_builds(*creds)))
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (see metrics.py)."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def _hit_ratio(hits, misses):
+    return round(hits / (hits + misses), 4) if hits + misses else None
+
+
+@metrics.register_collector
+def cache_metrics():
+    """Hit/miss counters and ratios of the result, metadata and Library id caches."""
+    result = sqt.result_cache.stats()
+    lib = sqt.library_resolution_stats()
+    counts = {'result': (result['hits'], result['misses']),
+              'metadata': (metadata_cache_stats['hits'], metadata_cache_stats['misses']),
+              'library_id': (lib['hits'], lib['lookups'])}
+    return (metrics.scrape_lines('measure_evaluate_cache_hits_total', 'counter',
+                                 'Cache hits.', 'cache', {k: h for k, (h, _) in counts.items()})
+            + metrics.scrape_lines('measure_evaluate_cache_misses_total', 'counter',
+                                   'Cache misses.', 'cache',
+                                   {k: m for k, (_, m) in counts.items()})
+            + metrics.scrape_lines('measure_evaluate_cache_hit_ratio', 'gauge',
+                                   'Cache hit ratio since start.', 'cache',
+                                   {k: _hit_ratio(h, m) for k, (h, m) in counts.items()}))
+
+
+@metrics.register_collector
+def persist_metrics():
+    """Write-behind persistence: reports queued / written / dropped, failed batch
+    attempts, queue depth and when the last attempt failed."""
+    stats = persist_queue.stats()
+    lines = metrics.scrape_lines(
+        'measure_evaluate_persist_reports_total', 'counter',
+        'MeasureReports through the write-behind queue, by outcome.', 'outcome',
+        {k: stats[k] for k in ('enqueued', 'written', 'dropped')})
+    for name, kind, help_text, value in (
+            ('measure_evaluate_persist_failed_attempts_total', 'counter',
+             'Failed transaction Bundle writes (each retry counts).', stats['failed_attempts']),
+            ('measure_evaluate_persist_queue_depth', 'gauge',
+             'MeasureReports waiting to be written.', stats['depth']),
+            ('measure_evaluate_persist_last_error_timestamp_seconds', 'gauge',
+             'Unix time of the last failed write.', stats['last_error_at'])):
+        if value is not None:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    return lines
+
+
+@app.route('/persist', methods=['GET'])
+def persist_stats():
+    """Write-behind persistence queue depth and write/retry/drop counters, and the last
+    write error."""
+    return jsonify({'write_behind': PERSIST_WRITE_BEHIND, **persist_queue.stats()})
+
+
 def _persist_resource(resource):
     """Save a FHIR resource to Aidbox via POST. Returns saved resource with server-assigned id."""
-    import urllib.request
-    import base64
-    creds = base64.b64encode(f"{AIDBOX_USER}:{AIDBOX_PASS}".encode()).decode()
     rt = resource['resourceType']
-    req = urllib.request.Request(
-        f"{AIDBOX_URL}/fhir/{rt}",
-        method="POST",
-        data=json.dumps(resource).encode(),
-    )
-    req.add_header("Authorization", f"Basic {creds}")
-    req.add_header("Content-Type", "application/json")
-    resp = urllib.request.urlopen(req, timeout=30)
-    return json.loads(resp.read())
+    return http_pool.request("POST", f"{AIDBOX_URL}/fhir/{rt}",
+                             AIDBOX_USER, AIDBOX_PASS, payload=resource, timeout=30)
 
 
-def measure_evaluate(body, persist=False):
-    """Handle Measure/\$evaluate-measure. POST persists the MeasureReport, GET does not."""
-    params = body.get('request', {}).get('params', {})
+def _send_transaction(bundle):
+    http_pool.request("POST", f"{AIDBOX_URL}/fhir", AIDBOX_USER, AIDBOX_PASS,
+                      payload=bundle, timeout=60)
+
+
+persist_queue = WriteBehindQueue(_send_transaction)
+atexit.register(persist_queue.flush)
+
+
+def queue_for_persist(report):
+    """Write-behind POST persistence: the report gets its id now and is returned as
+    stored; None when write-behind is off or the queue is full (write it directly)."""
+    if not PERSIST_WRITE_BEHIND:
+        return None
+    try:
+        return persist_queue.submit(report)
+    except queue.Full:
+        app.logger.warning("Persist queue full; writing MeasureReport synchronously")
+        return None
+
+
+def persist_report(report):
+    """Persist a MeasureReport (write-behind when enabled); never fails the request."""
+    try:
+        with metrics.phase('persist'), metrics.span('persist'):
+            return queue_for_persist(report) or _persist_resource(report)
+    except Exception as e:
+        app.logger.warning(f"Failed to persist MeasureReport: {e}")
+        return report
+
+
+# Normalize reportType: R4 $evaluate-measure input codes map to R4
+# MeasureReport.type codes used internally.
+#   Input (reportType)  → Internal (MeasureReport.type)
+#   subject             → individual
+#   subject-list        → subject-list
+#   population          → summary
+REPORT_TYPE_MAP = {
+    'subject': 'individual',
+    'subject-list': 'subject-list',
+    'population': 'summary',
+}
+
+
+def _outcome(code, diagnostics, severity='error'):
+    return {'resourceType': 'OperationOutcome',
+            'issue': [{'severity': severity, 'code': code, 'diagnostics': diagnostics}]}
+
+
+# The request parsing/validation and row -> MeasureReport shaping below are shared by
+# the threaded Flask endpoint (measure_evaluate) and the asyncio serving mode
+# (async_app.py); only the upstream I/O differs between the two.
+
+def parse_evaluate_params(params):
+    """Resolve and validate $evaluate-measure params.
+
+    Returns (ctx, None) on success, or (None, (OperationOutcome, http_status)).
+    ctx carries measure_id, requested_version, report_type (internal code),
+    patient_id, period_start, period_end, measure_info and exc_type; the caller adds
+    measure_meta (fetched Measure metadata, or None) before shaping.
 
+    A panel subject -- `Group/<id>`, or several patients (a comma-separated list, or
+    a repeated param) -- is evaluated as a subject-list restricted to those patients:
+    ctx['panel'] is True and patient_ids (explicit list) or group_id is set.
+
+    A (non-panel) subject-list with `_count` and/or `pageToken` is paged: ctx['page']
+    is the sqlquery_transport.Page to return, and page_query the params its self/next
+    links repeat.
+    """
     # Resolve measure from query param (type-level invocation per FHIR spec)
     # Accepts: "cms130", "CMS130FHIRColorectalCancerScrn", canonical URL,
     #          or canonical|version (e.g., "https://madie.cms.gov/Measure/...|1.0.000")
@@ -235,63 +545,20 @@ def measure_evaluate(body, persist=False):
                 measure_id = mid
                 break
 
-    # Fetch Measure resource from Aidbox (primary metadata source)
-    measure_meta = fetch_measure_metadata(measure_id) if measure_id in MEASURES else None
-
-    # Version validation: Measure.version (or requested version) vs registry supported_version
-    if measure_id in MEASURES:
-        supported = MEASURES[measure_id].get('supported_version')
-        actual_version = (measure_meta.get('version') if measure_meta else None) or requested_version
-        if actual_version and supported and actual_version != supported:
-            return jsonify({
-                'resourceType': 'OperationOutcome',
-                'issue': [{'severity': 'error', 'code': 'business-rule',
-                            'diagnostics': f'Measure version mismatch: version {actual_version}, '
-                                           f'SQL implementation supports {supported}'}]
-            }), 422
-        # Explicit requested version must also match the Measure resource version
-        if requested_version and measure_meta and measure_meta.get('version'):
-            if requested_version != measure_meta['version']:
-                return jsonify({
-                    'resourceType': 'OperationOutcome',
-                    'issue': [{'severity': 'error', 'code': 'not-found',
-                                'diagnostics': f'Requested version {requested_version} does not match '
-                                               f'Measure resource version {measure_meta["version"]}'}]
-                }), 404
-
     subject = params.get('subject')
     report_type = params.get('reportType')
     period_start = params.get('periodStart', '2026-01-01')
     period_end = params.get('periodEnd', '2026-12-31')
 
-    # Normalize reportType: R4 $evaluate-measure input codes map to R4
-    # MeasureReport.type codes used internally.
-    #   Input (reportType)  → Internal (MeasureReport.type)
-    #   subject             → individual
-    #   subject-list        → subject-list
-    #   population          → summary
-    REPORT_TYPE_MAP = {
-        'subject': 'individual',
-        'subject-list': 'subject-list',
-        'population': 'summary',
-    }
     if report_type:
         if report_type not in REPORT_TYPE_MAP:
-            return jsonify({
-                'resourceType': 'OperationOutcome',
-                'issue': [{'severity': 'error', 'code': 'invalid',
-                            'diagnostics': f'Invalid reportType: {report_type}. '
-                                           f'Valid values: subject, subject-list, population.'}]
-            }), 400
+            return None, (_outcome('invalid', f'Invalid reportType: {report_type}. '
+                                              f'Valid values: subject, subject-list, population.'), 400)
         report_type = REPORT_TYPE_MAP[report_type]
 
     # Validate reportType + subject combination
     if report_type == 'individual' and not subject:
-        return jsonify({
-            'resourceType': 'OperationOutcome',
-            'issue': [{'severity': 'error', 'code': 'required',
-                        'diagnostics': 'subject parameter is required for reportType=subject'}]
-        }), 400
+        return None, (_outcome('required', 'subject parameter is required for reportType=subject'), 400)
 
     # Determine effective report type (explicit > inference from subject)
     if not report_type:
@@ -299,91 +566,502 @@ def measure_evaluate(body, persist=False):
     elif report_type == 'summary':
         subject = None  # ignore subject for summary
 
+    patient_ids = group_id = None
+    if isinstance(subject, list) or (subject and ',' in subject):
+        refs = subject if isinstance(subject, list) else subject.split(',')
+        try:
+            patient_ids = list(dict.fromkeys(
+                _sanitize_patient_id(r.strip()) for r in refs if r.strip()))
+        except ValueError as e:
+            return None, (_outcome('invalid', str(e)), 400)
+        if len(patient_ids) > MAX_PANEL_SIZE:
+            return None, (_outcome('too-costly', f'{len(patient_ids)} subjects exceeds '
+                                                 f'MAX_PANEL_SIZE={MAX_PANEL_SIZE}'), 400)
+    elif subject and subject.startswith('Group/'):
+        group_id = subject[len('Group/'):]
+    panel = patient_ids is not None or group_id is not None
+    if panel:
+        report_type = 'subject-list'
+        subject = None
+
+    page = page_query = None
+    if report_type == 'subject-list' and not panel and (
+            params.get('_count') is not None or params.get('pageToken')):
+        try:
+            page = parse_page(params.get('_count'), params.get('pageToken'))
+        except ValueError as e:
+            return None, (_outcome('invalid', str(e)), 400)
+        page_query = {k: v for k, v in params.items()
+                      if k not in PAGE_PARAMS and isinstance(v, str)}
+
     # Resolve measure
     if measure_id not in MEASURES:
-        return jsonify({
-            'resourceType': 'OperationOutcome',
-            'issue': [{
-                'severity': 'error', 'code': 'not-found',
-                'diagnostics': f'Unknown measure: {measure_id}. '
-                               f'Available: {", ".join(sorted(MEASURES.keys()))}'
-            }]
-        }), 404
+        return None, (_outcome('not-found', f'Unknown measure: {measure_id}. '
+                                            f'Available: {", ".join(sorted(MEASURES.keys()))}'), 404)
 
     measure_info = MEASURES[measure_id]
-    exc_type = measure_info.get('exc_type', 'denominator-exclusion')
-    patient_id = subject.replace('Patient/', '') if subject else None
+    return {
+        'measure_id': measure_id,
+        'requested_version': requested_version,
+        'report_type': report_type,
+        'patient_id': subject.replace('Patient/', '') if subject else None,
+        'period_start': period_start,
+        'period_end': period_end,
+        'measure_info': measure_info,
+        'exc_type': measure_info.get('exc_type', 'denominator-exclusion'),
+        'measure_meta': None,
+        'panel': panel,
+        'patient_ids': patient_ids,
+        'group_id': group_id,
+        'page': page,
+        'page_query': page_query,
+        'links': None,
+        'shared_summary': False,
+    }, None
+
+
+# Paged subject-lists: keyset pagination over patient_id. The page token is the last
+# patient id of the previous page, base64url-encoded so clients treat it as opaque.
+PAGE_PARAMS = ('_count', 'pageToken')
+
+
+def encode_page_token(patient_id):
+    return base64.urlsafe_b64encode(patient_id.encode()).decode().rstrip('=')
+
+
+def decode_page_token(token):
+    try:
+        patient_id = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        return _sanitize_patient_id(patient_id)
+    except ValueError:
+        raise ValueError(f'Invalid pageToken: {token}') from None
+
+
+def parse_page(count, token):
+    """`_count` / `pageToken` -> Page (the first page without a token). `_count`
+    defaults to, and is capped at, MAX_PAGE_SIZE."""
+    if count is None:
+        count = MAX_PAGE_SIZE
+    try:
+        count = int(count)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid _count: {count}') from None
+    if count < 1:
+        raise ValueError(f'Invalid _count: {count} (must be at least 1)')
+    return sqt.Page(decode_page_token(token) if token else '', min(count, MAX_PAGE_SIZE))
+
+
+def page_url(ctx, after):
+    query = {**ctx['page_query'], '_count': str(ctx['page'].count)}
+    if after:
+        query['pageToken'] = encode_page_token(after)
+    return f'{PUBLIC_BASE_URL}/Measure/$evaluate-measure?{urlencode(query)}'
+
+
+def paginate(ctx, rows):
+    """MembershipRows fetched for ctx's page with one extra row -> the page's rows;
+    sets ctx['links'] to self, plus next when the extra row shows there is more."""
+    page = ctx['page']
+    links = [{'relation': 'self', 'url': page_url(ctx, page.after)}]
+    if len(rows) > page.count:
+        rows = rows.head(page.count)
+        links.append({'relation': 'next', 'url': page_url(ctx, rows.patient_ids[-1])})
+    ctx['links'] = links
+    return rows
+
+
+def check_measure_version(ctx, measure_meta):
+    """Measure.version (or requested version) vs registry supported_version.
+
+    Returns None when the request may proceed, else (OperationOutcome, http_status).
+    """
+    requested_version = ctx['requested_version']
+    supported = ctx['measure_info'].get('supported_version')
+    actual_version = (measure_meta.get('version') if measure_meta else None) or requested_version
+    if actual_version and supported and actual_version != supported:
+        return _outcome('business-rule', f'Measure version mismatch: version {actual_version}, '
+                                         f'SQL implementation supports {supported}'), 422
+    # Explicit requested version must also match the Measure resource version
+    if requested_version and measure_meta and measure_meta.get('version'):
+        if requested_version != measure_meta['version']:
+            return _outcome('not-found', f'Requested version {requested_version} does not match '
+                                         f'Measure resource version {measure_meta["version"]}'), 404
+    return None
+
+
+# Compiled individual-report templates: (measure, period, exc_type) -> (the metadata
+# the template was enriched with, template). A metadata refresh stores a new dict, so
+# the next request recompiles.
+_report_templates = {}
+MAX_REPORT_TEMPLATES = 256
+
+
+def report_template(ctx):
+    """The MeasureReportTemplate for ctx's measure, period and metadata."""
+    key = (ctx['measure_id'], ctx['period_start'], ctx['period_end'], ctx['exc_type'])
+    meta = ctx['measure_meta']
+    cached = _report_templates.get(key)
+    if cached is not None and cached[0] is meta:
+        return cached[1]
+    with metrics.span('enrich'):
+        template = MeasureReportTemplate(
+            ctx['measure_info'], ctx['period_start'], ctx['period_end'], ctx['exc_type'],
+            enrich=lambda report: enrich_measure_report(report, ctx['measure_id'], meta,
+                                                        ensure_reporter=False))
+    if len(_report_templates) >= MAX_REPORT_TEMPLATES:
+        _report_templates.clear()
+    _report_templates[key] = (meta, template)
+    return template
+
+
+def shape_individual_report(ctx, row, evidence_rows=None):
+    """Membership row (+ evidence rows) -> enriched individual MeasureReport, filled
+    into the measure's compiled template."""
+    template = report_template(ctx)
+    with metrics.span('build'):
+        return template.fill(row, evidence_rows)
+
+
+def shape_summary_report(ctx, results):
+    """Summary row(s) -> enriched summary MeasureReport."""
+    with metrics.span('build'):
+        report = build_summary_report(
+            results, ctx['measure_info'], ctx['period_start'], ctx['period_end'],
+            ctx['exc_type'])
+    with metrics.span('enrich'):
+        return enrich_measure_report(report, ctx['measure_id'], ctx['measure_meta'],
+                                     ensure_reporter=False)
+
+
+def subject_list_bundle(ctx, rows):
+    """Per-patient rows -> subject-list Bundle, built in memory. A page carries its
+    self/next links instead of a total (the cohort size is not counted)."""
+    entries = [{'resource': shape_individual_report(ctx, row), 'search': {'mode': 'match'}}
+               for row in rows]
+    bundle = {'resourceType': 'Bundle', 'type': 'collection'}
+    if ctx['links']:
+        bundle['link'] = ctx['links']
+    else:
+        bundle['total'] = len(entries)
+    bundle['entry'] = entries
+    return bundle
+
+
+def panel_bundle(ctx, rows, evidence_rows=None):
+    """Panel membership rows (+ the panel's evidence rows, split per patient) ->
+    Bundle of individual MeasureReports. Requested patients that do not exist are
+    listed in one warning OperationOutcome entry."""
+    evidence_by_patient = {}
+    for r in evidence_rows or []:
+        evidence_by_patient.setdefault(r.get('patient_id'), []).append(r)
+    entries = [{'resource': shape_individual_report(ctx, row,
+                                                    evidence_by_patient.get(row['patient_id'])),
+                'search': {'mode': 'match'}}
+               for row in rows]
+    found = {row['patient_id'] for row in rows}
+    missing = [pid for pid in ctx['patient_ids'] if pid not in found]
+    bundle = {'resourceType': 'Bundle', 'type': 'collection',
+              'total': len(entries), 'entry': entries}
+    if missing:
+        entries.append({'resource': _outcome('not-found', 'Patients not found: '
+                                             + ', '.join(f'Patient/{p}' for p in missing),
+                                             severity='warning'),
+                        'search': {'mode': 'outcome'}})
+    return bundle
+
+
+def group_member_ids(group):
+    """Group resource -> ids of its Patient members (other member types ignored)."""
+    ids = []
+    for member in (group or {}).get('member', []):
+        ref = (member.get('entity') or {}).get('reference', '')
+        if ref.startswith('Patient/'):
+            ids.append(ref[len('Patient/'):])
+    return list(dict.fromkeys(ids))
+
+
+def resolve_panel(ctx, group):
+    """Fill ctx['patient_ids'] from a fetched Group (None: not found). Returns None, or
+    (OperationOutcome, http_status) when the panel cannot be evaluated."""
+    if group is None or group.get('resourceType') != 'Group':
+        return _outcome('not-found', f"Group/{ctx['group_id']} not found"), 404
+    ctx['patient_ids'] = group_member_ids(group)
+    if len(ctx['patient_ids']) > MAX_PANEL_SIZE:
+        return _outcome('too-costly', f"Group/{ctx['group_id']} has "
+                                      f"{len(ctx['patient_ids'])} patients, exceeds "
+                                      f'MAX_PANEL_SIZE={MAX_PANEL_SIZE}'), 400
+    return None
+
 
-    # Execute via the SQL-on-FHIR $sqlquery-run operation. The calculation SQL is the
-    # single source of truth held in Aidbox as SQLQuery Library resources
+def fetch_group(group_id):
+    """Group/<id> from Aidbox, or None if it does not exist."""
+    try:
+        return http_pool.request('GET', f"{AIDBOX_URL}/fhir/Group/{group_id}",
+                                 AIDBOX_USER, AIDBOX_PASS, timeout=METADATA_DEADLINE)
+    except urllib.error.HTTPError as e:
+        if e.code in (404, 410):
+            return None
+        raise
+
+
+def iter_subject_list_json(ctx, total, rows):
+    """Yield a subject-list Bundle as JSON text, one entry per row.
+
+    Each MeasureReport is encoded (report_json.IndividualReportEncoder: the
+    measure's invariant fragments spliced with the row's patient and counts) and
+    handed to the socket before the next row is touched, so peak memory stays flat
+    in cohort size and the first bytes go out before the last row is shaped.
+    """
+    encoder = report_json.IndividualReportEncoder(
+        lambda row, evidence_rows: shape_individual_report(ctx, row, evidence_rows))
+    if ctx['links']:  # a page: links instead of the total, as in subject_list_bundle
+        yield ('{"resourceType":"Bundle","type":"collection","link":%s,"entry":['
+               % report_json.dumps(ctx['links']))
+    else:
+        yield '{"resourceType":"Bundle","type":"collection","total":%d,"entry":[' % total
+    sep = ''
+    for row in rows:
+        with metrics.span('build'):
+            entry = encoder.entry(row)
+        yield sep + entry
+        sep = ','
+    yield ']}'
+
+
+NO_DATA_OUTCOME = _outcome('not-found', 'No results. Is measure data loaded?',
+                           severity='information')
+
+
+def _patient_not_found(ctx):
+    return _outcome('not-found', f"Patient/{ctx['patient_id']} not found for "
+                                 f"{ctx['measure_id']}. Is measure data loaded?")
+
+
+def measure_evaluate(body, persist=False):
+    """Handle Measure/\$evaluate-measure. POST persists the MeasureReport, GET does not."""
+    params = body.get('request', {}).get('params', {})
+    ctx, error = parse_evaluate_params(params)
+    if error:
+        return jsonify(error[0]), error[1]
+    payload, status = evaluate(ctx, persist=persist, stream=STREAM_SUBJECT_LIST)
+    rec = ctx['recording']
+    if isinstance(payload, tuple):  # streamed subject-list: (total, rows)
+        total, rows = payload
+        chunks = iter_subject_list_json(ctx, total, rows)
+        resp = Response(metrics.timed_chunks(chunks, rec), mimetype='application/json')
+    else:
+        resp = jsonify(payload)
+        resp.status_code = status
+    # Spans recorded so far: for a streamed Bundle the headers go out before shaping.
+    resp.headers['Server-Timing'] = rec.server_timing()
+    return resp
+
+
+def evaluate(ctx, persist=False, stream=False):
+    """Evaluate one parsed request (see parse_evaluate_params).
+
+    Returns (payload, http_status): payload is the MeasureReport, subject-list Bundle
+    or OperationOutcome -- except that with stream=True a subject-list yields
+    (total, rows) for iter_subject_list_json instead of a built Bundle; its metrics
+    Recording (ctx['recording']) is then finished by whoever streams the rows.
+    """
+    rec = ctx['recording'] = metrics.start(ctx['measure_id'], ctx['report_type'])
+    try:
+        payload, status = _evaluate(ctx, persist, stream)
+    except BaseException:
+        rec.finish(500)
+        raise
+    if stream and isinstance(payload, tuple):
+        rec.detach()
+    else:
+        rec.finish(status)
+    return payload, status
+
+
+def _evaluate(ctx, persist, stream):
+    measure_id, report_type = ctx['measure_id'], ctx['report_type']
+    period_start, period_end = ctx['period_start'], ctx['period_end']
+    patient_id = ctx['patient_id']
+
+    # Fan out the independent upstream calls on the service-owned pool: Measure
+    # metadata, the report's SQLQuery Library run(s) and the reporter Organization
+    # upsert are separate Aidbox round trips, so latency is the slowest of them,
+    # not their sum. Only persistence depends on the built report.
+    #
+    # Execution is via the SQL-on-FHIR $sqlquery-run operation. The calculation SQL is
+    # the single source of truth held in Aidbox as SQLQuery Library resources
     # (<id>-{summary,per-patient,evidence}, installed from the FHIR package); this
     # adapter holds no measure SQL, only the row -> MeasureReport shaping
     # (build_*_report, transport-agnostic).
-    def _err(msg, code, http):
-        return jsonify({'resourceType': 'OperationOutcome',
-                        'issue': [{'severity': 'error', 'code': code, 'diagnostics': msg}]}), http
+    creds = (AIDBOX_URL, AIDBOX_USER, AIDBOX_PASS)
+    meta_future = _submit(fetch_measure_metadata, measure_id)
+    org_future = _submit(_ensure_reporter_org)
+    if ctx['panel']:
+        # Patient panel: ONE run of the panel-scoped Libraries with the ids pushed
+        # down as :subjects, instead of one subject evaluation per patient.
+        if ctx['group_id']:
+            try:
+                error = resolve_panel(ctx, fetch_group(ctx['group_id']))
+            except Exception as e:
+                error = _outcome('exception', f"Group/{ctx['group_id']} lookup failed: {e}"), 500
+            if error:
+                return error
+        if not ctx['patient_ids']:
+            rows_future = evidence_future = None
+        else:
+            rows_future = _submit(sqt.panel_rows, measure_id, ctx['patient_ids'],
+                                  period_start, period_end, *creds)
+            evidence_future = _submit(sqt.panel_evidence_rows, measure_id, ctx['patient_ids'],
+                                      period_start, period_end, *creds)
+    elif report_type == 'individual':
+        # Subject-scoped Libraries: the patient is pushed down into the SQL, so these
+        # are single-patient queries, not cohort runs filtered in Python.
+        rows_future = _submit(sqt.subject_row, measure_id, patient_id,
+                              period_start, period_end, *creds)
+        evidence_future = _submit(sqt.evidence_rows, measure_id, period_start, period_end,
+                                  *creds, patient_id=patient_id)
+    elif report_type == 'subject-list' and ctx['page']:
+        # One keyset page, fetched with an extra row to tell whether a next one exists.
+        page = ctx['page']._replace(count=ctx['page'].count + 1)
+        rows_future = _submit(sqt.page_rows, measure_id, page, period_start, period_end,
+                              *creds)
+    elif report_type == 'subject-list':
+        per_patient = sqt.iter_per_patient_rows if stream else sqt.per_patient_rows
+        rows_future = _submit(per_patient, measure_id, period_start, period_end, *creds)
+    else:
+        rows_future = _submit(sqt.summary_row, measure_id, period_start, period_end, *creds,
+                              shared=ctx['shared_summary'])
+
+    # Measure resource from Aidbox (primary metadata source); a missed deadline is
+    # treated like a failed fetch.
+    measure_meta = ctx['measure_meta'] = _await(meta_future, METADATA_DEADLINE, default=None)
+    error = check_measure_version(ctx, measure_meta)
+    if error:
+        return error
 
     try:
-        if report_type == 'individual':
-            rows = sqt.per_patient_rows(measure_id, period_start, period_end,
-                                        AIDBOX_URL, AIDBOX_USER, AIDBOX_PASS)
-            match = next((r for r in rows if r['patient_id'] == patient_id), None)
-            if match is None:
-                return _err(f'Patient/{patient_id} not found for {measure_id}. '
-                            'Is measure data loaded?', 'not-found', 404)
+        rows = _await(rows_future, SQL_DEADLINE) if rows_future else []
+        # The report references the reporter Organization; let its upsert finish first.
+        _await(org_future, METADATA_DEADLINE, default=None)
+
+        if ctx['panel']:
+            evidence_rows = (_await(evidence_future, SQL_DEADLINE, default=None)
+                             if evidence_future else None)
+            with metrics.phase('shape'):
+                return panel_bundle(ctx, rows, evidence_rows), 200
+
+        elif report_type == 'individual':
+            if rows is None:
+                return _patient_not_found(ctx), 404
             # Evidence rows for this patient (best-effort -- never fail the report)
-            evidence_rows = None
-            ev = sqt.evidence_rows(measure_id, period_start, period_end,
-                                   AIDBOX_URL, AIDBOX_USER, AIDBOX_PASS)
-            if ev is not None:
-                evidence_rows = [e for e in ev if e.get('patient_id') == patient_id]
-            report = build_measure_report(
-                match, measure_info, period_start, period_end, exc_type,
-                evidence_rows=evidence_rows)
-            report = enrich_measure_report(report, measure_id)
-            if persist:
-                try:
-                    report = _persist_resource(report)
-                except Exception as e:
-                    app.logger.warning(f"Failed to persist MeasureReport: {e}")
-            return jsonify(report)
+            evidence_rows = _await(evidence_future, SQL_DEADLINE, default=None)
+            with metrics.phase('shape'):
+                report = shape_individual_report(ctx, rows, evidence_rows)
 
         elif report_type == 'subject-list':
-            rows = sqt.per_patient_rows(measure_id, period_start, period_end,
-                                        AIDBOX_URL, AIDBOX_USER, AIDBOX_PASS)
-            entries = []
-            for row in rows:
-                report = build_measure_report(
-                    row, measure_info, period_start, period_end, exc_type)
-                report = enrich_measure_report(report, measure_id)
-                entries.append({'resource': report, 'search': {'mode': 'match'}})
-            return jsonify({'resourceType': 'Bundle', 'type': 'collection',
-                            'total': len(entries), 'entry': entries})
+            if ctx['page']:
+                rows = paginate(ctx, rows)
+                if stream:
+                    return (len(rows), iter(rows)), 200
+            if stream:
+                return rows, 200
+            with metrics.phase('shape'):
+                return subject_list_bundle(ctx, rows), 200
 
         else:  # summary (population)
-            results = sqt.summary_row(measure_id, period_start, period_end,
-                                      AIDBOX_URL, AIDBOX_USER, AIDBOX_PASS)
-            if not results:
-                return jsonify({'resourceType': 'OperationOutcome',
-                                'issue': [{'severity': 'information', 'code': 'not-found',
-                                           'diagnostics': 'No results. Is measure data loaded?'}]}), 404
-            report = build_summary_report(
-                results, measure_info, period_start, period_end, exc_type)
-            report = enrich_measure_report(report, measure_id)
-            if persist:
-                try:
-                    report = _persist_resource(report)
-                except Exception as e:
-                    app.logger.warning(f"Failed to persist MeasureReport: {e}")
-            return jsonify(report)
+            if not rows:
+                return NO_DATA_OUTCOME, 404
+            with metrics.phase('shape'):
+                report = shape_summary_report(ctx, rows)
     except Exception as e:
-        return _err(f'$sqlquery-run execution error: {e}', 'exception', 500)
+        return _outcome('exception', f'$sqlquery-run execution error: {e}'), 500
+
+    if persist:
+        report = persist_report(report)
+    return report, 200
+
+
+# ---------------------------------------------------------------------------
+# Measure/$evaluate-measure-batch: several measures (or the whole registry) for one
+# period and reportType, evaluated concurrently and returned as one Bundle. Each
+# measure runs through evaluate() on _batch_pool -- a separate pool, since evaluate()
+# itself waits on _upstream_pool; BATCH_PARALLELISM caps measures in flight.
+# ---------------------------------------------------------------------------
+BATCH_PARALLELISM = int(os.environ.get('BATCH_PARALLELISM', 4))
+# A population batch of at least this many measures reads their totals from ONE run of
+# the all-summary Library (every measure's CTEs merged, shared ones evaluated once)
+# instead of one <id>-summary run per measure; 0 disables it.
+BATCH_SHARED_SUMMARY_MIN = int(os.environ.get('BATCH_SHARED_SUMMARY_MIN', 4))
+_batch_pool = ThreadPoolExecutor(max_workers=BATCH_PARALLELISM, thread_name_prefix='batch')
+
+
+def parse_batch_measures(raw):
+    """`measure` of a batch call: comma-separated ids/canonicals, or empty/'all' for the
+    whole registry. Returns the list of per-measure `measure` values."""
+    if not raw or raw == 'all':
+        return sorted(MEASURES)
+    return [m.strip() for m in raw.split(',') if m.strip()]
+
+
+def batch_params(params):
+    """Per-measure params for a batch call; reportType defaults to population. A batch
+    is not paged (its Bundle has no links to carry), so _count / pageToken are dropped."""
+    params = {'reportType': 'population',
+              **{k: v for k, v in params.items() if k not in PAGE_PARAMS}}
+    return [{**params, 'measure': m} for m in parse_batch_measures(params.get('measure'))]
+
+
+def batch_bundle(results):
+    """[(payload, status)] -> collection Bundle: MeasureReports (subject-list Bundles are
+    flattened into their MeasureReports) and an OperationOutcome for each failed measure."""
+    entries = []
+    for payload, status in results:
+        if payload.get('resourceType') == 'Bundle':
+            entries.extend(payload['entry'])
+        elif status >= 400:
+            entries.append({'resource': payload, 'search': {'mode': 'outcome'}})
+        else:
+            entries.append({'resource': payload, 'search': {'mode': 'match'}})
+    return {'resourceType': 'Bundle', 'type': 'collection',
+            'total': len(entries), 'entry': entries}
+
+
+def shared_summary(measure_params):
+    """Whether a batch's population reports should come from the all-summary Library
+    (only the population path reads ctx['shared_summary'])."""
+    return 0 < BATCH_SHARED_SUMMARY_MIN <= len(measure_params)
+
+
+def _evaluate_params(params, persist, shared=False):
+    ctx, error = parse_evaluate_params(params)
+    if error:
+        return error
+    ctx['shared_summary'] = shared
+    return evaluate(ctx, persist=persist)
+
+
+def measure_evaluate_batch(body, persist=False):
+    """Handle Measure/\$evaluate-measure-batch (POST persists each MeasureReport)."""
+    params = batch_params(body.get('request', {}).get('params', {}))
+    shared = shared_summary(params)
+    futures = [_batch_pool.submit(_evaluate_params, p, persist, shared) for p in params]
+    return jsonify(batch_bundle([f.result() for f in futures]))
 
 
 if __name__ == '__main__':
+    if os.environ.get('SERVER_MODE') == 'async':
+        # asyncio serving mode: its own entry point, which imports this module as `app`
+        # (so its state is not duplicated under __main__ and the Flask pools stay idle).
+        async_main = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'async_app.py')
+        os.execv(sys.executable, [sys.executable, async_main])
     port = int(os.environ.get('PORT', 8090))
     print(f'SQL Measure/\$evaluate-measure service starting on port {port}')
     print(f'AIDBOX_URL: {AIDBOX_URL}')
     print(f'REPO_ROOT: {REPO_ROOT}')
     print(f'Measures available: {", ".join(sorted(MEASURES.keys()))}')
+    libraries = _submit(prewarm_library_ids)
+    warmed = prewarm_measure_metadata()
+    print(f'Measure metadata prewarmed: {sum(v is not None for v in warmed.values())}'
+          f'/{len(warmed)}')
+    print(f'Library ids resolved by batch search: {libraries.result()}')
     app.run(host='0.0.0.0', port=port, threaded=True)
@@ -0,0 +1,626 @@
+"""Asyncio serving mode for the Measure/\\$evaluate-measure adapter (SERVER_MODE=async).
+
+The Flask server parks an OS thread on every in-flight request for as long as its
+$sqlquery-run takes (up to SQL_DEADLINE), plus pool threads for the fanned-out
+upstream calls. Here a single event loop multiplexes all of them over non-blocking
+aiohttp client connections, so thousands of concurrent evaluations cost sockets and
+coroutines, not threads.
+
+Only the I/O differs from app.py: request parsing, the version check and the
+row -> MeasureReport shaping (evaluate_measure's build_*_report via app.shape_*) are
+shared, and so are the $sqlquery-run result cache, the Library id cache and the
+cache / snapshot decisions of sqlquery_transport (plan_library_run,
+plan_snapshot_read) -- this module only performs the calls they describe.
+
+Started on its own (python app/async_app.py, or app.py with SERVER_MODE=async, which
+hands over to it); it imports app.py as a module for the shared request logic.
+
+Admission control:
+  ASYNC_MAX_INFLIGHT — evaluations running at once (each holds upstream connections)
+  ASYNC_MAX_QUEUED   — evaluations allowed to wait for a running slot; beyond that the
+                       request is shed with 503 + Retry-After instead of queueing
+                       without bound
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+
+try:
+    from aiohttp import ClientResponseError, ClientSession, ClientTimeout, TCPConnector, web
+except ImportError as e:  # Flask mode does not need it
+    raise ImportError("SERVER_MODE=async requires aiohttp "
+                      "(pip install -r app/requirements.txt)") from e
+
+import app as svc
+import http_pool
+import metrics
+import report_json
+import sqlquery_transport as sqt
+
+ASYNC_MAX_INFLIGHT = int(os.environ.get('ASYNC_MAX_INFLIGHT', 256))
+ASYNC_MAX_QUEUED = int(os.environ.get('ASYNC_MAX_QUEUED', 1024))
+RETRY_AFTER_SECONDS = int(os.environ.get('ASYNC_RETRY_AFTER', 1))
+
+
+class AidboxClient:
+    """Keep-alive aiohttp session to Aidbox, sized like http_pool's connection pool."""
+
+    def __init__(self, base_url, user, password):
+        self.base_url = base_url
+        self._headers = {'Authorization': http_pool.basic_auth(user, password),
+                         'Accept': 'application/json'}
+        self._session: ClientSession | None = None
+
+    async def start(self):
+        connector = TCPConnector(limit=0, limit_per_host=http_pool.POOL_PER_HOST)
+        self._session = ClientSession(connector=connector, headers=self._headers)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def request(self, method, path, payload=None, timeout=30,
+                      accept='application/json', decode=None):
+        """One Aidbox call; returns the decoded JSON body (None for an empty body), or
+        decode(body bytes) for a non-JSON `accept`.
+
+        A >= 400 status raises aiohttp.ClientResponseError. Counted and timed into
+        metrics like http_pool.request."""
+        t0 = time.perf_counter()
+        try:
+            async with self._session.request(
+                    method, self.base_url + path, json=payload, headers={'Accept': accept},
+                    timeout=ClientTimeout(total=timeout)) as resp:
+                data = await resp.read()
+                resp.raise_for_status()
+        except Exception:
+            metrics.record_upstream(path, time.perf_counter() - t0, error=True)
+            raise
+        t1 = time.perf_counter()
+        if decode is not None:
+            rows = decode(data)
+        else:
+            text = data.decode()
+            rows = json.loads(text) if text.strip() else None
+        metrics.record_upstream(path, t1 - t0, time.perf_counter() - t1)
+        return rows
+
+
+class AsyncSingleFlight:
+    """sqlquery_transport.SingleFlight on the event loop: one task per in-flight key,
+    awaited (shielded) by every caller, so a caller's cancellation does not cancel
+    the run the others are waiting on."""
+
+    def __init__(self):
+        self._calls: dict[tuple, asyncio.Future] = {}
+        self.executions = self.coalesced = 0
+
+    async def do(self, key, coro_fn):
+        task = self._calls.get(key)
+        if task is None:
+            self.executions += 1
+            task = self._calls[key] = asyncio.ensure_future(coro_fn())
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved: every waiter may have gone away
+
+    def stats(self):
+        return {'executions': self.executions, 'coalesced': self.coalesced,
+                'in_flight': len(self._calls)}
+
+
+client = AidboxClient(svc.AIDBOX_URL, svc.AIDBOX_USER, svc.AIDBOX_PASS)
+single_flight = AsyncSingleFlight()
+# Coalesces the data version / snapshot build polls: when the poll interval lapses,
+# the coroutines that find it due share one /$sql read instead of each issuing one.
+_polls = AsyncSingleFlight()
+
+
+# --- upstream calls (async I/O around the sqlquery_transport / app decisions) ------
+
+async def resolve_library_ids(variant_ids):
+    """Async sqlquery_transport.resolve_library_ids (one batched url search)."""
+    urls = {f"{sqt.CANONICAL_BASE}/{v}": v for v in variant_ids}
+    t0 = time.perf_counter()
+    bundle = await client.request('GET', sqt.library_batch_search_url('', urls))
+    found = sqt.library_ids_from_bundle(bundle)
+    sqt.record_batch_resolution(urls, found, t0)
+    return len(found)
+
+
+async def prewarm_library_ids():
+    try:
+        return await resolve_library_ids(sqt.library_variant_ids(svc.MEASURES))
+    except Exception as e:
+        svc.app.logger.warning(f"Batched Library resolution failed: {e}")
+        return None
+
+
+async def resolve_library_id(variant_id):
+    rid = sqt.cached_library_id(variant_id)
+    if rid is not None:
+        return rid
+    t0 = time.perf_counter()
+    try:
+        with metrics.span('library-ids'):
+            bundle = await client.request('GET', sqt.library_search_url('', variant_id))
+    except Exception:
+        return variant_id
+    return sqt.record_lookup(variant_id, bundle, t0)
+
+
+async def _poll(sql):
+    try:
+        return await client.request('POST', '/$sql', [sql], timeout=10)
+    except Exception:
+        return None
+
+
+async def data_version():
+    if not sqt.data_version_due():
+        return sqt.last_data_version()
+    return await _polls.do(('data-version',), _read_data_version)
+
+
+async def _read_data_version():
+    return sqt.record_data_version(await _poll(sqt.DATA_VERSION_SQL))
+
+
+async def snapshot_builds():
+    if not sqt.snapshot_builds_due():
+        return sqt.last_snapshot_builds()
+    return await _polls.do(('snapshot-builds',), _read_snapshot_builds)
+
+
+async def _read_snapshot_builds():
+    return sqt.record_snapshot_builds(await _poll(sqt.SNAPSHOT_BUILDS_SQL))
+
+
+async def snapshot_rows(measure_id, period_start, period_end, patient_id=None, page=None):
+    """Async sqlquery_transport.snapshot_rows: None when there is no fresh snapshot."""
+    if not sqt.MEMBERSHIP_SNAPSHOTS:
+        return None
+    version, builds = await asyncio.gather(data_version(), snapshot_builds())
+    read = sqt.plan_snapshot_read(measure_id, period_start, period_end, version, builds,
+                                  patient_id, page)
+    if read is None:
+        return None
+    rows = sqt.cached_rows(read.cache_key)
+    if rows is None:
+        try:
+            with metrics.span('measure-sql'):
+                rows = await client.request('POST', '/$sql', read.query,
+                                            timeout=svc.SQL_DEADLINE)
+        except Exception:
+            return None
+        rows = sqt.store_rows(read.cache_key, sqt.snapshot_membership(rows))
+    return metrics.record_rows(rows)
+
+
+async def run_library(variant_id, period_start, period_end, subject=None):
+    """Async sqlquery_transport.run_library, through the same result cache and with
+    identical concurrent runs coalesced."""
+    with sqt.library_span(variant_id):
+        version = await data_version() if subject is None else None
+        run = sqt.plan_library_run(variant_id, period_start, period_end, subject, version)
+        rows = sqt.cached_rows(run.cache_key)
+        if rows is None:
+            rows = await single_flight.do(
+                run.flight_key,
+                lambda: _run_library(variant_id, period_start, period_end, subject,
+                                     run.cache_key))
+        return metrics.record_rows(rows)
+
+
+async def _run_library(variant_id, period_start, period_end, subject, cache_key):
+    fmt, accept, decode = sqt.library_format(variant_id)
+    body = sqt.sqlquery_run_body(period_start, period_end, subject, fmt)
+    for attempt in (0, 1):
+        lib_id = await resolve_library_id(variant_id)
+        try:
+            rows = await client.request('POST', f"/fhir/Library/{lib_id}/$sqlquery-run",
+                                        body, timeout=svc.SQL_DEADLINE,
+                                        accept=accept, decode=decode)
+            if rows is None:
+                rows = []
+        except ClientResponseError as e:
+            if e.status != 404 or attempt:
+                raise
+            sqt.forget_library_id(variant_id)  # stale id: re-resolve by url and retry once
+            continue
+        break
+    return sqt.store_rows(cache_key, rows)
+
+
+async def raw_per_patient_rows(measure_id, period_start, period_end):
+    rows = await snapshot_rows(measure_id, period_start, period_end)
+    if rows is None:
+        rows = await run_library(f"{measure_id}-per-patient", period_start, period_end)
+    return rows
+
+
+async def page_rows(measure_id, page, period_start, period_end):
+    rows = await snapshot_rows(measure_id, period_start, period_end, page=page)
+    if rows is None:
+        rows = await run_library(f"{measure_id}-per-patient-page", period_start,
+                                 period_end, subject=page)
+    return rows
+
+
+async def summary_rows(measure_id, period_start, period_end, shared=False):
+    """Async sqlquery_transport.summary_row, before summary_from_rows."""
+    if shared:
+        try:
+            rows = sqt.measure_summary_rows(
+                await run_library(sqt.SHARED_SUMMARY_VARIANT, period_start, period_end),
+                measure_id)
+            if rows:
+                return rows
+        except Exception:
+            pass
+    return await run_library(f"{measure_id}-summary", period_start, period_end)
+
+
+async def subject_row(measure_id, patient_id, period_start, period_end):
+    rows = await snapshot_rows(measure_id, period_start, period_end, patient_id=patient_id)
+    if rows is None:
+        rows = await run_library(f"{measure_id}-per-patient-subject", period_start,
+                                 period_end, subject=patient_id)
+    return next(iter(rows), None)
+
+
+async def evidence_rows(measure_id, patient_id, period_start, period_end):
+    try:
+        return await run_library(f"{measure_id}-evidence-subject", period_start, period_end,
+                                 subject=patient_id)
+    except Exception:
+        return None
+
+
+async def panel_rows(measure_id, patient_ids, period_start, period_end):
+    return list(await run_library(f"{measure_id}-per-patient-subjects", period_start,
+                                  period_end, subject=list(patient_ids)))
+
+
+async def panel_evidence_rows(measure_id, patient_ids, period_start, period_end):
+    try:
+        return await run_library(f"{measure_id}-evidence-subjects", period_start, period_end,
+                                 subject=list(patient_ids))
+    except Exception:
+        return None
+
+
+async def fetch_group(group_id):
+    try:
+        return await client.request('GET', f"/fhir/Group/{group_id}",
+                                    timeout=svc.METADATA_DEADLINE)
+    except ClientResponseError as e:
+        if e.status in (404, 410):
+            return None
+        raise
+
+
+async def measure_metadata(measure_id, refresh=False):
+    """Async app.fetch_measure_metadata, through the same TTL/negative cache."""
+    if not refresh:
+        hit, meta = svc.cached_measure_metadata(measure_id)
+        if hit:
+            return meta
+    fhir_id = svc.measure_fhir_id(measure_id)
+    if not fhir_id:
+        return None
+    try:
+        with metrics.span('metadata'):
+            m = await client.request('GET', f"/fhir/Measure/{fhir_id}",
+                                     timeout=svc.METADATA_DEADLINE)
+    except Exception:
+        m = None
+    return svc.store_measure_metadata(measure_id, svc.parse_measure_metadata(m))
+
+
+async def prewarm_measure_metadata(measure_ids=None):
+    """Async app.prewarm_measure_metadata: all fetches concurrently on the loop."""
+    measure_ids = list(measure_ids or svc.MEASURES)
+    metas = await asyncio.gather(*(measure_metadata(mid, refresh=True) for mid in measure_ids))
+    return {mid: (meta or {}).get('version') for mid, meta in zip(measure_ids, metas)}
+
+
+async def ensure_reporter_org():
+    if svc._reporter_org_created:
+        return
+    try:
+        await client.request('PUT', '/fhir/Organization/sql-measure-engine',
+                             svc.REPORTER_ORG, timeout=10)
+        svc._reporter_org_created = True
+    except Exception:
+        pass
+
+
+async def persist_report(report):
+    """Async app.persist_report: write-behind queue (shared with Flask mode), else a
+    direct POST."""
+    try:
+        with metrics.phase('persist'), metrics.span('persist'):
+            return (svc.queue_for_persist(report)
+                    or await client.request('POST', f"/fhir/{report['resourceType']}", report))
+    except Exception as e:
+        svc.app.logger.warning(f"Failed to persist MeasureReport: {e}")
+        return report
+
+
+# --- HTTP-RPC endpoint ---------------------------------------------------------------
+
+_slots = asyncio.Semaphore(ASYNC_MAX_INFLIGHT)
+_waiting = _running = 0
+
+
+def _json(body, status=200, headers=None):
+    # Same encoder as Flask's jsonify (report_json.dumps).
+    return web.json_response(body, status=status, headers=headers, dumps=report_json.dumps)
+
+
+async def handle_operation(request):
+    """Aidbox HTTP-RPC dispatch endpoint (same contract as app.handle_operation)."""
+    global _waiting, _running
+    body = await request.json()
+    operation_id = body.get('operation', {}).get('id', '')
+    if operation_id in ('measure-evaluate', 'measure-evaluate-get'):
+        handler = measure_evaluate
+    elif operation_id in ('measure-evaluate-batch', 'measure-evaluate-batch-get'):
+        handler = measure_evaluate_batch
+    else:
+        return _json(svc._outcome('not-supported', f'Unknown operation: {operation_id}'), 400)
+
+    if _slots.locked() and _waiting >= ASYNC_MAX_QUEUED:
+        return _json(svc._outcome('throttled', 'Too many evaluations in flight; retry later.'),
+                     503, headers={'Retry-After': str(RETRY_AFTER_SECONDS)})
+    _waiting += 1
+    try:
+        await _slots.acquire()
+    finally:
+        _waiting -= 1
+    _running += 1
+    try:
+        # POST persists, GET does not
+        return await handler(request, body, persist=not operation_id.endswith('-get'))
+    finally:
+        _running -= 1
+        _slots.release()
+
+
+async def measure_evaluate(request, body, persist=False):
+    params = body.get('request', {}).get('params', {})
+    ctx, error = svc.parse_evaluate_params(params)
+    if error:
+        return _json(*error)
+    payload, status = await evaluate(ctx, persist=persist, stream=svc.STREAM_SUBJECT_LIST)
+    if isinstance(payload, sqt.MembershipRows):  # streamed subject-list
+        return await _stream_subject_list(request, ctx, payload)
+    return _json(payload, status,
+                 headers={'Server-Timing': ctx['recording'].server_timing()})
+
+
+async def evaluate(ctx, persist=False, stream=False):
+    """Async app.evaluate: (payload, http_status); with stream=True a subject-list
+    yields its per-patient MembershipRows instead of a built Bundle, and its
+    metrics Recording (ctx['recording']) is finished by _stream_subject_list."""
+    rec = ctx['recording'] = metrics.start(ctx['measure_id'], ctx['report_type'])
+    try:
+        payload, status = await _evaluate(ctx, persist, stream)
+    except BaseException:
+        rec.finish(500)
+        raise
+    if stream and isinstance(payload, sqt.MembershipRows):
+        rec.detach()
+    else:
+        rec.finish(status)
+    return payload, status
+
+
+async def _evaluate(ctx, persist, stream):
+    measure_id, report_type = ctx['measure_id'], ctx['report_type']
+    period_start, period_end = ctx['period_start'], ctx['period_end']
+    patient_id = ctx['patient_id']
+
+    # Same fan-out as the Flask path, as tasks on the loop.
+    meta_task = asyncio.ensure_future(measure_metadata(measure_id))
+    org_task = asyncio.ensure_future(ensure_reporter_org())
+    rows_task = evidence_task = None
+    if ctx['panel']:
+        if ctx['group_id']:
+            try:
+                error = svc.resolve_panel(ctx, await fetch_group(ctx['group_id']))
+            except Exception as e:
+                error = svc._outcome('exception',
+                                     f"Group/{ctx['group_id']} lookup failed: {e}"), 500
+            if error:
+                return error
+        if ctx['patient_ids']:
+            rows_task = asyncio.ensure_future(
+                panel_rows(measure_id, ctx['patient_ids'], period_start, period_end))
+            evidence_task = asyncio.ensure_future(
+                panel_evidence_rows(measure_id, ctx['patient_ids'], period_start, period_end))
+    elif report_type == 'individual':
+        rows_task = asyncio.ensure_future(
+            subject_row(measure_id, patient_id, period_start, period_end))
+        evidence_task = asyncio.ensure_future(
+            evidence_rows(measure_id, patient_id, period_start, period_end))
+    elif report_type == 'subject-list' and ctx['page']:
+        page = ctx['page']._replace(count=ctx['page'].count + 1)  # +1: is there a next?
+        rows_task = asyncio.ensure_future(
+            page_rows(measure_id, page, period_start, period_end))
+    elif report_type == 'subject-list':
+        rows_task = asyncio.ensure_future(
+            raw_per_patient_rows(measure_id, period_start, period_end))
+    else:
+        rows_task = asyncio.ensure_future(
+            summary_rows(measure_id, period_start, period_end, ctx['shared_summary']))
+    tasks = [t for t in (meta_task, org_task, rows_task, evidence_task) if t]
+
+    try:
+        measure_meta = ctx['measure_meta'] = await meta_task
+        error = svc.check_measure_version(ctx, measure_meta)
+        if error:
+            return error
+
+        try:
+            rows = await asyncio.wait_for(rows_task, svc.SQL_DEADLINE) if rows_task else []
+            await org_task
+            if ctx['panel']:
+                evidence = await evidence_task if evidence_task else None
+                with metrics.phase('shape'):
+                    return svc.panel_bundle(ctx, rows, evidence), 200
+            elif report_type == 'individual':
+                if rows is None:
+                    return svc._patient_not_found(ctx), 404
+                evidence = await evidence_task
+                with metrics.phase('shape'):
+                    report = svc.shape_individual_report(ctx, rows, evidence)
+            elif report_type == 'subject-list':
+                if ctx['page']:
+                    rows = svc.paginate(ctx, rows)
+                if stream:
+                    return rows, 200
+                with metrics.phase('shape'):
+                    return svc.subject_list_bundle(ctx, rows), 200
+            else:
+                rows = sqt.summary_from_rows(rows)
+                if not rows:
+                    return svc.NO_DATA_OUTCOME, 404
+                with metrics.phase('shape'):
+                    report = svc.shape_summary_report(ctx, rows)
+        except Exception as e:
+            return svc._outcome('exception', f'$sqlquery-run execution error: {e}'), 500
+
+        if persist:
+            report = await persist_report(report)
+        return report, 200
+    finally:
+        for t in tasks:
+            t.cancel()  # no-op for finished tasks; drops work for an early error return
+
+
+async def measure_evaluate_batch(request, body, persist=False):
+    """Async app.measure_evaluate_batch: at most BATCH_PARALLELISM measures in flight."""
+    params = svc.batch_params(body.get('request', {}).get('params', {}))
+    shared = svc.shared_summary(params)
+    cap = asyncio.Semaphore(svc.BATCH_PARALLELISM)
+
+    async def one(measure_params):
+        ctx, error = svc.parse_evaluate_params(measure_params)
+        if error:
+            return error
+        ctx['shared_summary'] = shared
+        async with cap:
+            return await evaluate(ctx, persist=persist)
+
+    results = await asyncio.gather(*(one(p) for p in params))
+    return _json(svc.batch_bundle(results))
+
+
+async def _stream_subject_list(request, ctx, rows):
+    """subject-list Bundle written entry by entry; each write awaits the socket drain,
+    so a slow client throttles shaping instead of letting output pile up in memory."""
+    chunks = metrics.timed_chunks(
+        svc.iter_subject_list_json(ctx, len(rows), iter(rows)),
+        ctx['recording'])
+    try:
+        resp = web.StreamResponse(headers={
+            'Content-Type': 'application/json',
+            'Server-Timing': ctx['recording'].server_timing()})
+        await resp.prepare(request)
+        for chunk in chunks:
+            await resp.write(chunk.encode())
+        await resp.write_eof()
+        return resp
+    finally:
+        chunks.close()  # finishes the Recording even if the client went away
+
+
+async def cache_stats(request):
+    return _json({**sqt.result_cache.stats(), 'single_flight': single_flight.stats(),
+                  'http_pool': http_pool.pool.stats(),
+                  'admission': {'max_inflight': ASYNC_MAX_INFLIGHT,
+                                'max_queued': ASYNC_MAX_QUEUED,
+                                'running': _running, 'waiting': _waiting}})
+
+
+async def cache_invalidate(request):
+    return _json({'invalidated': sqt.invalidate_results(request.query.get('variant'))})
+
+
+async def metadata_cache(request):
+    return _json(svc.metadata_status())
+
+
+async def metadata_refresh(request):
+    measure = request.query.get('measure')
+    if measure and measure not in svc.MEASURES:
+        return _json(svc._outcome('not-found', f'Unknown measure: {measure}'), 404)
+    return _json(await prewarm_measure_metadata([measure] if measure else None))
+
+
+async def persist_stats(request):
+    return _json({'write_behind': svc.PERSIST_WRITE_BEHIND, **svc.persist_queue.stats()})
+
+
+async def library_ids(request):
+    return _json(svc.library_status())
+
+
+async def prometheus_metrics(request):
+    return web.Response(body=metrics.render().encode(),
+                        headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+async def membership_snapshots(request):
+    version, builds = await asyncio.gather(data_version(), snapshot_builds())
+    return _json(sqt.snapshot_status(version, builds))
+
+
+async def _client_ctx(application):
+    await client.start()
+    warmed, resolved = await asyncio.gather(prewarm_measure_metadata(), prewarm_library_ids())
+    print(f'Measure metadata prewarmed: {sum(v is not None for v in warmed.values())}'
+          f'/{len(warmed)}')
+    print(f'Library ids resolved by batch search: {resolved}')
+    yield
+    await client.close()
+
+
+def make_app():
+    application = web.Application()
+    application.cleanup_ctx.append(_client_ctx)
+    application.router.add_post('/', handle_operation)
+    application.router.add_get('/cache', cache_stats)
+    application.router.add_post('/cache/invalidate', cache_invalidate)
+    application.router.add_get('/metadata', metadata_cache)
+    application.router.add_post('/metadata/refresh', metadata_refresh)
+    application.router.add_get('/libraries', library_ids)
+    application.router.add_get('/membership', membership_snapshots)
+    application.router.add_get('/metrics', prometheus_metrics)
+    application.router.add_get('/persist', persist_stats)
+    return application
+
+
+def serve(port):
+    web.run_app(make_app(), host='0.0.0.0', port=port, print=None)
+
+
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 8090))
+    print(f'SQL Measure/$evaluate-measure service (async) starting on port {port}')
+    print(f'AIDBOX_URL: {svc.AIDBOX_URL}')
+    print(f'REPO_ROOT: {svc.REPO_ROOT}')
+    print(f'Measures available: {", ".join(sorted(svc.MEASURES.keys()))}')
+    serve(port)
@@ -29,7 +29,9 @@ import re
 import sys
 import urllib.request
 import base64
+import time
 from datetime import datetime, timezone
+from functools import lru_cache
 
 _FHIR_ID_RE = re.compile(r'^[A-Za-z0-9\-.]{1,64}$')
 
@@ -114,13 +116,52 @@ def parameterize_sql(sql: str, period_start: str, period_end: str) -> str:
     return sql
 
 
+_SUBJ_MARKER_RE = re.compile(r"--\s*\$SUBJ\$\s+(.+?)\s*$", re.MULTILINE)
+
+# Bound subject filters of the SQLQuery Libraries: one patient (:subject), or a panel
+# of patients passed as one comma-separated :subjects string (FHIR ids cannot contain
+# commas) -- `col = ANY(array)` still probes the patient_id indexes, once per member.
+SUBJECT_SQL = ":subject"
+SUBJECTS_SQL = "ANY(string_to_array(:subjects, ','))"
+# One keyset page of the cohort: the first :count patient ids after :after, in
+# patient_id order (the outer FROM of the page-scoped Library is the same subquery).
+PAGE_IDS_SQL = "SELECT id FROM patient_flat WHERE id > :after ORDER BY id LIMIT :count"
+PAGE_SQL = f"ANY(ARRAY({PAGE_IDS_SQL}))"
+
+
+def _subject_sql(subject_param: bool, subjects_param: bool) -> str | None:
+    if subjects_param:
+        return SUBJECTS_SQL
+    return SUBJECT_SQL if subject_param else None
+
+
+def push_down_subject(sql: str, subject_sql: str) -> str:
+    """Substitute the subject push-down markers with a filter on `subject_sql`.
+
+    `subject_sql` is a SQL expression: a quoted literal (`'<pid>'`, the /$sql path),
+    a bound placeholder (`:subject`, the subject-scoped SQLQuery Libraries) or
+    SUBJECTS_SQL (the panel-scoped ones).
+      * `-- $SUBJ$ <col-expr>` -> `AND <col-expr> = <subject_sql>`
+      * `/*$SUBJ_PARAM$*/`     -> `, <subject_sql>` (extra shared_* function arg)
+    """
+    sql = _SUBJ_MARKER_RE.sub(lambda m: f"AND {m.group(1)} = {subject_sql}", sql)
+    return sql.replace("/*$SUBJ_PARAM$*/", f", {subject_sql}")
+
+
 def build_evidence_sql(measure_sql: str, evidence_sql_fragment: str,
-                       patient_id: str | None) -> str | None:
+                       patient_id: str | None,
+                       subject_param: bool = False,
+                       subjects_param: bool = False) -> str | None:
     """Build full evidence SQL by appending evidence CTEs to measure CTEs.
 
     The evidence SQL fragment (03-*-evidence.sql) contains additional CTEs
     and a final SELECT. It must be appended after the last CTE of the
     measure SQL (before the final aggregate SELECT).
+
+    With subject_param=True the subject filter is bound to a `:subject`
+    placeholder instead of a patient_id literal -- the <id>-evidence-subject
+    SQLQuery Library; subjects_param=True binds it to a `:subjects` panel
+    (<id>-evidence-subjects).
     """
     # Find the final SELECT to get CTEs only
     idx = measure_sql.rfind("\nSELECT\n    COUNT(*)")
@@ -137,15 +178,11 @@ def build_evidence_sql(measure_sql: str, evidence_sql_fragment: str,
     # measure CTEs use ix_*_subject indexes instead of scanning the cohort.
     # Without this, evidence SQL is bottlenecked by full-cohort CTE work
     # (CMS165 evidence query took 170s on 97K cohort before this).
-    if patient_id:
-        pid_for_markers = _sanitize_patient_id(patient_id)
-        ctes = re.sub(
-            r"--\s*\$SUBJ\$\s+(.+?)\s*$",
-            lambda m: f"AND {m.group(1)} = '{pid_for_markers}'",
-            ctes,
-            flags=re.MULTILINE,
-        )
-        ctes = ctes.replace("/*$SUBJ_PARAM$*/", f", '{pid_for_markers}'")
+    subject_sql = _subject_sql(subject_param, subjects_param)
+    if not subject_sql and patient_id:
+        subject_sql = f"'{_sanitize_patient_id(patient_id)}'"
+    if subject_sql:
+        ctes = push_down_subject(ctes, subject_sql)
     else:
         ctes = ctes.replace("/*$SUBJ_PARAM$*/", "")
 
@@ -165,8 +202,7 @@ def build_evidence_sql(measure_sql: str, evidence_sql_fragment: str,
     evidence_section_start = len(ctes_joined) + 1
 
     # Filter to single patient if provided
-    if patient_id:
-        pid = _sanitize_patient_id(patient_id)
+    if subject_sql:
         full_sql = full_sql.rstrip().rstrip(";")
         # Add or replace WHERE clause for patient filter
         if "WHERE mr.patient_id" not in full_sql:
@@ -174,7 +210,7 @@ def build_evidence_sql(measure_sql: str, evidence_sql_fragment: str,
             order_idx = full_sql.find("ORDER BY", evidence_section_start)
             if order_idx != -1:
                 full_sql = (full_sql[:order_idx]
-                            + f"WHERE mr.patient_id = '{pid}'\n"
+                            + f"WHERE mr.patient_id = {subject_sql}\n"
                             + full_sql[order_idx:])
         full_sql += ";"
 
@@ -210,13 +246,7 @@ def build_patient_sql(measure_sql: str, patient_id: str | None) -> str:
     if patient_id:
         pid = _sanitize_patient_id(patient_id)
         # Marker-based push-down (no-op when markers absent in measure SQL)
-        ctes = re.sub(
-            r"--\s*\$SUBJ\$\s+(.+?)\s*$",
-            lambda m: f"AND {m.group(1)} = '{pid}'",
-            ctes,
-            flags=re.MULTILINE,
-        )
-        ctes = ctes.replace("/*$SUBJ_PARAM$*/", f", '{pid}'")
+        ctes = push_down_subject(ctes, f"'{pid}'")
         outer_from = (
             f"FROM (SELECT id AS patient_id FROM patient_flat WHERE id = '{pid}') ap"
         )
@@ -307,13 +337,24 @@ LEFT JOIN numerator n ON n.patient_id = ap.patient_id{extra_join};"""
     )
 
 
-def build_per_patient_sql(measure_sql: str) -> str:
+def build_per_patient_sql(measure_sql: str, subject_param: bool = False,
+                          subjects_param: bool = False, page_param: bool = False) -> str:
     """Build per-patient membership SQL: one row per patient with boolean flags
-    (patient_id, in_ip, in_exc, in_num [, in_num_2 ...]). Population mode only.
+    (patient_id, in_ip, in_exc, in_num [, in_num_2 ...]).
 
     Same CTEs and join structure as build_summary_sql, but projected per patient
     instead of aggregated. Packaged (with the MP literals parameterized) as each
     measure's <id>-per-patient SQLQuery Library by build_sqlquery_libraries.py.
+
+    With subject_param=True the push-down markers are bound to a `:subject`
+    placeholder (see push_down_subject) and the outer FROM is restricted to that
+    patient -- the <id>-per-patient-subject Library, which costs index probes for
+    one patient instead of a cohort scan. subjects_param=True does the same for a
+    `:subjects` panel (<id>-per-patient-subjects): one run, cost linear in panel size.
+
+    page_param=True binds them to one keyset page instead (PAGE_SQL: the :count ids
+    after :after) and orders the rows by patient_id -- <id>-per-patient-page, which
+    serves a paged subject-list at the cost of its own rows.
     """
     idx = measure_sql.rfind("\nSELECT\n    COUNT(*)")
     if idx == -1:
@@ -322,7 +363,20 @@ def build_per_patient_sql(measure_sql: str) -> str:
         idx = measure_sql.rfind("\nSELECT")
 
     ctes = measure_sql[:idx]
-    ctes = ctes.replace("/*$SUBJ_PARAM$*/", "")  # population mode
+    subject_sql = _subject_sql(subject_param, subjects_param)
+    order_by = ""
+    if page_param:
+        ctes = push_down_subject(ctes, PAGE_SQL)
+        outer_from = ("FROM (SELECT id AS patient_id FROM patient_flat WHERE id > :after "
+                      "ORDER BY id LIMIT :count) ap")
+        order_by = "\nORDER BY ap.patient_id"
+    elif subject_sql:
+        ctes = push_down_subject(ctes, subject_sql)
+        outer_from = (f"FROM (SELECT id AS patient_id FROM patient_flat "
+                      f"WHERE id = {subject_sql}) ap")
+    else:
+        ctes = ctes.replace("/*$SUBJ_PARAM$*/", "")  # population mode
+        outer_from = "FROM (SELECT id AS patient_id FROM patient_flat) ap"
 
     extra_nums = [i for i in range(2, 10) if f"numerator_{i}" in ctes]
     extra_select = "".join(
@@ -341,13 +395,172 @@ SELECT
     (ip.patient_id IS NOT NULL) AS in_ip,
     (ip.patient_id IS NOT NULL AND de.patient_id IS NOT NULL) AS in_exc,
     (ip.patient_id IS NOT NULL AND de.patient_id IS NULL AND n.patient_id IS NOT NULL) AS in_num{extra_select}
-FROM (SELECT id AS patient_id FROM patient_flat) ap
+{outer_from}
 LEFT JOIN initial_population ip ON ip.patient_id = ap.patient_id
 LEFT JOIN denominator_exclusion de ON de.patient_id = ap.patient_id
-LEFT JOIN numerator n ON n.patient_id = ap.patient_id{extra_join}"""
+LEFT JOIN numerator n ON n.patient_id = ap.patient_id{extra_join}{order_by}"""
     )
 
 
+# ---------------------------------------------------------------------------
+# Shared-CTE "all measures" summary. Every measure SQL recomputes the same building
+# blocks -- the mp CTE, the office-visit qualifying encounters, the shared_*
+# exclusion wrappers -- so running the registry scans encounter_flat and
+# condition_flat once per measure. build_all_summary_sql merges the measures into
+# one statement in which identical CTEs are defined once.
+# ---------------------------------------------------------------------------
+_CTE_START_RE = re.compile(r"(?m)^(?:WITH\s+)?(\w+) AS \(")
+_SQL_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_MP_COLUMN_RE = re.compile(r"(?<![\w.])mp\.(\w+)")
+# The measurement-period columns every measure's mp CTE defines; a measure's own
+# extra columns (lookback starts etc.) keep its mp CTE separate.
+BASE_MP_COLUMNS = frozenset(("mp_start", "mp_end"))
+BASE_MP_SQL = """
+    SELECT
+        '2026-01-01T00:00:00Z'::timestamptz AS mp_start,
+        '2026-12-31T23:59:59Z'::timestamptz AS mp_end
+"""
+
+
+def _close_paren(sql: str, start: int) -> int:
+    """Index of the `)` closing the `(` at sql[start], skipping string literals and
+    comments."""
+    depth, i = 0, start
+    while i < len(sql):
+        c = sql[i]
+        if c == "'":
+            i = sql.index("'", i + 1)
+        elif sql.startswith("--", i):
+            i = sql.find("\n", i)
+            if i == -1:
+                break
+        elif sql.startswith("/*", i):
+            i = sql.index("*/", i) + 1
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    raise ValueError("unbalanced parentheses in measure SQL")
+
+
+def split_ctes(measure_sql: str) -> list[tuple[str, str, str]]:
+    """The measure's CTEs before its final SELECT, in order: (name, body, comment) --
+    body is the SQL inside the CTE's parentheses, comment the comment lines above it."""
+    idx = measure_sql.rfind("\nSELECT\n    COUNT(*)")
+    if idx == -1:
+        idx = measure_sql.rfind("\nSELECT\n    count(*)")
+    if idx == -1:
+        idx = measure_sql.rfind("\nSELECT")
+    ctes = measure_sql[:idx].replace("/*$SUBJ_PARAM$*/", "")  # population mode
+    out, pos = [], 0
+    while True:
+        m = _CTE_START_RE.search(ctes, pos)
+        if m is None:
+            return out
+        end = _close_paren(ctes, m.end() - 1)
+        comment = "\n".join(line for line in ctes[pos:m.start()].splitlines()
+                            if line.strip().startswith("--"))
+        out.append((m.group(1), ctes[m.end():end], comment))
+        pos = end + 1
+
+
+def _normalized(body: str) -> str:
+    return " ".join(_SQL_COMMENT_RE.sub(" ", body).split())
+
+
+def _ref_re(names) -> re.Pattern:
+    return re.compile(r"(?<![\w.])(" + "|".join(sorted(names, key=len, reverse=True))
+                      + r")(?!\w)")
+
+
+def build_all_summary_sql(measure_sqls: dict[str, str]) -> str:
+    """One statement returning one summary row per measure:
+    (measure, ip, den, exc, num, num_2 .. num_N; num_N NULL where a measure has fewer
+    numerators).
+
+    The measures' CTEs are merged into one WITH list. Two CTEs are the same CTE when
+    their SQL (comments and whitespace aside) is identical and the CTEs they read are
+    the same -- so a measure's qualifying encounters matching the same ValueSets as
+    another's, or its shared_* exclusion wrappers, are defined once and referenced by
+    every measure; PostgreSQL materializes a CTE referenced more than once, so each is
+    evaluated once per statement. A body reading only mp.mp_start / mp.mp_end reads
+    the common `mp` even when its measure's mp CTE has more columns.
+
+    Naming: a CTE shared by several measures keeps its name (the first one to claim
+    it; later different CTEs of that name are prefixed), one used by a single measure
+    is prefixed `<measure>_`. The shared_* exclusion wrappers always keep their name --
+    the SQLQuery Library build swaps them for the injected excl-<name> CTEs.
+    Each measure's row is build_summary_sql's projection over its renamed CTEs.
+    """
+    # CTE id -> (name, body, comment, {referenced CTE name: id}), in definition order;
+    # id 0 is the common mp.
+    ids = {_normalized(BASE_MP_SQL): 0}
+    defs = {0: ("mp", BASE_MP_SQL, "", {})}
+    users = {0: set(measure_sqls)}
+    measure_ctes = {}  # measure -> {CTE name: id}
+    for mid, sql in measure_sqls.items():
+        local = {}
+        for name, body, comment in split_ctes(sql):
+            refs = {}
+            if local:
+                for ref in set(_ref_re(local).findall(_SQL_COMMENT_RE.sub(" ", body))):
+                    reads_base_mp = set(_MP_COLUMN_RE.findall(body)) <= BASE_MP_COLUMNS
+                    refs[ref] = 0 if ref == "mp" and reads_base_mp else local[ref]
+            norm = _normalized(body)
+            if refs:
+                norm = _ref_re(refs).sub(lambda m: f"\0{refs[m.group(1)]}\0", norm)
+            cte_id = ids.setdefault(norm, len(ids))
+            defs.setdefault(cte_id, (name, body, comment, refs))
+            for used in (cte_id, *refs.values()):
+                users.setdefault(used, set()).add(mid)
+            local[name] = cte_id
+        measure_ctes[mid] = local
+
+    names, taken = {}, set()
+    for cte_id, (name, body, _, _) in defs.items():
+        shared = len(users[cte_id]) > 1 or f"LATERAL shared_{name}(" in body
+        if not shared or name in taken:
+            name = f"{min(users[cte_id])}_{name}"
+        names[cte_id] = name
+        taken.add(name)
+
+    cte_sql = []
+    for cte_id, (name, body, comment, refs) in defs.items():
+        if refs:
+            body = _ref_re(refs).sub(lambda m: names[refs[m.group(1)]], body)
+        cte_sql.append((f"{comment}\n" if comment else "") + f"{names[cte_id]} AS ({body})")
+    cte_sql.append("all_patients AS (SELECT id AS patient_id FROM patient_flat)")
+
+    num_counts = {mid: [i for i in range(2, 10) if f"numerator_{i}" in ctes]
+                  for mid, ctes in measure_ctes.items()}
+    max_num = max((max(n) for n in num_counts.values() if n), default=1)
+    selects = []
+    for mid, ctes in measure_ctes.items():
+        ref = {name: names[cte_id] for name, cte_id in ctes.items()}
+        extra = "".join(
+            f",\n    SUM(CASE WHEN n{i}.patient_id IS NOT NULL THEN 1 ELSE 0 END) AS num_{i}"
+            if i in num_counts[mid] else f",\n    NULL::bigint AS num_{i}"
+            for i in range(2, max_num + 1))
+        joins = "".join(f"\nLEFT JOIN {ref[f'numerator_{i}']} n{i} "
+                        f"ON n{i}.patient_id = ap.patient_id" for i in num_counts[mid])
+        selects.append(
+            f"""SELECT
+    '{mid}' AS measure,
+    SUM(CASE WHEN ip.patient_id IS NOT NULL THEN 1 ELSE 0 END) AS ip,
+    SUM(CASE WHEN ip.patient_id IS NOT NULL THEN 1 ELSE 0 END) AS den,
+    SUM(CASE WHEN ip.patient_id IS NOT NULL AND de.patient_id IS NOT NULL THEN 1 ELSE 0 END) AS exc,
+    SUM(CASE WHEN ip.patient_id IS NOT NULL AND de.patient_id IS NULL AND n.patient_id IS NOT NULL THEN 1 ELSE 0 END) AS num{extra}
+FROM all_patients ap
+LEFT JOIN {ref['initial_population']} ip ON ip.patient_id = ap.patient_id
+LEFT JOIN {ref['denominator_exclusion']} de ON de.patient_id = ap.patient_id
+LEFT JOIN {ref['numerator']} n ON n.patient_id = ap.patient_id{joins}""")
+    return ("-- All measures, shared CTEs (evaluate_measure.build_all_summary_sql)\n"
+            "WITH " + ",\n\n".join(cte_sql) + "\n" + "\nUNION ALL\n".join(selects) + ";")
+
+
 CQF_CRITERIA_REF = "http://hl7.org/fhir/StructureDefinition/cqf-criteriaReference"
 
 
@@ -418,6 +631,39 @@ def build_evaluated_resources(evidence_rows: list[dict]) -> list[dict]:
     return evaluated
 
 
+MEASURE_POPULATION_SYSTEM = "http://terminology.hl7.org/CodeSystem/measure-population"
+REPORT_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S+00:00"
+# Numerators of the extra groups of multi-rate measures, in group order.
+EXTRA_NUM_KEYS = tuple(f"num_{i}" for i in range(2, 10))
+
+_report_date = (None, "")
+
+
+def report_date() -> str:
+    """Current time as MeasureReport.date (second resolution, formatted once a second)."""
+    global _report_date
+    now = int(time.time())
+    if _report_date[0] != now:
+        _report_date = (now, datetime.fromtimestamp(now, timezone.utc).strftime(REPORT_DATE_FORMAT))
+    return _report_date[1]
+
+
+@lru_cache(maxsize=None)
+def _population_codes(exc_type: str) -> tuple[dict, dict, dict, dict]:
+    """ip / den / exclusion / num population codes of an individual report group.
+
+    Built once per exclusion type and shared by every report, so they must not be
+    mutated.
+    """
+    return tuple(
+        {"coding": [{"system": MEASURE_POPULATION_SYSTEM, "code": code, "display": display}]}
+        for code, display in (("initial-population", "Initial Population"),
+                              ("denominator", "Denominator"),
+                              (exc_type, exc_type.replace("-", " ").title()),
+                              ("numerator", "Numerator"))
+    )
+
+
 def _build_group_entry(ip: int, den: int, exc: int, num: int, exc_type: str) -> dict:
     """Build a single FHIR MeasureReport group entry for an individual report.
 
@@ -426,24 +672,13 @@ def _build_group_entry(ip: int, den: int, exc: int, num: int, exc_type: str) ->
     our designated reference oracle (release.json) and the source of the
     canonical expected MeasureReports in dqm-content-qicore-2025.
     """
+    ip_code, den_code, exc_code, num_code = _population_codes(exc_type)
     return {
         "population": [
-            {
-                "code": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/measure-population", "code": "initial-population", "display": "Initial Population"}]},
-                "count": ip,
-            },
-            {
-                "code": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/measure-population", "code": "denominator", "display": "Denominator"}]},
-                "count": den,
-            },
-            {
-                "code": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/measure-population", "code": exc_type, "display": exc_type.replace("-", " ").title()}]},
-                "count": exc,
-            },
-            {
-                "code": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/measure-population", "code": "numerator", "display": "Numerator"}]},
-                "count": num,
-            },
+            {"code": ip_code, "count": ip},
+            {"code": den_code, "count": den},
+            {"code": exc_code, "count": exc},
+            {"code": num_code, "count": num},
         ],
         "measureScore": {"value": 1.0},
     }
@@ -469,8 +704,7 @@ def build_measure_report(
     groups = [_build_group_entry(ip, den, exc, patient_result["num"], exc_type)]
 
     # Add extra groups for multi-rate measures
-    for i in range(2, 10):
-        num_key = f"num_{i}"
+    for num_key in EXTRA_NUM_KEYS:
         if num_key in patient_result:
             groups.append(_build_group_entry(ip, den, exc, patient_result[num_key], exc_type))
 
@@ -480,7 +714,7 @@ def build_measure_report(
         "type": "individual",
         "measure": measure_info["canonical"],
         "subject": {"reference": f"Patient/{patient_result['patient_id']}"},
-        "date": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00"),
+        "date": report_date(),
         "period": {
             "start": f"{period_start}T00:00:00+00:00",
             "end": f"{period_end}T23:59:59+00:00",
@@ -495,6 +729,84 @@ def build_measure_report(
     return report
 
 
+class MeasureReportTemplate:
+    """Individual MeasureReports of one measure and measurement period.
+
+    Compiled once: a skeleton report is built by build_measure_report and passed
+    through `enrich` (the service's DEQM enrichment -- profile, versioned canonical,
+    reporter, scoring, group ids), and everything that does not depend on the
+    patient is kept. fill() then sets only subject, counts, date and evidence, and
+    returns what enrich(build_measure_report(row, ...)) would. The skeleton has one
+    group per numerator the measure's rows carry (num, num_2 ..), so it is compiled
+    for the first row's numerator keys (per distinct set, should a row differ).
+
+    Each report gets its own copy of the skeleton's nested parts (meta, extension,
+    reporter, period, ...); only the population codes are shared, as in
+    build_measure_report.
+    """
+
+    def __init__(self, measure_info: dict, period_start: str, period_end: str,
+                 exc_type: str = "denominator-exclusion", enrich=None):
+        self._args = (measure_info, period_start, period_end, exc_type)
+        self._enrich = enrich
+        self._codes = _population_codes(exc_type)
+        self._skeletons: dict[tuple[str, ...], tuple[dict, list]] = {}
+
+    def _skeleton(self, num_keys: tuple[str, ...]) -> tuple[dict, list]:
+        """(skeleton report without group, group ids) for rows with `num_keys`."""
+        compiled = self._skeletons.get(num_keys)
+        if compiled is None:
+            row = {"patient_id": "", "ip": 0, "den": 0, "exc": 0, "num": 0,
+                   **dict.fromkeys(num_keys, 0)}
+            skeleton = build_measure_report(row, *self._args)
+            if self._enrich is not None:
+                skeleton = self._enrich(skeleton)
+            group_ids = [g.get("id") for g in skeleton.pop("group")]
+            compiled = self._skeletons[num_keys] = (skeleton, group_ids)
+        return compiled
+
+    def fill(self, patient_result: dict, evidence_rows: list[dict] | None = None) -> dict:
+        ip, den, exc = patient_result["ip"], patient_result["den"], patient_result["exc"]
+        ip_code, den_code, exc_code, num_code = self._codes
+        num_keys = tuple(k for k in EXTRA_NUM_KEYS if k in patient_result)
+        skeleton, group_ids = self._skeleton(num_keys)
+        nums = [patient_result["num"]] + [patient_result[k] for k in num_keys]
+        groups = []
+        for group_id, num in zip(group_ids, nums):
+            group = {
+                "population": [
+                    {"code": ip_code, "count": ip},
+                    {"code": den_code, "count": den},
+                    {"code": exc_code, "count": exc},
+                    {"code": num_code, "count": num},
+                ],
+                "measureScore": {"value": 1.0},
+            }
+            if group_id:
+                group["id"] = group_id
+            groups.append(group)
+
+        report = {k: _copy_json(v) for k, v in skeleton.items()}
+        report["subject"] = {"reference": f"Patient/{patient_result['patient_id']}"}
+        report["date"] = report_date()
+        report["group"] = groups
+        if evidence_rows:
+            evaluated = build_evaluated_resources(evidence_rows)
+            if evaluated:
+                report["evaluatedResource"] = evaluated
+        return report
+
+
+def _copy_json(value):
+    """Copy of a JSON value (dicts and lists copied, scalars shared) -- a cheaper
+    copy.deepcopy for the small nested parts of a template skeleton."""
+    if isinstance(value, dict):
+        return {k: _copy_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(v) for v in value]
+    return value
+
+
 def build_summary_report(
     results: list[dict],
     measure_info: dict,
@@ -543,7 +855,7 @@ def build_summary_report(
         "status": "complete",
         "type": "summary",
         "measure": measure_info["canonical"],
-        "date": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00"),
+        "date": report_date(),
         "period": {
             "start": f"{period_start}T00:00:00+00:00",
             "end": f"{period_end}T23:59:59+00:00",
@@ -0,0 +1,165 @@
+"""Shared keep-alive HTTP connection pool for every Aidbox call the service makes.
+
+urllib.request opens (and for https, handshakes) a fresh connection per call, which
+dominates short single-patient requests under concurrent load. This pool keeps
+idle http.client connections per (scheme, host, port) and reuses them across
+threads:
+
+  * POOL_SIZE     — idle keep-alive connections retained per host
+  * POOL_PER_HOST — connections allowed in flight per host at once; further callers
+                    wait (up to their request timeout) for a free slot
+
+Errors mirror urllib so existing handlers keep working: a >= 400 status raises
+urllib.error.HTTPError (with the body readable via .read()).
+"""
+from __future__ import annotations
+
+import base64
+import http.client
+import io
+import json
+import os
+import threading
+import time
+import urllib.error
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import metrics
+
+POOL_SIZE = int(os.environ.get("AIDBOX_POOL_SIZE", 16))
+POOL_PER_HOST = int(os.environ.get("AIDBOX_POOL_PER_HOST", 32))
+
+# Errors that mean a reused keep-alive connection was closed by the server while
+# idle; the request is retried once on a fresh connection.
+_STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                 ConnectionResetError, BrokenPipeError)
+
+
+@lru_cache(maxsize=16)
+def basic_auth(user: str, password: str) -> str:
+    """Basic auth header value (built once per credential pair)."""
+    return "Basic " + base64.b64encode(f"{user}:{password}".encode()).decode()
+
+
+class Response:
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        text = self.body.decode()
+        return json.loads(text) if text.strip() else None
+
+
+class ConnectionPool:
+    """Thread-safe per-host pool of keep-alive http.client connections."""
+
+    def __init__(self, pool_size=POOL_SIZE, per_host=POOL_PER_HOST):
+        self.pool_size = pool_size
+        self.per_host = per_host
+        self._idle: dict[tuple, list] = {}
+        self._slots: dict[tuple, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self.created = self.reused = 0
+
+    def _slot(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.per_host)
+            return self._slots[key]
+
+    def _checkout(self, key, timeout):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                conn = idle.pop()
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+            self.created += 1
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return cls(host, port, timeout=timeout), False
+
+    def _checkin(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None, timeout=30) -> Response:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname,
+               parts.port or (443 if parts.scheme == "https" else 80))
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        slot = self._slot(key)
+        if not slot.acquire(timeout=timeout):
+            raise TimeoutError(f"no free connection to {parts.netloc} within {timeout}s")
+        try:
+            for attempt in (0, 1):
+                conn, reused = self._checkout(key, timeout)
+                try:
+                    conn.request(method, path, body=body, headers=headers or {})
+                    resp = conn.getresponse()
+                    data = resp.read()
+                except _STALE_ERRORS:
+                    conn.close()
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                except BaseException:
+                    conn.close()
+                    raise
+                if resp.will_close:
+                    conn.close()
+                else:
+                    self._checkin(key, conn)
+                break
+        finally:
+            slot.release()
+        if resp.status >= 400:
+            raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers,
+                                         io.BytesIO(data))
+        return Response(resp.status, resp.headers, data)
+
+    def stats(self):
+        with self._lock:
+            return {"pool_size": self.pool_size, "per_host": self.per_host,
+                    "created": self.created, "reused": self.reused,
+                    "idle": sum(len(v) for v in self._idle.values())}
+
+
+pool = ConnectionPool()
+
+
+def request(method, url, user, password, payload=None, timeout=30,
+            accept="application/json", decode=None):
+    """One Aidbox call through the shared pool; `payload` is JSON-encoded if given.
+
+    Returns the decoded JSON body (None for an empty body), or decode(body bytes) for
+    a non-JSON `accept`. Each call is counted in metrics (and timed into the current
+    evaluation's sql/decode phases)."""
+    headers = {"Authorization": basic_auth(user, password), "Accept": accept}
+    body = None
+    if payload is not None:
+        body = json.dumps(payload).encode()
+        headers["Content-Type"] = "application/json"
+    path = urlsplit(url).path
+    t0 = time.perf_counter()
+    try:
+        resp = pool.request(method, url, body=body, headers=headers, timeout=timeout)
+    except Exception:
+        metrics.record_upstream(path, time.perf_counter() - t0, error=True)
+        raise
+    t1 = time.perf_counter()
+    data = decode(resp.body) if decode is not None else resp.json()
+    metrics.record_upstream(path, t1 - t0, time.perf_counter() - t1)
+    return data
@@ -0,0 +1,378 @@
+"""Prometheus metrics for the evaluate service (GET /metrics, text format 0.0.4).
+
+Kept dependency-free like http_pool: a handful of counters, gauges and histograms
+rendered in the Prometheus text exposition format.
+
+Per-evaluation timings are split into phases, accumulated by a Recording that the
+evaluation installs in a context variable (propagated to the upstream pool's
+threads and to asyncio tasks), so the transport and the shaping code can attribute
+their time without threading a handle through every call:
+
+  * sql     — upstream $sqlquery-run / $sql time (request + response transfer)
+  * decode  — JSON decoding of those responses
+  * shape   — rows -> MeasureReport / Bundle (incl. enrichment)
+  * persist — POST persistence (the enqueue, or the synchronous write)
+
+Phases of calls that run in parallel (membership rows and evidence) add up, so a
+phase can exceed the evaluation's wall time.
+
+The same Recording also collects finer, per-request spans for diagnosing one slow
+request -- returned as a Server-Timing header and, with TRACE_LOG=1, logged as one
+JSON line per evaluation (logger "measure_evaluate.trace", stderr) together with the
+Library ids that were run:
+
+  library-ids, metadata, measure-sql, evidence-sql, build, enrich, persist
+"""
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+PHASES = ("sql", "decode", "shape", "persist")
+SPANS = ("library-ids", "metadata", "measure-sql", "evidence-sql", "build", "enrich",
+         "persist")
+TRACE_LOG = os.environ.get("TRACE_LOG", "0") != "0"
+
+trace_log = logging.getLogger("measure_evaluate.trace")
+if TRACE_LOG:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_log.addHandler(_handler)
+    trace_log.setLevel(logging.INFO)
+    trace_log.propagate = False
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _num(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}"
+                                for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value):
+        with self._lock:
+            counts, total = self._values.get(labels) or ([0] * (len(self.buckets) + 1), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._values[labels] = (counts, total + value)
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        lines = self.header()
+        for k, (counts, total) in items:
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                lines.append(f"{self.name}_bucket"
+                             f"{_labels(self.labelnames, k, [('le', _num(bound))])} {n}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, k)} {_num(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, k)} {counts[-1]}")
+        return lines
+
+
+evaluation_seconds = Histogram(
+    "measure_evaluate_duration_seconds", "Evaluation wall time.",
+    ("measure", "report_type", "status"))
+phase_seconds = Histogram(
+    "measure_evaluate_phase_seconds",
+    "Evaluation time by phase (sql, decode, shape, persist).",
+    ("measure", "report_type", "phase"))
+evaluation_rows = Histogram(
+    "measure_evaluate_rows", "Rows returned by Aidbox per evaluation.",
+    ("measure", "report_type"), buckets=ROW_BUCKETS)
+in_flight = Gauge(
+    "measure_evaluate_in_flight", "Evaluations currently running.", ("report_type",))
+upstream_requests = Counter(
+    "aidbox_upstream_requests_total", "Aidbox calls made, by call type.", ("call",))
+upstream_errors = Counter(
+    "aidbox_upstream_errors_total",
+    "Aidbox calls that failed (HTTP >= 400, timeout or connection error).", ("call",))
+
+_METRICS = [evaluation_seconds, phase_seconds, evaluation_rows, in_flight,
+            upstream_requests, upstream_errors]
+# Callables returning extra exposition lines at scrape time (cache ratios etc.).
+_collectors = []
+
+
+def register_collector(fn):
+    _collectors.append(fn)
+    return fn
+
+
+def scrape_lines(name, kind, help_text, labelname, values):
+    """Exposition lines for a metric read at scrape time from counters kept elsewhere:
+    values {label: number}; None values are skipped."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines += [f'{name}{{{labelname}="{_escape(k)}"}} {_num(v)}'
+              for k, v in sorted(values.items()) if v is not None]
+    return lines
+
+
+def render():
+    lines = []
+    for m in _METRICS:
+        lines += m.render()
+    for fn in _collectors:
+        lines += fn()
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# --- per-evaluation recording --------------------------------------------------------
+
+class Recording:
+    """Phase times, spans, Library ids and row count of one evaluation."""
+
+    def __init__(self, measure, report_type):
+        self.measure = measure
+        self.report_type = report_type
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.spans: dict[str, float] = {}
+        self.libraries: dict[str, str] = {}
+        self.rows = 0
+        self.status = None
+        self.elapsed = None
+        self.t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._token = None
+        self._finished = False
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] += seconds
+
+    def add_span(self, name, seconds):
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def add_rows(self, n):
+        with self._lock:
+            self.rows += n
+
+    def server_timing(self):
+        """Server-Timing header value: the spans recorded so far (ms) and the total."""
+        with self._lock:
+            spans = dict(self.spans)
+        total = self.elapsed if self.elapsed is not None else time.perf_counter() - self.t0
+        parts = [f"{name};dur={spans[name] * 1000:.1f}" for name in SPANS if name in spans]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+    def trace(self):
+        with self._lock:
+            return {"measure": self.measure, "report_type": self.report_type,
+                    "status": self.status, "rows": self.rows,
+                    "total_ms": round((self.elapsed or 0) * 1000, 1),
+                    "spans": {k: round(v * 1000, 1) for k, v in self.spans.items()},
+                    "libraries": dict(self.libraries)}
+
+    def finish(self, status):
+        """Observe the evaluation; only the first call counts."""
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            self.status = status
+            self.elapsed = time.perf_counter() - self.t0
+        labels = (self.measure, self.report_type)
+        evaluation_seconds.observe(*labels, str(status), value=self.elapsed)
+        for name, seconds in self.phases.items():
+            phase_seconds.observe(*labels, name, value=seconds)
+        evaluation_rows.observe(*labels, value=self.rows)
+        in_flight.dec(self.report_type)
+        if TRACE_LOG:
+            trace_log.info(json.dumps(self.trace(), separators=(",", ":")))
+        self.detach()
+
+    def detach(self):
+        """Stop being the current Recording (e.g. before a streamed response, whose
+        remaining phases are recorded explicitly via timed_chunks)."""
+        if self._token is not None:
+            try:
+                _current.reset(self._token)
+            except ValueError:  # already in another context
+                pass
+            self._token = None
+
+
+_current: contextvars.ContextVar[Recording | None] = contextvars.ContextVar(
+    "measure_evaluate_recording", default=None)
+
+
+def start(measure, report_type):
+    """Begin recording an evaluation in the current context; finish() ends it."""
+    rec = Recording(measure, report_type)
+    rec._token = _current.set(rec)
+    in_flight.inc(report_type)
+    return rec
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def phase(name, rec=None):
+    """Attribute the block's time to `name` in rec (default: the current Recording)."""
+    rec = rec or _current.get()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if rec is not None:
+            rec.add(name, time.perf_counter() - t0)
+
+
+@contextmanager
+def span(name, rec=None):
+    """Attribute the block's time to span `name` of rec (default: the current
+    Recording) -- Server-Timing / trace log only, not the histograms."""
+    rec = rec or _current.get()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if rec is not None:
+            rec.add_span(name, time.perf_counter() - t0)
+
+
+def note_library(variant_id, library_id):
+    """Record which Library (runtime id) served a variant in the current evaluation."""
+    rec = _current.get()
+    if rec is not None:
+        with rec._lock:
+            rec.libraries[variant_id] = library_id
+
+
+class timed_chunks:
+    """Pass-through iterator over a streamed response body that times only the
+    production of each chunk (not the socket writes between them) into rec's
+    phase, and finishes rec when exhausted or closed -- close() is what WSGI servers
+    call, also for a body never iterated (an unstarted generator's finally would
+    not run)."""
+
+    def __init__(self, chunks, rec, phase_name="shape", status=200):
+        self._chunks = iter(chunks)
+        self._rec = rec
+        self._phase = phase_name
+        self._status = status
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # The Recording is current again while a chunk is produced, so the spans of
+        # the shaping code (build, enrich) are attributed to it.
+        token = _current.set(self._rec)
+        try:
+            with phase(self._phase, self._rec):
+                return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+        finally:
+            _current.reset(token)
+
+    def close(self):
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+        self._rec.finish(self._status)
+
+
+def upstream_call(path):
+    """Aidbox call type of a request path, for the upstream counters."""
+    if "$sqlquery-run" in path:
+        return "sqlquery-run"
+    if "$sql" in path:
+        return "sql"
+    parts = [p for p in path.split("?", 1)[0].split("/") if p]
+    if "fhir" in parts:
+        rest = parts[parts.index("fhir") + 1:]
+        return rest[0] if rest else "transaction"
+    return parts[-1] if parts else "root"
+
+
+def record_upstream(path, request_seconds, decode_seconds=0.0, error=False):
+    """Count one Aidbox call; $sql / $sqlquery-run time goes to the current
+    Recording's sql and decode phases."""
+    call = upstream_call(path)
+    upstream_requests.inc(call)
+    if error:
+        upstream_errors.inc(call)
+    rec = _current.get()
+    if rec is None or call not in ("sqlquery-run", "sql"):
+        return
+    rec.add("sql", request_seconds)
+    rec.add("decode", decode_seconds)
+
+
+def record_rows(rows):
+    """Count measure rows (a Library run or snapshot read, cached or not) into the
+    current Recording; returns rows."""
+    rec = _current.get()
+    if rec is not None and rows:
+        rec.add_rows(len(rows))
+    return rows
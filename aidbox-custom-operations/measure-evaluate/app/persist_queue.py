@@ -0,0 +1,156 @@
+"""Write-behind persistence of MeasureReports.
+
+A POST $evaluate-measure writes its MeasureReport to /fhir/MeasureReport before
+responding -- a second Aidbox round trip on every evaluation. With write-behind on
+(app.py PERSIST_WRITE_BEHIND=1, off by default) reports are instead given their id up
+front, returned to the client at once, and written by a background worker that drains
+the queue into FHIR transaction Bundles (PUT MeasureReport/<id>, so a retried batch is
+idempotent). A returned report is then not yet stored, and one whose batch keeps
+failing is dropped: see `dropped` / `last_error` in stats().
+
+  * PERSIST_BATCH_SIZE    — reports per transaction Bundle
+  * PERSIST_FLUSH_SECONDS — how long a partial batch waits for more reports
+  * PERSIST_MAX_RETRIES   — retries of a failed batch (exponential backoff) before
+                            its reports are dropped and counted as such
+  * PERSIST_QUEUE_MAX     — queue capacity; submit raises queue.Full beyond it and the
+                            caller writes synchronously instead
+"""
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+PERSIST_BATCH_SIZE = int(os.environ.get("PERSIST_BATCH_SIZE", 50))
+PERSIST_FLUSH_SECONDS = float(os.environ.get("PERSIST_FLUSH_SECONDS", 1))
+PERSIST_MAX_RETRIES = int(os.environ.get("PERSIST_MAX_RETRIES", 5))
+PERSIST_QUEUE_MAX = int(os.environ.get("PERSIST_QUEUE_MAX", 10000))
+RETRY_BACKOFF_MAX = 30.0
+
+log = logging.getLogger(__name__)
+
+
+def transaction_bundle(resources):
+    """Resources (each with an id) -> FHIR transaction Bundle of PUT entries."""
+    return {
+        "resourceType": "Bundle",
+        "type": "transaction",
+        "entry": [{"resource": r,
+                   "request": {"method": "PUT", "url": f"{r['resourceType']}/{r['id']}"}}
+                  for r in resources],
+    }
+
+
+class WriteBehindQueue:
+    """Bounded queue of resources flushed in transaction Bundles by one daemon thread.
+
+    `send(bundle)` performs the actual write and raises on failure."""
+
+    def __init__(self, send, batch_size=PERSIST_BATCH_SIZE,
+                 flush_seconds=PERSIST_FLUSH_SECONDS, max_retries=PERSIST_MAX_RETRIES,
+                 max_depth=PERSIST_QUEUE_MAX):
+        self._send = send
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_retries = max_retries
+        self._queue: queue.Queue = queue.Queue(maxsize=max_depth)
+        self._worker: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.enqueued = self.written = self.batches = 0
+        self.failed_attempts = self.dropped = 0
+        self.last_error = self.last_error_at = None
+
+    def submit(self, resource):
+        """Assign the resource its id (if it has none) and queue it for writing.
+
+        Returns the resource as it will be stored. Raises queue.Full at capacity, with
+        the resource as it was passed in (no id assigned), so the caller's direct write
+        still gets a server-assigned id."""
+        assigned = "id" not in resource
+        if assigned:
+            resource["id"] = str(uuid.uuid4())
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(resource)
+        except queue.Full:
+            if assigned:
+                del resource["id"]
+            raise
+        with self._lock:
+            self.enqueued += 1
+        return resource
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="persist-queue",
+                                                    daemon=True)
+                    self._worker.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        bundle = transaction_bundle(batch)
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._send(bundle)
+            except Exception as e:
+                with self._lock:
+                    self.failed_attempts += 1
+                    self.last_error = str(e)
+                    self.last_error_at = time.time()
+                if attempt < self.max_retries:
+                    time.sleep(min(2 ** attempt, RETRY_BACKOFF_MAX))
+                continue
+            with self._lock:
+                self.written += len(batch)
+                self.batches += 1
+            return
+        with self._lock:
+            self.dropped += len(batch)
+        log.error("Dropped %d MeasureReport(s) after %d failed attempts: %s",
+                  len(batch), self.max_retries + 1, self.last_error)
+
+    def flush(self, timeout=10.0):
+        """Wait (up to `timeout`) until everything queued so far has been handled.
+        Returns True if the queue drained."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {"depth": self._queue.qsize(),
+                    "unfinished": self._queue.unfinished_tasks,
+                    "enqueued": self.enqueued, "written": self.written,
+                    "batches": self.batches, "failed_attempts": self.failed_attempts,
+                    "dropped": self.dropped, "last_error": self.last_error,
+                    "last_error_at": self.last_error_at,
+                    "batch_size": self.batch_size, "flush_seconds": self.flush_seconds}
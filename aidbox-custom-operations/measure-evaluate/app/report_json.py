@@ -0,0 +1,107 @@
+"""JSON encoding of the service's responses.
+
+Every response body goes through dumps(), picked by JSON_ENCODER:
+
+  * stdlib — json with sorted keys and compact separators (byte-for-byte what
+             jsonify produced before); the default
+  * orjson — the optional orjson package (pip install orjson), same key order and
+             separators; non-ASCII characters are emitted as UTF-8 instead of
+             \\u escapes
+
+Individual MeasureReports in a subject-list are mostly the same text over and over:
+population codings, the versioned measure canonical, the period, the DEQM profile,
+reporter and scoring extension differ only by measure, and the group array only by
+the patient's 0/1 population counts. IndividualReportEncoder encodes those parts
+once per evaluation and splices the patient id, report date and (rare) evaluated
+resources into them, instead of building and encoding a nested dict per patient.
+REPORT_FRAGMENTS=0 encodes every report from its dict instead.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+
+from evaluate_measure import build_evaluated_resources, report_date
+
+JSON_ENCODER = os.environ.get("JSON_ENCODER", "stdlib")
+REPORT_FRAGMENTS = os.environ.get("REPORT_FRAGMENTS", "1") != "0"
+# Distinct population-count combinations kept encoded per evaluation (a per-patient
+# cohort has a handful: counts are 0/1).
+MAX_GROUP_FRAGMENTS = 1024
+
+if JSON_ENCODER == "orjson":
+    try:
+        import orjson
+    except ImportError as e:
+        raise ImportError("JSON_ENCODER=orjson requires orjson (pip install orjson)") from e
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS).decode()
+elif JSON_ENCODER == "stdlib":
+    dumps = json.JSONEncoder(sort_keys=True, separators=(",", ":")).encode
+else:
+    raise ValueError(f"JSON_ENCODER must be 'stdlib' or 'orjson', not {JSON_ENCODER!r}")
+
+# Placeholders put into a skeleton report before it is encoded; their encoded form is
+# then replaced by str.format fields.
+_DATE, _GROUP, _EVIDENCE, _PATIENT = "@@date@@", "@@group@@", "@@evidence@@", "@@patient@@"
+_SLOT_RE = re.compile(r'"@@(date|group|evidence)@@"|@@(patient)@@')
+
+
+class IndividualReportEncoder:
+    """Encodes the subject-list entries of one evaluation by splicing.
+
+    shape(row, evidence_rows) is the evaluation's dict path (build + enrich). It is
+    called only to derive the fragments -- once for the skeleton and once per
+    distinct population-count combination -- so entry(row) is always the text of
+    {"resource": shape(row, evidence_rows), "search": {"mode": "match"}}.
+    """
+
+    def __init__(self, shape):
+        self._shape = shape
+        self._skeletons: dict[bool, str] = {}
+        self._groups: dict[tuple, str] = {}
+        self._date = self._date_json = None
+
+    def entry(self, row, evidence_rows=None) -> str:
+        """One encoded Bundle entry for a membership row (+ the patient's evidence)."""
+        if not REPORT_FRAGMENTS:
+            return dumps({"resource": self._shape(row, evidence_rows),
+                          "search": {"mode": "match"}})
+        evaluated = build_evaluated_resources(evidence_rows) if evidence_rows else None
+        skeleton = self._skeletons.get(bool(evaluated))
+        if skeleton is None:
+            skeleton = self._skeleton(row, bool(evaluated))
+        counts = tuple(item for item in row.items() if item[0] != "patient_id")
+        group = self._groups.get(counts)
+        if group is None:
+            group = self._group(row, counts)
+        return skeleton.format(date=self._now(), group=group,
+                               patient=dumps(row["patient_id"])[1:-1],
+                               evidence=dumps(evaluated) if evaluated else "")
+
+    def _skeleton(self, row, with_evidence):
+        report = self._shape({**row, "patient_id": _PATIENT}, None)
+        report["date"] = _DATE
+        report["group"] = _GROUP
+        if with_evidence:
+            report["evaluatedResource"] = _EVIDENCE
+        text = dumps({"resource": report, "search": {"mode": "match"}})
+        skeleton = _SLOT_RE.sub(lambda m: "{%s}" % (m.group(1) or m.group(2)),
+                                text.replace("{", "{{").replace("}", "}}"))
+        self._skeletons[with_evidence] = skeleton
+        return skeleton
+
+    def _group(self, row, counts):
+        group = dumps(self._shape(row, None)["group"])
+        if len(self._groups) < MAX_GROUP_FRAGMENTS:
+            self._groups[counts] = group
+        return group
+
+    def _now(self):
+        # The report date changes once a second; re-encode it only then.
+        date = report_date()
+        if date != self._date:
+            self._date, self._date_json = date, dumps(date)
+        return self._date_json
@@ -8,27 +8,94 @@ evaluate_measure's MeasureReport builders expect -- so the adapter holds NO meas
 SQL, only the transport call + row shaping.
 
 Library -> builder-row mapping:
-  <id>-summary      -> {ip, den, exc, num[, num_2..]}         (one aggregate row)
-  <id>-per-patient  -> {patient_id, in_ip, in_exc, in_num[, in_num_2..]} per patient
-  <id>-evidence     -> decision-chain rows (passed through unchanged)
+  <id>-summary              -> {ip, den, exc, num[, num_2..]}    (one aggregate row)
+  <id>-per-patient          -> {patient_id, in_ip, in_exc, in_num[, in_num_2..]} per patient
+                               (-> {patient_id, ip, den, exc, num[, num_2..]})
+  <id>-per-patient-subject  -> the same row for ONE patient (:subject push-down)
+  <id>-per-patient-subjects -> the rows for a patient panel (:subjects push-down)
+  <id>-per-patient-page     -> one keyset page of the rows, in patient_id order
+                               (:after / :count push-down)
+  <id>-evidence             -> decision-chain rows (passed through unchanged)
+  <id>-evidence-subject     -> the same rows for ONE patient (:subject push-down)
+  <id>-evidence-subjects    -> the same rows for a patient panel (:subjects push-down)
+  all-summary               -> {measure, ip, den, exc, num[, num_2..]} for EVERY measure,
+                               from one statement over the merged measure CTEs
+
+The <id>-per-patient* rows are fetched as CSV and held column-wise (MembershipRows);
+iterating them yields the builder rows {patient_id, ip, den, exc, num[, num_N]}.
+
+Per-patient membership (subject and subject-list reports) is read from a precomputed
+sof.measure_membership snapshot instead, while one built from the current data version
+exists (tools/build_membership.py).
 """
 from __future__ import annotations
-import base64
+import csv
+import io
 import json
-import urllib.request
-
+import os
+import threading
+import time
+import urllib.error
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import NamedTuple
+from urllib.parse import quote
 
-def _auth(user, password):
-    return "Basic " + base64.b64encode(f"{user}:{password}".encode()).decode()
+import http_pool
+import metrics
 
 
-def _truthy(v):
-    return v in (True, "t", "true", 1, "1")
+# Values a membership flag column holds for true (JSON, CSV); True == 1, so 1 too.
+_TRUE = frozenset((True, "t", "true", "1"))
 
 
 # Canonical url base the SQLQuery Libraries declare (build_sqlquery_libraries.py).
 CANONICAL_BASE = "https://health-samurai.io/fhir/Library"
+# Library variants every measure ships (build_sqlquery_libraries.py).
+LIBRARY_VARIANTS = ("summary", "per-patient", "evidence",
+                    "per-patient-subject", "evidence-subject",
+                    "per-patient-subjects", "evidence-subjects",
+                    "per-patient-page")
+# Registry-wide summary Library: one row per measure (build_sqlquery_libraries.py).
+SHARED_SUMMARY_VARIANT = "all-summary"
 _id_by_url: dict[str, str] = {}  # canonical url -> runtime resource id (cache)
+# Held by the id cache's writers and by every resolution_stats update; id reads are
+# single lookups.
+_id_lock = threading.Lock()
+
+# Resolution timings (GET /libraries): the startup batch, cache hits, lazy single
+# lookups, and cache refreshes forced by a $sqlquery-run 404.
+resolution_stats = {"batch_ms": None, "batch_urls": 0, "batch_resolved": 0, "hits": 0,
+                    "lookups": 0, "lookup_ms": 0.0, "refreshes": 0}
+
+
+def library_variant_ids(measure_ids):
+    return [f"{mid}-{v}" for mid in measure_ids for v in LIBRARY_VARIANTS] + [
+        SHARED_SUMMARY_VARIANT]
+
+
+def resolve_library_ids(variant_ids, base_url, user, password, timeout=30):
+    """Resolve many Libraries' runtime ids with ONE search (comma-joined `url` = OR),
+    run at startup so no request pays a lookup. Variants the search does not return
+    keep the <variant_id> fallback (Libraries loaded by PUT under their stable id).
+    Returns the number resolved by search; on failure nothing is cached, and lookups
+    fall back to _resolve_library_id."""
+    urls = {f"{CANONICAL_BASE}/{v}": v for v in variant_ids}
+    t0 = time.perf_counter()
+    bundle = http_pool.request("GET", library_batch_search_url(base_url, urls),
+                               user, password, timeout=timeout)
+    found = library_ids_from_bundle(bundle)
+    record_batch_resolution(urls, found, t0)
+    return len(found)
+
+
+def record_batch_resolution(urls, found, t0):
+    """Cache a batch search result ({url: id}) for `urls` ({url: variant_id})."""
+    with _id_lock:
+        for url, variant_id in urls.items():
+            _id_by_url[url] = found.get(url, variant_id)
+        resolution_stats.update(batch_ms=round((time.perf_counter() - t0) * 1000, 1),
+                                batch_urls=len(urls), batch_resolved=len(found))
 
 
 def _resolve_library_id(variant_id, base_url, user, password, timeout=30):
@@ -36,61 +103,658 @@ def _resolve_library_id(variant_id, base_url, user, password, timeout=30):
 
     A FHIR-package-installed Library is re-keyed to a far-assigned GUID id (the canonical
     `url` is preserved), so it is NOT addressable at Library/<our-id>. We look it up by
-    url via search and cache the result. Falls back to <variant_id> when search finds
-    nothing (e.g. Libraries loaded by PUT under their stable id -- dev/test)."""
-    url = f"{CANONICAL_BASE}/{variant_id}"
-    if url in _id_by_url:
-        return _id_by_url[url]
-    from urllib.parse import quote
-    req = urllib.request.Request(
-        f"{base_url}/fhir/Library?url={quote(url, safe='')}&_elements=id")
-    req.add_header("Authorization", _auth(user, password))
-    req.add_header("Accept", "application/json")
+    url via search and cache the result (normally prefilled by resolve_library_ids).
+    Falls back to <variant_id> when search finds nothing (e.g. Libraries loaded by PUT
+    under their stable id -- dev/test); a failed search is not cached."""
+    rid = cached_library_id(variant_id)
+    if rid is not None:
+        return rid
+    t0 = time.perf_counter()
     try:
-        with urllib.request.urlopen(req, timeout=timeout) as resp:
-            bundle = json.loads(resp.read().decode())
-        entries = bundle.get("entry", [])
-        rid = entries[0]["resource"]["id"] if entries else variant_id
+        with metrics.span("library-ids"):
+            bundle = http_pool.request("GET", library_search_url(base_url, variant_id),
+                                       user, password, timeout=timeout)
     except Exception:
-        rid = variant_id
-    _id_by_url[url] = rid
+        return variant_id
+    return record_lookup(variant_id, bundle, t0)
+
+
+def cached_library_id(variant_id):
+    """The cached runtime id of <variant_id> (counted as a hit), else None."""
+    rid = _id_by_url.get(f"{CANONICAL_BASE}/{variant_id}")
+    if rid is not None:
+        with _id_lock:
+            resolution_stats["hits"] += 1
     return rid
 
 
-def run_library(variant_id, period_start, period_end, base_url, user, password, timeout=120):
-    """Resolve <variant_id> (e.g. 'cms130-summary') to its runtime id via canonical url,
-    then POST /Library/<id>/$sqlquery-run with the MP params. Returns rows (list[dict])."""
-    lib_id = _resolve_library_id(variant_id, base_url, user, password)
-    body = {
+def record_lookup(variant_id, bundle, t0):
+    """Cache the id a single url search (started at t0) found; returns it."""
+    rid = library_id_from_bundle(bundle, variant_id)
+    with _id_lock:
+        _id_by_url[f"{CANONICAL_BASE}/{variant_id}"] = rid
+        resolution_stats["lookups"] += 1
+        resolution_stats["lookup_ms"] += round((time.perf_counter() - t0) * 1000, 1)
+    return rid
+
+
+def forget_library_id(variant_id):
+    """Drop a cached id that Aidbox no longer serves (a $sqlquery-run 404), e.g.
+    after the FHIR package was reinstalled under new ids."""
+    with _id_lock:
+        _id_by_url.pop(f"{CANONICAL_BASE}/{variant_id}", None)
+        resolution_stats["refreshes"] += 1
+
+
+def library_ids():
+    """A copy of the Library id cache ({canonical url: runtime id}), for GET /libraries."""
+    with _id_lock:
+        return dict(_id_by_url)
+
+
+def library_resolution_stats():
+    """A copy of resolution_stats, for GET /libraries and /metrics."""
+    with _id_lock:
+        return dict(resolution_stats)
+
+
+# The pure pieces of a Library run (search url, request body, summary row shape, and
+# below the cache and snapshot decisions) are shared with the asyncio serving mode
+# (async_app.py), which does its own I/O.
+
+def library_search_url(base_url, variant_id):
+    url = f"{CANONICAL_BASE}/{variant_id}"
+    return f"{base_url}/fhir/Library?url={quote(url, safe='')}&_elements=id"
+
+
+def library_id_from_bundle(bundle, variant_id):
+    entries = (bundle or {}).get("entry", [])
+    return entries[0]["resource"]["id"] if entries else variant_id
+
+
+def library_batch_search_url(base_url, urls):
+    # Each url is escaped on its own; the separating commas stay literal (OR).
+    joined = ",".join(quote(u, safe="") for u in urls)
+    return f"{base_url}/fhir/Library?url={joined}&_elements=id,url&_count={len(urls)}"
+
+
+def library_ids_from_bundle(bundle):
+    """Batch search Bundle -> {canonical url: runtime id}."""
+    return {e["resource"]["url"]: e["resource"]["id"]
+            for e in (bundle or {}).get("entry", [])
+            if e.get("resource", {}).get("url")}
+
+
+class Page(NamedTuple):
+    """One keyset page of a cohort: the first `count` patients after patient id
+    `after` ("" for the first page), in patient_id order."""
+    after: str
+    count: int
+
+
+def sqlquery_run_body(period_start, period_end, subject=None, fmt="json"):
+    """$sqlquery-run Parameters: the MP params, plus :subject for the subject-scoped
+    variants (a patient id), :subjects for the panel-scoped ones (a list of ids,
+    sent comma-separated) or :after / :count for the page-scoped one (a Page);
+    `fmt` is the _format of the result."""
+    sql_params = [
+        {"name": "period_start", "valueDate": period_start},
+        {"name": "period_end", "valueDate": period_end},
+    ]
+    if isinstance(subject, Page):
+        sql_params += [{"name": "after", "valueString": subject.after},
+                       {"name": "count", "valueInteger": subject.count}]
+    elif isinstance(subject, (list, tuple)):
+        sql_params.append({"name": "subjects", "valueString": ",".join(subject)})
+    elif subject is not None:
+        sql_params.append({"name": "subject", "valueString": subject})
+    return {
         "resourceType": "Parameters",
         "parameter": [
-            {"name": "_format", "valueCode": "json"},
+            {"name": "_format", "valueCode": fmt},
             {"name": "parameters", "resource": {
                 "resourceType": "Parameters",
-                "parameter": [
-                    {"name": "period_start", "valueDate": period_start},
-                    {"name": "period_end", "valueDate": period_end},
-                ]}},
+                "parameter": sql_params}},
         ],
     }
-    req = urllib.request.Request(
-        f"{base_url}/fhir/Library/{lib_id}/$sqlquery-run",
-        method="POST", data=json.dumps(body).encode())
-    req.add_header("Authorization", _auth(user, password))
-    req.add_header("Content-Type", "application/json")
-    with urllib.request.urlopen(req, timeout=timeout) as resp:
-        b = resp.read().decode()
-        return json.loads(b) if b.strip() else []
 
 
-def summary_row(measure_id, period_start, period_end, base_url, user, password):
+# ---------------------------------------------------------------------------
+# Membership rows. An <id>-per-patient* result is one patient id and three or four
+# booleans per patient; as JSON that is a dict with a string key per column per row,
+# decoded and then normalized into a second dict per row. The membership variants
+# are instead requested as CSV (MEMBERSHIP_FORMAT=json: as JSON rows) and decoded
+# column-wise into MembershipRows -- the patient ids plus one bytearray of 0/1 per
+# flag column, about a byte per patient and flag -- which is also what the result
+# cache holds.
+# ---------------------------------------------------------------------------
+MEMBERSHIP_FORMAT = os.environ.get("MEMBERSHIP_FORMAT", "csv")
+_ACCEPT = {"csv": "text/csv", "json": "application/json"}
+
+
+def _flag_column(values):
+    return bytearray(map(_TRUE.__contains__, values))
+
+
+class MembershipRows:
+    """Columnar <id>-per-patient rows: patient_ids, and flags {in_ip, in_exc, in_num
+    [, in_num_N]: bytearray}. len() is the patient count; iterating yields builder
+    rows {patient_id, ip, den, exc, num[, num_N]} one at a time (den mirrors ip: a
+    patient in the initial population is in the denominator)."""
+
+    __slots__ = ("patient_ids", "flags")
+
+    def __init__(self, patient_ids, flags):
+        self.patient_ids = patient_ids
+        self.flags = flags
+
+    def __len__(self):
+        return len(self.patient_ids)
+
+    def head(self, n):
+        """The first n rows."""
+        return MembershipRows(self.patient_ids[:n],
+                              {k: v[:n] for k, v in self.flags.items()})
+
+    def __iter__(self):
+        if not self.patient_ids:
+            return
+        ip, exc, num = self.flags["in_ip"], self.flags["in_exc"], self.flags["in_num"]
+        extra = [(k[len("in_"):], v) for k, v in self.flags.items() if k.startswith("in_num_")]
+        for i, patient_id in enumerate(self.patient_ids):
+            row = {"patient_id": patient_id, "ip": ip[i], "den": ip[i],
+                   "exc": exc[i], "num": num[i]}
+            for name, column in extra:  # in_num_2 -> num_2
+                row[name] = column[i]
+            yield row
+
+    @classmethod
+    def from_csv(cls, text):
+        header, _, body = text.partition("\n")
+        header = header.rstrip("\r")
+        if not header:
+            return cls([], {})
+        if '"' in text:  # quoted fields: let the csv module parse them
+            rows = list(csv.reader(io.StringIO(body)))
+            cells = [cell for row in rows for cell in row]
+        else:
+            # Ids and booleans need no quoting: all cells, row-major, in one split.
+            cells = body.replace("\r\n", ",").replace("\n", ",").split(",")
+        names = next(csv.reader([header]))
+        width = len(names)
+        count = len(cells) // width
+        columns = {name: cells[i:count * width:width] for i, name in enumerate(names)}
+        return cls(columns.get("patient_id", []),
+                   {k: _flag_column(v) for k, v in columns.items() if k.startswith("in_")})
+
+    @classmethod
+    def from_dicts(cls, rows):
+        """From JSON rows ({patient_id, in_ip, in_exc, in_num[, in_num_N]})."""
+        if not rows:
+            return cls([], {})
+        return cls([r["patient_id"] for r in rows],
+                   {k: _flag_column([r.get(k) for r in rows])
+                    for k in rows[0] if k.startswith("in_")})
+
+
+def decode_membership(body):
+    """A membership $sqlquery-run response body -> MembershipRows. CSV is decoded
+    column-wise; a JSON array (MEMBERSHIP_FORMAT=json, or a server that ignored
+    _format) row-wise."""
+    text = body.decode()
+    if text.lstrip().startswith("["):
+        return MembershipRows.from_dicts(json.loads(text))
+    return MembershipRows.from_csv(text)
+
+
+def library_format(variant_id):
+    """(_format, Accept, body decoder) of a Library variant's $sqlquery-run: the
+    membership variants as MEMBERSHIP_FORMAT into MembershipRows, the rest as JSON."""
+    if "-per-patient" in variant_id:
+        return MEMBERSHIP_FORMAT, _ACCEPT[MEMBERSHIP_FORMAT], decode_membership
+    return "json", _ACCEPT["json"], None
+
+
+# ---------------------------------------------------------------------------
+# Result cache. sof.* only changes when tools/refresh_sof.py (or setup.py)
+# re-materializes it, and both bump the single-row sof.data_version counter
+# (sql/04-data-version.sql). Cohort-level results are cached keyed by
+# (variant id, period_start, period_end, data version): a bump makes every older
+# entry unreachable, and LRU eviction reclaims it.
+# ---------------------------------------------------------------------------
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 256))
+# How often (seconds) the data version is re-read from Aidbox. A refresh becomes
+# visible to the cache at most this long after refresh_sof bumps the version.
+DATA_VERSION_POLL_SECONDS = float(os.environ.get("DATA_VERSION_POLL_SECONDS", 5))
+
+
+class ResultCache:
+    """Size-bounded, thread-safe LRU of $sqlquery-run rows with hit/miss counters."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, rows):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = rows
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, variant_id=None):
+        """Drop every entry, or only those of one Library variant. Returns the count."""
+        with self._lock:
+            if variant_id is None:
+                n = len(self._entries)
+                self._entries.clear()
+                return n
+            stale = [k for k in self._entries if k[0] == variant_id]
+            for k in stale:
+                del self._entries[k]
+            return len(stale)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._entries), "max_size": self.max_size,
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_ratio": round(self.hits / lookups, 4) if lookups else None}
+
+
+class _Call:
+    __slots__ = ("done", "rows", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.rows = self.error = None
+
+
+class SingleFlight:
+    """Coalesces identical concurrent $sqlquery-run executions.
+
+    The first caller with a given (Library, params) key runs it; callers arriving
+    while it is in flight wait for that run and share its rows (or its exception)
+    instead of starting their own -- a dashboard opened in a dozen browsers costs
+    one cohort execution, not twelve. Nothing is kept once the run finishes; reuse
+    across time is the ResultCache's job."""
+
+    def __init__(self):
+        self._calls: dict = {}
+        self._lock = threading.Lock()
+        self.executions = self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.rows
+        try:
+            call.rows = fn()
+            return call.rows
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"executions": self.executions, "coalesced": self.coalesced,
+                    "in_flight": len(self._calls)}
+
+
+result_cache = ResultCache(RESULT_CACHE_SIZE)
+single_flight = SingleFlight()
+_data_version = {"value": None, "read_at": 0.0}
+_data_version_lock = threading.Lock()
+DATA_VERSION_SQL = "SELECT version FROM sof.data_version WHERE id = 1"
+
+
+def data_version_due():
+    """True when the cached data version is older than DATA_VERSION_POLL_SECONDS."""
+    return time.monotonic() - _data_version["read_at"] >= DATA_VERSION_POLL_SECONDS
+
+
+def last_data_version():
+    """The data version as last read (None: unknown)."""
+    return _data_version["value"]
+
+
+def record_data_version(rows):
+    """Store a DATA_VERSION_SQL result (None/[] -> unknown) and return the version."""
+    value = rows[0]["version"] if rows else None
+    _data_version.update(value=value, read_at=time.monotonic())
+    return value
+
+
+def data_version(base_url, user, password, timeout=10):
+    """Current sof.data_version, re-read at most every DATA_VERSION_POLL_SECONDS.
+
+    None when it cannot be read (table missing, Aidbox down): the caller then
+    bypasses the cache, since freshness cannot be established."""
+    with _data_version_lock:
+        if not data_version_due():
+            return last_data_version()
+        try:
+            rows = http_pool.request("POST", f"{base_url}/$sql", user, password,
+                                     payload=[DATA_VERSION_SQL], timeout=timeout)
+        except Exception:
+            rows = None
+        return record_data_version(rows)
+
+
+def invalidate_results(variant_id=None):
+    """Explicitly drop cached results (all, or one Library variant) and force the
+    next lookup to re-read the data version. Returns the number of entries dropped."""
+    with _data_version_lock:
+        _data_version["read_at"] = 0.0
+    return result_cache.invalidate(variant_id)
+
+
+# ---------------------------------------------------------------------------
+# Membership snapshots. tools/build_membership.py precomputes each measure's
+# <id>-per-patient output into sof.measure_membership (sql/05-measure-membership.sql),
+# keyed by (measure, period_start, period_end, patient_id), and records in
+# sof.measure_membership_build the data version each (measure, period) snapshot was
+# built from. While that still equals the current sof.data_version the snapshot is
+# served -- a primary-key probe for a subject, a range scan for a subject-list or one
+# page of it -- instead of running the Library; a stale or missing snapshot falls back
+# to it.
+# ---------------------------------------------------------------------------
+MEMBERSHIP_SNAPSHOTS = os.environ.get("MEMBERSHIP_SNAPSHOTS", "1") != "0"
+SNAPSHOT_BUILDS_SQL = ("SELECT measure, period_start::text AS period_start, "
+                       "period_end::text AS period_end, data_version, built_at, row_count "
+                       "FROM sof.measure_membership_build")
+SNAPSHOT_TABLE = "sof.measure_membership"
+_SNAPSHOT_SELECT = ("SELECT patient_id, in_ip, in_exc, in_num, in_num_extra "
+                    f"FROM {SNAPSHOT_TABLE} "
+                    "WHERE measure = ? AND period_start = ?::date AND period_end = ?::date")
+_snapshot_builds = {"value": {}, "read_at": 0.0}
+_snapshot_builds_lock = threading.Lock()
+snapshot_stats = {"served": 0, "stale": 0, "missing": 0}
+_snapshot_stats_lock = threading.Lock()
+
+
+def snapshot_builds_due():
+    return time.monotonic() - _snapshot_builds["read_at"] >= DATA_VERSION_POLL_SECONDS
+
+
+def last_snapshot_builds():
+    return _snapshot_builds["value"]
+
+
+def record_snapshot_builds(rows):
+    """Store a SNAPSHOT_BUILDS_SQL result as {(measure, start, end): build row}
+    (None -> no snapshots, e.g. the table is missing) and return it."""
+    builds = {(r["measure"], r["period_start"], r["period_end"]): r for r in rows or []}
+    _snapshot_builds.update(value=builds, read_at=time.monotonic())
+    return builds
+
+
+def snapshot_builds(base_url, user, password, timeout=10):
+    """Recorded snapshot builds, re-read at most every DATA_VERSION_POLL_SECONDS."""
+    with _snapshot_builds_lock:
+        if not snapshot_builds_due():
+            return last_snapshot_builds()
+        try:
+            rows = http_pool.request("POST", f"{base_url}/$sql", user, password,
+                                     payload=[SNAPSHOT_BUILDS_SQL], timeout=timeout)
+        except Exception:
+            rows = None
+        return record_snapshot_builds(rows)
+
+
+def snapshot_fresh(builds, measure_id, period_start, period_end, version):
+    """True when (measure, period) has a snapshot built from data `version`."""
+    build = builds.get((measure_id, period_start, period_end))
+    if build is None:
+        outcome = "missing"
+    elif version is None or build["data_version"] != version:
+        outcome = "stale"
+    else:
+        outcome = "served"
+    with _snapshot_stats_lock:
+        snapshot_stats[outcome] += 1
+    return outcome == "served"
+
+
+def snapshot_query(measure_id, period_start, period_end, patient_id=None, page=None):
+    """/$sql payload reading one (measure, period) snapshot, one patient of it, or one
+    keyset page of it (a Page)."""
+    if patient_id is not None:
+        return [_SNAPSHOT_SELECT + " AND patient_id = ?",
+                measure_id, period_start, period_end, patient_id]
+    if page is not None:
+        return [_SNAPSHOT_SELECT + " AND patient_id > ? ORDER BY patient_id LIMIT ?",
+                measure_id, period_start, period_end, page.after, page.count]
+    return [_SNAPSHOT_SELECT + " ORDER BY patient_id", measure_id, period_start, period_end]
+
+
+def snapshot_row(r):
+    """sof.measure_membership row -> the <id>-per-patient Library row shape."""
+    row = {"patient_id": r["patient_id"], "in_ip": r["in_ip"],
+           "in_exc": r["in_exc"], "in_num": r["in_num"]}
+    row.update(r.get("in_num_extra") or {})
+    return row
+
+
+def snapshot_status(version, builds):
+    """GET /membership: recorded builds (with freshness) and serve/fallback counters."""
+    with _snapshot_stats_lock:
+        stats = dict(snapshot_stats)
+    return {"enabled": MEMBERSHIP_SNAPSHOTS, "data_version": version, **stats,
+            "builds": [{**b, "fresh": version is not None and b["data_version"] == version}
+                       for b in builds.values()]}
+
+
+class SnapshotRead(NamedTuple):
+    """How to serve one snapshot read: its ResultCache key (None: not cached) and
+    the /$sql payload that reads it."""
+    cache_key: tuple | None
+    query: list
+
+
+def plan_snapshot_read(measure_id, period_start, period_end, version, builds,
+                       patient_id=None, page=None):
+    """A SnapshotRead when (measure, period) has a snapshot fresh at data `version`,
+    else None (the caller runs the Library). Only the whole cohort is cached."""
+    if not snapshot_fresh(builds, measure_id, period_start, period_end, version):
+        return None
+    metrics.note_library(f"{measure_id}-per-patient", SNAPSHOT_TABLE)
+    cohort = patient_id is None and page is None
+    return SnapshotRead(
+        (f"{measure_id}-membership", period_start, period_end, version) if cohort else None,
+        snapshot_query(measure_id, period_start, period_end, patient_id, page))
+
+
+def snapshot_membership(rows):
+    """A snapshot read's /$sql rows -> MembershipRows."""
+    return MembershipRows.from_dicts([snapshot_row(r) for r in rows or []])
+
+
+def snapshot_rows(measure_id, period_start, period_end, base_url, user, password,
+                  patient_id=None, page=None, timeout=120):
+    """<id>-per-patient rows from a fresh membership snapshot -- the whole cohort, the
+    one patient's row ([] if the patient is not in it) or one Page. None when there is
+    no fresh snapshot (or reading it fails): the caller runs the Library instead."""
+    if not MEMBERSHIP_SNAPSHOTS:
+        return None
+    read = plan_snapshot_read(measure_id, period_start, period_end,
+                              data_version(base_url, user, password),
+                              snapshot_builds(base_url, user, password), patient_id, page)
+    if read is None:
+        return None
+    rows = cached_rows(read.cache_key)
+    if rows is None:
+        try:
+            with metrics.span("measure-sql"):
+                rows = http_pool.request("POST", f"{base_url}/$sql", user, password,
+                                         payload=read.query, timeout=timeout)
+        except Exception:
+            return None
+        rows = store_rows(read.cache_key, snapshot_membership(rows))
+    return metrics.record_rows(rows)
+
+
+@contextmanager
+def library_span(variant_id):
+    """Trace one Library run (cached, coalesced or executed) in the current evaluation:
+    its time as the measure-sql or evidence-sql span, and the runtime Library id."""
+    with metrics.span("evidence-sql" if "-evidence" in variant_id else "measure-sql"):
+        yield
+    metrics.note_library(variant_id,
+                         _id_by_url.get(f"{CANONICAL_BASE}/{variant_id}", variant_id))
+
+
+def flight_key(variant_id, period_start, period_end, subject=None, version=None):
+    """SingleFlight key of one run: the Library and every parameter it is bound to
+    (plus the data version for cohort runs, which is also their cache key)."""
+    if isinstance(subject, (list, tuple)):
+        subject = tuple(subject)
+    return (variant_id, period_start, period_end, subject, version)
+
+
+class LibraryRun(NamedTuple):
+    """How to serve one Library run: its SingleFlight key and its ResultCache key
+    (None: not cached)."""
+    flight_key: tuple
+    cache_key: tuple | None
+
+
+def plan_library_run(variant_id, period_start, period_end, subject=None, version=None):
+    """The LibraryRun of <variant_id>. Only cohort runs (no subject) at a known data
+    `version` are cached; the caller reads the version only for cohort runs."""
+    cached = subject is None and version is not None
+    return LibraryRun(
+        flight_key(variant_id, period_start, period_end, subject, version),
+        (variant_id, period_start, period_end, version) if cached else None)
+
+
+def cached_rows(cache_key):
+    """The cached rows under `cache_key`, else None (always None for an uncached run)."""
+    return None if cache_key is None else result_cache.get(cache_key)
+
+
+def store_rows(cache_key, rows):
+    """Cache `rows` under `cache_key` (unless None) and return them."""
+    if cache_key is not None:
+        result_cache.put(cache_key, rows)
+    return rows
+
+
+def run_library(variant_id, period_start, period_end, base_url, user, password, timeout=120,
+                subject=None):
+    """Run <variant_id> through the result cache (see ResultCache), coalescing
+    identical concurrent runs (see SingleFlight).
+
+    Only cohort-level runs are cached -- summary, per-patient, evidence: those are
+    what dashboards repeat. Subject-scoped runs are single-patient index probes (and
+    panel and page runs a bounded slice) and would only churn the LRU, so they always
+    go upstream.
+    """
+    with library_span(variant_id):
+        return metrics.record_rows(_run_library_cached(
+            variant_id, period_start, period_end, base_url, user, password, timeout, subject))
+
+
+def _run_library_cached(variant_id, period_start, period_end, base_url, user, password,
+                        timeout, subject):
+    version = data_version(base_url, user, password) if subject is None else None
+    run = plan_library_run(variant_id, period_start, period_end, subject, version)
+    rows = cached_rows(run.cache_key)
+    if rows is None:
+        def run_and_cache():
+            return store_rows(run.cache_key, _run_library(
+                variant_id, period_start, period_end, base_url, user, password, timeout,
+                subject))
+        rows = single_flight.do(run.flight_key, run_and_cache)
+    return rows
+
+
+def _run_library(variant_id, period_start, period_end, base_url, user, password, timeout=120,
+                 subject=None):
+    """Resolve <variant_id> (e.g. 'cms130-summary') to its runtime id via canonical url,
+    then POST /Library/<id>/$sqlquery-run with the MP params (+ :subject for the
+    subject-scoped variants). Returns rows: list[dict], or MembershipRows for the
+    <id>-per-patient* variants."""
+    fmt, accept, decode = library_format(variant_id)
+    body = sqlquery_run_body(period_start, period_end, subject, fmt)
+    for attempt in (0, 1):
+        lib_id = _resolve_library_id(variant_id, base_url, user, password)
+        try:
+            rows = http_pool.request("POST", f"{base_url}/fhir/Library/{lib_id}/$sqlquery-run",
+                                     user, password, payload=body, timeout=timeout,
+                                     accept=accept, decode=decode)
+        except urllib.error.HTTPError as e:
+            if e.code != 404 or attempt:
+                raise
+            forget_library_id(variant_id)  # stale id: re-resolve by url and retry once
+            continue
+        return [] if rows is None else rows
+
+
+def summary_row(measure_id, period_start, period_end, base_url, user, password,
+                shared=False):
     """The <id>-summary aggregate row (ip/den/exc/num[/num_N]), as the builders want it.
 
     build_summary_report SUMS a list of rows, so wrapping the single aggregate row in a
     one-element list yields the same totals. Returns [] if no data.
+
+    shared=True reads the measure's row of the all-summary Library instead -- one run
+    (cached and coalesced like any cohort run) serves every measure of a batch -- and
+    falls back to <id>-summary when that fails or has no row for the measure.
     """
-    rows = run_library(f"{measure_id}-summary", period_start, period_end,
-                       base_url, user, password)
+    rows = None
+    if shared:
+        try:
+            rows = measure_summary_rows(
+                run_library(SHARED_SUMMARY_VARIANT, period_start, period_end,
+                            base_url, user, password), measure_id) or None
+        except Exception:
+            rows = None
+    if rows is None:
+        rows = run_library(f"{measure_id}-summary", period_start, period_end,
+                           base_url, user, password)
+    return summary_from_rows(rows)
+
+
+def measure_summary_rows(rows, measure_id):
+    """all-summary rows -> measure_id's row in the <id>-summary shape (a measure with
+    fewer numerators than the widest has NULL num_N columns; they are dropped)."""
+    return [{k: v for k, v in r.items()
+             if k != "measure" and not (v is None and k.startswith("num_"))}
+            for r in rows or [] if r.get("measure") == measure_id]
+
+
+def summary_from_rows(rows):
+    """<id>-summary Library rows -> [builder row] ([] if no data)."""
     if not rows:
         return []
     r = rows[0]
@@ -101,31 +765,87 @@ def summary_row(measure_id, period_start, period_end, base_url, user, password):
     return [out]
 
 
+def raw_per_patient_rows(measure_id, period_start, period_end, base_url, user, password):
+    """<id>-per-patient MembershipRows for the whole cohort: from a fresh membership
+    snapshot when there is one, else by running the Library."""
+    rows = snapshot_rows(measure_id, period_start, period_end, base_url, user, password)
+    if rows is None:
+        rows = run_library(f"{measure_id}-per-patient", period_start, period_end,
+                           base_url, user, password)
+    return rows
+
+
 def per_patient_rows(measure_id, period_start, period_end, base_url, user, password):
-    """<id>-per-patient membership rows normalized to builder shape.
+    """<id>-per-patient membership rows normalized to builder shape (whole cohort)."""
+    return list(raw_per_patient_rows(measure_id, period_start, period_end,
+                                     base_url, user, password))
 
-    Emits {patient_id, ip, den, exc, num[, num_N]} with booleans -> 0/1 ints.
-    den mirrors ip (a patient in the initial population is in the denominator).
-    """
-    rows = run_library(f"{measure_id}-per-patient", period_start, period_end,
-                       base_url, user, password)
-    out = []
-    for r in rows:
-        ip = 1 if _truthy(r["in_ip"]) else 0
-        rec = {"patient_id": r["patient_id"], "ip": ip, "den": ip,
-               "exc": 1 if _truthy(r["in_exc"]) else 0,
-               "num": 1 if _truthy(r["in_num"]) else 0}
-        for k, v in r.items():
-            if k.startswith("in_num_"):  # in_num_2 -> num_2
-                rec[k.replace("in_", "")] = 1 if _truthy(v) else 0
-        out.append(rec)
-    return out
-
-
-def evidence_rows(measure_id, period_start, period_end, base_url, user, password):
-    """<id>-evidence decision-chain rows, passed through unchanged (or None if absent)."""
+
+def iter_per_patient_rows(measure_id, period_start, period_end, base_url, user, password):
+    """Streaming form of per_patient_rows: returns (count, iterator).
+
+    Each builder row is made only as the iterator reaches it, so a consumer that
+    shapes and writes one report at a time never holds a row-wise copy of the cohort
+    next to the columnar one."""
+    rows = raw_per_patient_rows(measure_id, period_start, period_end, base_url, user, password)
+    return len(rows), iter(rows)
+
+
+def page_rows(measure_id, page, period_start, period_end, base_url, user, password):
+    """MembershipRows of one keyset Page of the cohort, in patient_id order: a range
+    read of a fresh membership snapshot, else one run of <id>-per-patient-page with
+    the page pushed down as :after / :count. Either way the cost follows the page
+    size, not the cohort; pages are not cached."""
+    rows = snapshot_rows(measure_id, period_start, period_end, base_url, user, password,
+                         page=page)
+    if rows is None:
+        rows = run_library(f"{measure_id}-per-patient-page", period_start, period_end,
+                           base_url, user, password, subject=page)
+    return rows
+
+
+def subject_row(measure_id, patient_id, period_start, period_end, base_url, user, password):
+    """Membership row for ONE patient via <id>-per-patient-subject, or None if the
+    patient does not exist. The subject is bound as :subject and pushed down into every
+    CTE (and the injected excl-*-subject exclusions), so this costs index probes for one
+    patient rather than a cohort scan. A fresh membership snapshot answers it with a
+    single primary-key probe instead."""
+    rows = snapshot_rows(measure_id, period_start, period_end, base_url, user, password,
+                         patient_id=patient_id)
+    if rows is None:
+        rows = run_library(f"{measure_id}-per-patient-subject", period_start, period_end,
+                           base_url, user, password, subject=patient_id)
+    return next(iter(rows), None)
+
+
+def panel_rows(measure_id, patient_ids, period_start, period_end, base_url, user, password):
+    """Membership rows for a patient panel via <id>-per-patient-subjects: ONE run with
+    the ids pushed down as :subjects, so cost follows the panel size rather than
+    (panel size x cohort). Patients that do not exist have no row."""
+    return list(run_library(f"{measure_id}-per-patient-subjects", period_start, period_end,
+                            base_url, user, password, subject=list(patient_ids)))
+
+
+def panel_evidence_rows(measure_id, patient_ids, period_start, period_end,
+                        base_url, user, password):
+    """<id>-evidence-subjects rows for a patient panel (or None if absent)."""
     try:
-        return run_library(f"{measure_id}-evidence", period_start, period_end,
-                           base_url, user, password)
+        return run_library(f"{measure_id}-evidence-subjects", period_start, period_end,
+                           base_url, user, password, subject=list(patient_ids))
+    except Exception:
+        return None
+
+
+def evidence_rows(measure_id, period_start, period_end, base_url, user, password,
+                  patient_id=None):
+    """<id>-evidence decision-chain rows, passed through unchanged (or None if absent).
+
+    With patient_id, runs <id>-evidence-subject instead: the subject is pushed down
+    into the measure CTEs and the final SELECT, so only that patient's rows are
+    computed (CMS165 evidence without push-down took 170s on a 97K cohort)."""
+    variant = f"{measure_id}-evidence-subject" if patient_id else f"{measure_id}-evidence"
+    try:
+        return run_library(variant, period_start, period_end,
+                           base_url, user, password, subject=patient_id)
     except Exception:
         return None
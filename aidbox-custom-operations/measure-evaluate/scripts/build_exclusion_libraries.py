@@ -2,17 +2,27 @@
 """Generate SQL-on-FHIR SQLQuery Library resources for the shared exclusions.
 
 Parses sqlquery/shared/exclusions.sql (7 named blocks delimited by `-- @@ <name>`)
-and emits one FHIR Library on the SQLQuery profile per block into
-sqlquery/shared/excl-<name>.json.
+and emits four FHIR Libraries on the SQLQuery profile per block into sqlquery/shared/:
+  excl-<name>.json          — population mode (the `-- $SUBJ$` markers stripped)
+  excl-<name>-subject.json  — subject mode (markers bound to a :subject parameter);
+                              injected by the measures' <id>-*-subject Libraries
+  excl-<name>-subjects.json — panel mode (markers bound to a :subjects parameter);
+                              injected by the measures' <id>-*-subjects Libraries
+  excl-<name>-page.json     — page mode (markers bound to the :after / :count keyset
+                              page); injected by the measures' <id>-*-page Libraries
 
 Each exclusion Library:
-  * carries the block SQL base64'd in content.data (+ readable sql-text extension)
+  * reads the period's rows of the materialized sof.shared_exclusion table while its
+    build is current (shared_exclusion_fresh, sql/02-shared-exclusions.sql) and runs
+    the block SQL otherwise -- see read_materialized
+  * carries that SQL base64'd in content.data (+ readable sql-text extension)
   * declares :period_start / :period_end date parameters (bound at $sqlquery-run)
   * declares relatedArtifact depends-on for every flat/terminology ViewDefinition
     the block reads (vd_ label convention, non-colliding — pure lineage metadata)
 
-The block SQL is used verbatim; this module only wraps it into the FHIR Library
-envelope and derives the depends-on lineage. It shares CANONICAL_BASE /
+Apart from the subject markers and the materialized-table branch the block SQL is used
+verbatim; this module only wraps it into the FHIR Library envelope and derives the
+depends-on lineage. It shares CANONICAL_BASE /
 RELATION_TO_VD / vd-label conventions with build_sqlquery_libraries.
 
 Usage:
@@ -25,7 +35,8 @@ import argparse, base64, json, os, re, sys, urllib.request
 REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, os.path.join(REPO_ROOT, "scripts"))
 from build_sqlquery_libraries import (
-    CANONICAL_BASE, RELATION_TO_VD, RELATION_RE, _vd_url_by_id, fhir_put,
+    CANONICAL_BASE, RELATION_TO_VD, RELATION_RE, SCOPE_PARAMETERS, _vd_url_by_id,
+    fhir_put, em,
 )
 
 SHARED_OUT_DIR = os.path.join(REPO_ROOT, "sqlquery", "shared")
@@ -53,6 +64,12 @@ def parse_blocks(sql: str) -> dict:
     return out
 
 
+# A whole `-- $SUBJ$ <col-expr>` marker line. Stripped in population mode rather than
+# left as a comment: a block may end on a marker, and a trailing line comment would
+# swallow the `)` Aidbox closes the injected CTE with.
+SUBJ_MARKER_LINE_RE = re.compile(r"(?m)^[ \t]*--\s*\$SUBJ\$[^\n]*\n?")
+
+
 def depends_on(sql: str, vd_urls: dict) -> list:
     """One depends-on per distinct flat/terminology relation the block reads.
 
@@ -66,8 +83,52 @@ def depends_on(sql: str, vd_urls: dict) -> list:
             for vid in vd_ids]
 
 
-def build_library(name: str, sql: str, vd_urls: dict) -> dict:
-    lib_id = f"excl-{name}"
+SCOPE_SQL = {"subject": em.SUBJECT_SQL, "subjects": em.SUBJECTS_SQL, "page": em.PAGE_SQL}
+
+# The block's final SELECT: the first statement line at column 0 (CTE bodies are
+# indented or parenthesized).
+FINAL_SELECT_RE = re.compile(r"(?m)^SELECT\b")
+FRESH_SQL = "shared_exclusion_fresh((:period_start)::date, (:period_end)::date)"
+
+
+def read_materialized(name: str, sql: str) -> str:
+    """Put a sof.shared_exclusion branch in front of the block's derivation.
+
+    Both branches are gated on FRESH_SQL, a constant for the run, so PostgreSQL
+    executes only one of them (a One-Time Filter); the materialized branch carries its
+    own $SUBJ$ marker, so the scoped variants probe the table's primary key.
+    """
+    m = FINAL_SELECT_RE.search(sql)
+    if m is None:
+        raise SystemExit(f"exclusions.sql block {name}: no final SELECT")
+    ctes, derived = sql[:m.start()], sql[m.start():].rstrip("\n")
+    return f"""{ctes}SELECT x.patient_id
+FROM sof.shared_exclusion x
+WHERE {FRESH_SQL}
+    AND x.name = '{name}'
+    AND x.period_start = (:period_start)::date AND x.period_end = (:period_end)::date
+    -- $SUBJ$ x.patient_id
+UNION ALL
+SELECT d.patient_id FROM (
+{derived}
+) d
+WHERE NOT {FRESH_SQL}"""
+
+
+def build_library(name: str, sql: str, vd_urls: dict, scope: str = "") -> dict:
+    sql = read_materialized(name, sql)
+    if scope:
+        lib_id = f"excl-{name}-{scope}"
+        sql = em.push_down_subject(sql, SCOPE_SQL[scope])
+    else:
+        lib_id = f"excl-{name}"
+        sql = SUBJ_MARKER_LINE_RE.sub("", sql).rstrip("\n")
+    parameters = [
+        {"name": "period_start", "use": "in", "type": "date"},
+        {"name": "period_end", "use": "in", "type": "date"},
+    ]
+    parameters += [{"name": name, "use": "in", "type": type_}
+                   for name, type_ in SCOPE_PARAMETERS.get(scope, ())]
     return {
         "resourceType": "Library",
         "id": lib_id,
@@ -78,10 +139,7 @@ def build_library(name: str, sql: str, vd_urls: dict) -> dict:
         "type": {"coding": [{
             "system": "https://sql-on-fhir.org/ig/CodeSystem/LibraryTypesCodes",
             "code": "sql-query"}]},
-        "parameter": [
-            {"name": "period_start", "use": "in", "type": "date"},
-            {"name": "period_end", "use": "in", "type": "date"},
-        ],
+        "parameter": parameters,
         "relatedArtifact": depends_on(sql, vd_urls),
         "content": [{
             "contentType": "application/sql",
@@ -98,7 +156,12 @@ def generate(vd_urls: dict) -> dict:
     missing = set(EXCLUSIONS) - set(blocks)
     if missing:
         raise SystemExit(f"exclusions.sql missing blocks: {sorted(missing)}")
-    return {name: build_library(name, blocks[name], vd_urls) for name in EXCLUSIONS}
+    out = {}
+    for name in EXCLUSIONS:
+        for scope in ("", "subject", "subjects", "page"):
+            lib = build_library(name, blocks[name], vd_urls, scope=scope)
+            out[lib["id"]] = lib
+    return out
 
 
 def main():
@@ -114,13 +177,13 @@ def main():
     libs = generate(vd_urls)
 
     os.makedirs(SHARED_OUT_DIR, exist_ok=True)
-    for name, lib in libs.items():
-        path = os.path.join(SHARED_OUT_DIR, f"excl-{name}.json")
+    for lib_id, lib in libs.items():
+        path = os.path.join(SHARED_OUT_DIR, f"{lib_id}.json")
         with open(path, "w") as f:
             json.dump(lib, f, indent=2)
             f.write("\n")
         deps = ",".join(a["label"] for a in lib["relatedArtifact"])
-        print(f"  excl-{name:24s} deps=[{deps}]")
+        print(f"  {lib_id:37s} deps=[{deps}]")
         if args.load:
             fhir_put(lib, args.base_url, auth)
     if args.load:
@@ -49,6 +49,14 @@ APP_ENTRY = {
                 "path": ["Measure", "$evaluate-measure"],
                 "method": "GET",
             },
+            "measure-evaluate-batch": {
+                "path": ["Measure", "$evaluate-measure-batch"],
+                "method": "POST",
+            },
+            "measure-evaluate-batch-get": {
+                "path": ["Measure", "$evaluate-measure-batch"],
+                "method": "GET",
+            },
         },
     },
 }
@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
 """Generate SQL-on-FHIR SQLQuery Library resources from the measure SQL.
 
-For each measure this emits three SQLQuery Libraries (FHIR Library resources on the
-SQLQuery profile) into sqlquery/measures/<id>/:
-  <id>-summary.json     — cohort totals + score (build_summary_sql shape)
-  <id>-per-patient.json — one row per patient with membership flags
-  <id>-evidence.json    — per-patient decision chain (when 03-<id>-evidence.sql exists)
+For each measure this emits up to eight SQLQuery Libraries (FHIR Library resources on
+the SQLQuery profile) into sqlquery/measures/<id>/:
+  <id>-summary.json              — cohort totals + score (build_summary_sql shape)
+  <id>-per-patient.json          — one row per patient with membership flags
+  <id>-per-patient-subject.json  — the same row for ONE patient (:subject push-down)
+  <id>-per-patient-subjects.json — the rows for a patient panel (:subjects push-down)
+  <id>-per-patient-page.json     — one keyset page of the rows (:after / :count push-down)
+  <id>-evidence.json             — per-patient decision chain (when 03-<id>-evidence.sql exists)
+  <id>-evidence-subject.json     — the decision chain for ONE patient (:subject push-down)
+  <id>-evidence-subjects.json    — the decision chains for a panel (:subjects push-down)
+
+plus one registry-wide Library into sqlquery/measures/all/:
+  all-summary.json               — every measure's totals from ONE statement, the
+                                   measures' identical CTEs defined once
+                                   (evaluate_measure.build_all_summary_sql)
 
 Each Library:
   * carries the measure SQL base64'd in content.data (+ readable sql-text extension)
-  * declares :period_start / :period_end date parameters (bound at $sqlquery-run)
+  * declares :period_start / :period_end date parameters (bound at $sqlquery-run),
+    plus a :subject string parameter on the subject-scoped variants, a :subjects
+    string (comma-separated patient ids) on the panel-scoped ones, or :after (string)
+    and :count (integer) on the page-scoped one
   * declares relatedArtifact depends-on for every flat/terminology ViewDefinition
     the SQL reads — the lineage graph (measure -> views -> resources). The SQL still
     references the physical relations directly; depends-on is metadata, not routing.
@@ -20,8 +33,9 @@ literals swapped for :period_start / :period_end placeholders — a transport ch
 not a logic change.
 
 Usage:
-  python3 scripts/build_sqlquery_libraries.py                 # all measures -> files
+  python3 scripts/build_sqlquery_libraries.py                 # all measures (+ all-summary)
   python3 scripts/build_sqlquery_libraries.py cms130          # one measure
+  python3 scripts/build_sqlquery_libraries.py all             # all-summary only
   python3 scripts/build_sqlquery_libraries.py --load --base-url http://localhost:8888
 """
 from __future__ import annotations
@@ -151,7 +165,24 @@ def depends_on(sql: str, vd_urls: dict) -> list:
             for vid in vd_ids]
 
 
-def build_library(measure_id: str, variant: str, sql: str, vd_urls: dict) -> dict:
+# Parameters a scoped variant declares on top of the MP dates (see build_library).
+SCOPE_PARAMETERS = {
+    "subject": [("subject", "string")],
+    "subjects": [("subjects", "string")],
+    "page": [("after", "string"), ("count", "integer")],
+}
+
+
+def build_library(measure_id: str, variant: str, sql: str, vd_urls: dict,
+                  scope: str = "") -> dict:
+    """Wrap measure SQL into a SQLQuery Library.
+
+    scope="subject" (or "subjects", "page") marks a subject- (panel-, page-) scoped
+    variant: the SQL filters on the scope's parameters (SCOPE_PARAMETERS; see
+    evaluate_measure.push_down_subject), the Library declares them, and its exclusions
+    come from the excl-<label>-<scope> Libraries so the push-down reaches the injected
+    exclusion CTEs too.
+    """
     lib_id = f"{measure_id}-{variant}"
     param_sql = parameterize(sql)
     if ":period_start" not in param_sql:
@@ -159,12 +190,19 @@ def build_library(measure_id: str, variant: str, sql: str, vd_urls: dict) -> dic
     # Replace inline shared_* exclusion CTEs with depends-on injection: the exclusion
     # SQL now comes from the excl-<label> Library, injected as a CTE named <label>.
     param_sql, excl_labels = rewire_exclusions(param_sql)
+    excl_suffix = f"-{scope}" if scope else ""
     related = depends_on(param_sql, vd_urls) + [
         {"type": "depends-on",
-         "resource": f"{CANONICAL_BASE}/Library/excl-{label}",
+         "resource": f"{CANONICAL_BASE}/Library/excl-{label}{excl_suffix}",
          "label": label}
         for label in excl_labels
     ]
+    parameters = [
+        {"name": "period_start", "use": "in", "type": "date"},
+        {"name": "period_end", "use": "in", "type": "date"},
+    ]
+    parameters += [{"name": name, "use": "in", "type": type_}
+                   for name, type_ in SCOPE_PARAMETERS.get(scope, ())]
     return {
         "resourceType": "Library",
         "id": lib_id,
@@ -175,10 +213,7 @@ def build_library(measure_id: str, variant: str, sql: str, vd_urls: dict) -> dic
         "type": {"coding": [{
             "system": "https://sql-on-fhir.org/ig/CodeSystem/LibraryTypesCodes",
             "code": "sql-query"}]},
-        "parameter": [
-            {"name": "period_start", "use": "in", "type": "date"},
-            {"name": "period_end", "use": "in", "type": "date"},
-        ],
+        "parameter": parameters,
         "relatedArtifact": related,
         "content": [{
             "contentType": "application/sql",
@@ -207,6 +242,18 @@ def generate(measure_id: str, vd_urls: dict) -> dict:
                                  em.build_summary_sql(measure_sql), vd_urls),
         "per-patient": build_library(measure_id, "per-patient",
                                      em.build_per_patient_sql(measure_sql), vd_urls),
+        "per-patient-subject": build_library(
+            measure_id, "per-patient-subject",
+            em.build_per_patient_sql(measure_sql, subject_param=True), vd_urls,
+            scope="subject"),
+        "per-patient-subjects": build_library(
+            measure_id, "per-patient-subjects",
+            em.build_per_patient_sql(measure_sql, subjects_param=True), vd_urls,
+            scope="subjects"),
+        "per-patient-page": build_library(
+            measure_id, "per-patient-page",
+            em.build_per_patient_sql(measure_sql, page_param=True), vd_urls,
+            scope="page"),
     }
     # Third variant: <id>-evidence. Population-mode evidence SQL (measure CTE chain
     # + the 03-*-evidence.sql fragment appended). It goes through the SAME
@@ -218,9 +265,30 @@ def generate(measure_id: str, vd_urls: dict) -> dict:
         if evidence_sql:
             out["evidence"] = build_library(measure_id, "evidence",
                                             evidence_sql, vd_urls)
+        # Subject-scoped evidence: same chain with the subject pushed down, so an
+        # individual report's evaluatedResource is a single-patient query.
+        subject_sql = em.build_evidence_sql(measure_sql, fragment, patient_id=None,
+                                            subject_param=True)
+        if subject_sql:
+            out["evidence-subject"] = build_library(measure_id, "evidence-subject",
+                                                    subject_sql, vd_urls, scope="subject")
+        subjects_sql = em.build_evidence_sql(measure_sql, fragment, patient_id=None,
+                                             subjects_param=True)
+        if subjects_sql:
+            out["evidence-subjects"] = build_library(measure_id, "evidence-subjects",
+                                                     subjects_sql, vd_urls, scope="subjects")
     return out
 
 
+def generate_all(vd_urls: dict) -> dict:
+    """The all-summary Library: one summary row per registry measure, from a single
+    statement over the merged measure CTEs. Its shared_* wrappers are rewired to the
+    excl-<label> Libraries once, however many measures read them."""
+    measure_sqls = {m: open(_measure_sql_path(m)).read() for m in MEASURES}
+    return {"summary": build_library("all", "summary",
+                                     em.build_all_summary_sql(measure_sqls), vd_urls)}
+
+
 def fhir_put(resource: dict, base_url: str, auth: str):
     req = urllib.request.Request(
         f"{base_url}/fhir/Library/{resource['id']}", method="PUT",
@@ -232,7 +300,8 @@ def fhir_put(resource: dict, base_url: str, auth: str):
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("measures", nargs="*", help="measure ids (default: all)")
+    ap.add_argument("measures", nargs="*",
+                    help="measure ids, or `all` for all-summary (default: everything)")
     ap.add_argument("--load", action="store_true", help="PUT the Libraries into Aidbox")
     ap.add_argument("--base-url", default="http://localhost:8888")
     ap.add_argument("--user", default="root")
@@ -241,10 +310,10 @@ def main():
 
     auth = "Basic " + base64.b64encode(f"{args.user}:{args.password}".encode()).decode()
     vd_urls = _vd_url_by_id()
-    targets = args.measures or MEASURES
+    targets = args.measures or MEASURES + ["all"]
 
     for m in targets:
-        libs = generate(m, vd_urls)
+        libs = generate_all(vd_urls) if m == "all" else generate(m, vd_urls)
         out_dir = os.path.join(REPO_ROOT, "sqlquery", "measures", m)
         os.makedirs(out_dir, exist_ok=True)
         for variant, lib in libs.items():
@@ -253,7 +322,7 @@ def main():
                 json.dump(lib, f, indent=2)
                 f.write("\n")
             deps = ",".join(a["label"] for a in lib["relatedArtifact"])
-            print(f"  {m}-{variant:11s} deps=[{deps}]")
+            print(f"  {m}-{variant:20s} deps=[{deps}]")
             if args.load:
                 fhir_put(lib, args.base_url, auth)
         if args.load:
@@ -393,6 +393,15 @@ def main():
     n_ok, n_total = build_normalizers(BASE_URL, f"Basic {auth_header()}", verbose=False)
     print(f"  OK — {n_ok}/{n_total} normalizer nodes")
 
+    # Bump the sof data version last, so the evaluate service drops results it
+    # cached against the previous sof.* contents.
+    execute_sql_file(os.path.join(SCRIPT_DIR, "sql", "04-data-version.sql"), "sof data version")
+    # Membership snapshot tables (empty until tools/build_membership.py fills them;
+    # the service falls back to the SQLQuery Libraries meanwhile).
+    execute_sql_file(os.path.join(SCRIPT_DIR, "sql", "05-measure-membership.sql"), "Membership snapshot tables")
+    # High-water marks for tools/refresh_sof.py --delta (recorded by its full refreshes).
+    execute_sql_file(os.path.join(SCRIPT_DIR, "sql", "06-sof-refresh-marks.sql"), "sof refresh marks")
+
     # Summary
     try:
         patients = run_sql("SELECT COUNT(*) AS n FROM patient")
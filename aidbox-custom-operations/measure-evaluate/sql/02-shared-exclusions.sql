@@ -12,6 +12,16 @@
 --   hospice AS (SELECT h.* FROM mp, LATERAL shared_hospice(mp.mp_start, mp.mp_end, $subject) h),
 --
 -- Prerequisites: shared/sql/01-views.sql (flat views must exist)
+--
+-- Materialized exclusions: tools/build_shared_exclusions.py writes every exclusion's
+-- patient list for a measurement period into sof.shared_exclusion, and records the
+-- build in sof.shared_exclusion_build with the sof.data_version it was built from.
+-- While that version is current, each shared_* function below (and the excl-*
+-- SQLQuery Libraries, see sqlquery/shared/exclusions.sql) reads the period's rows
+-- -- a primary-key range scan, or a probe with p_subject -- and skips the
+-- derivation; otherwise the derivation runs as before. The gate is a constant
+-- for the query, so PostgreSQL evaluates it once (a One-Time Filter) and runs
+-- only one of the two branches.
 
 -- ============================================================
 -- Drop existing functions in reverse-dependency order.
@@ -26,6 +36,75 @@ DROP FUNCTION IF EXISTS shared_advanced_illness(timestamptz, timestamptz);
 DROP FUNCTION IF EXISTS shared_dementia_meds(timestamptz, timestamptz);
 DROP FUNCTION IF EXISTS shared_nursing_home(timestamptz, timestamptz);
 
+-- ============================================================
+-- MATERIALIZED EXCLUSIONS — one row per (exclusion, period, patient)
+-- ============================================================
+CREATE TABLE IF NOT EXISTS sof.shared_exclusion (
+    name         text NOT NULL,  -- hospice, palliative, ... (the shared_ suffix)
+    period_start date NOT NULL,
+    period_end   date NOT NULL,
+    patient_id   text NOT NULL,
+    PRIMARY KEY (name, period_start, period_end, patient_id)
+);
+
+CREATE TABLE IF NOT EXISTS sof.shared_exclusion_build (
+    period_start date        NOT NULL,
+    period_end   date        NOT NULL,
+    data_version bigint      NOT NULL,
+    built_at     timestamptz NOT NULL DEFAULT now(),
+    row_count    bigint,     -- NULL while the build's transaction is running
+    PRIMARY KEY (period_start, period_end)
+);
+
+-- Is the period's build complete and current? PL/pgSQL so that this file can be
+-- applied before sql/04-data-version.sql creates sof.data_version (false until then).
+CREATE OR REPLACE FUNCTION shared_exclusion_fresh(
+    p_period_start date,
+    p_period_end date
+)
+RETURNS boolean AS $$
+BEGIN
+    RETURN EXISTS (
+        SELECT 1
+        FROM sof.shared_exclusion_build b
+        JOIN sof.data_version v ON v.id = 1 AND v.version = b.data_version
+        WHERE b.period_start = p_period_start AND b.period_end = p_period_end
+            AND b.row_count IS NOT NULL);
+EXCEPTION WHEN undefined_table THEN
+    RETURN false;
+END
+$$ LANGUAGE plpgsql STABLE;
+
+-- The same for a function's MP bounds. Builds cover whole days (00:00:00Z to
+-- 23:59:59Z, as the measures' mp CTEs), so other bounds never match one.
+CREATE OR REPLACE FUNCTION shared_exclusion_mp_fresh(
+    p_mp_start timestamptz,
+    p_mp_end timestamptz
+)
+RETURNS boolean AS $$
+    SELECT p_mp_start = (p_mp_start AT TIME ZONE 'UTC')::date::timestamp AT TIME ZONE 'UTC'
+        AND p_mp_end = ((p_mp_end AT TIME ZONE 'UTC')::date + time '23:59:59') AT TIME ZONE 'UTC'
+        AND shared_exclusion_fresh((p_mp_start AT TIME ZONE 'UTC')::date,
+                                   (p_mp_end AT TIME ZONE 'UTC')::date)
+$$ LANGUAGE sql STABLE;
+
+-- One exclusion's materialized rows for an MP (none unless the build is fresh).
+CREATE OR REPLACE FUNCTION shared_exclusion_rows(
+    p_name text,
+    p_mp_start timestamptz,
+    p_mp_end timestamptz,
+    p_subject text DEFAULT NULL
+)
+RETURNS TABLE(patient_id text) AS $$
+    SELECT x.patient_id
+    FROM sof.shared_exclusion x
+    WHERE shared_exclusion_mp_fresh(p_mp_start, p_mp_end)
+        AND x.name = p_name
+        AND x.period_start = (p_mp_start AT TIME ZONE 'UTC')::date
+        AND x.period_end = (p_mp_end AT TIME ZONE 'UTC')::date
+        AND (p_subject IS NULL OR x.patient_id = p_subject)
+$$ LANGUAGE sql STABLE;
+
 -- ============================================================
 -- HOSPICE (6 sub-checks) — used by 9 measures
 -- ============================================================
@@ -35,6 +114,8 @@ CREATE OR REPLACE FUNCTION shared_hospice(
     p_subject text DEFAULT NULL
 )
 RETURNS TABLE(patient_id text) AS $$
+  SELECT patient_id FROM shared_exclusion_rows('hospice', p_mp_start, p_mp_end, p_subject)
+  UNION ALL
   SELECT DISTINCT patient_id FROM (
     -- Inpatient discharge to hospice
     SELECT e.patient_id
@@ -99,6 +180,7 @@ RETURNS TABLE(patient_id text) AS $$
         AND (c.abatement_date IS NULL OR c.abatement_date >= p_mp_start)
         AND (p_subject IS NULL OR c.patient_id = p_subject)
   ) sub
+  WHERE NOT shared_exclusion_mp_fresh(p_mp_start, p_mp_end)
 $$ LANGUAGE sql STABLE;
 
 -- ============================================================
@@ -110,6 +192,8 @@ CREATE OR REPLACE FUNCTION shared_palliative(
     p_subject text DEFAULT NULL
 )
 RETURNS TABLE(patient_id text) AS $$
+  SELECT patient_id FROM shared_exclusion_rows('palliative', p_mp_start, p_mp_end, p_subject)
+  UNION ALL
   SELECT DISTINCT patient_id FROM (
     -- Palliative observation (LOINC 71007-9)
     SELECT o.patient_id
@@ -151,6 +235,7 @@ RETURNS TABLE(patient_id text) AS $$
         AND (pr.performed_end IS NULL OR pr.performed_end >= p_mp_start)
         AND (p_subject IS NULL OR pr.patient_id = p_subject)
   ) sub
+  WHERE NOT shared_exclusion_mp_fresh(p_mp_start, p_mp_end)
 $$ LANGUAGE sql STABLE;
 
 -- ============================================================
@@ -162,6 +247,8 @@ CREATE OR REPLACE FUNCTION shared_has_frailty(
     p_subject text DEFAULT NULL
 )
 RETURNS TABLE(patient_id text) AS $$
+  SELECT patient_id FROM shared_exclusion_rows('has_frailty', p_mp_start, p_mp_end, p_subject)
+  UNION ALL
   SELECT DISTINCT patient_id FROM (
     -- Frailty Device (DeviceRequest)
     SELECT dr.patient_id
@@ -213,6 +300,7 @@ RETURNS TABLE(patient_id text) AS $$
         AND o.effective_end >= p_mp_start AND o.effective_end <= p_mp_end
         AND (p_subject IS NULL OR o.patient_id = p_subject)
   ) sub
+  WHERE NOT shared_exclusion_mp_fresh(p_mp_start, p_mp_end)
 $$ LANGUAGE sql STABLE;
 
 -- ============================================================
@@ -224,6 +312,8 @@ CREATE OR REPLACE FUNCTION shared_advanced_illness(
     p_subject text DEFAULT NULL
 )
 RETURNS TABLE(patient_id text) AS $$
+    SELECT patient_id FROM shared_exclusion_rows('advanced_illness', p_mp_start, p_mp_end, p_subject)
+    UNION ALL
     SELECT c.patient_id
     FROM condition_flat c
     JOIN concepts vs ON vs.system = c.code_system AND vs.code = c.code
@@ -233,6 +323,7 @@ RETURNS TABLE(patient_id text) AS $$
         AND c.onset_date >= (p_mp_start - INTERVAL '1 year')
         AND c.onset_date <= p_mp_end
         AND (p_subject IS NULL OR c.patient_id = p_subject)
+        AND NOT shared_exclusion_mp_fresh(p_mp_start, p_mp_end)
 $$ LANGUAGE sql STABLE;
 
 -- ============================================================
@@ -244,6 +335,8 @@ CREATE OR REPLACE FUNCTION shared_dementia_meds(
     p_subject text DEFAULT NULL
 )
 RETURNS TABLE(patient_id text) AS $$
+    SELECT patient_id FROM shared_exclusion_rows('dementia_meds', p_mp_start, p_mp_end, p_subject)
+    UNION ALL
     SELECT mr.patient_id
     FROM medicationrequest_flat mr
     JOIN concepts vs ON vs.system = mr.med_system AND vs.code = mr.med_code
@@ -253,6 +346,7 @@ RETURNS TABLE(patient_id text) AS $$
         AND COALESCE(mr.validity_start, mr.authored_on) <= p_mp_end
         AND COALESCE(mr.validity_end, mr.authored_on) >= (p_mp_start - INTERVAL '1 year')
         AND (p_subject IS NULL OR mr.patient_id = p_subject)
+        AND NOT shared_exclusion_mp_fresh(p_mp_start, p_mp_end)
 $$ LANGUAGE sql STABLE;
 
 -- ============================================================
@@ -265,6 +359,8 @@ CREATE OR REPLACE FUNCTION shared_advanced_illness_frailty(
     p_subject text DEFAULT NULL
 )
 RETURNS TABLE(patient_id text) AS $$
+    SELECT patient_id FROM shared_exclusion_rows('advanced_illness_frailty', p_mp_start, p_mp_end, p_subject)
+    UNION ALL
     SELECT p.id AS patient_id
     FROM patient_flat p
     JOIN shared_has_frailty(p_mp_start, p_mp_end, p_subject) f ON f.patient_id = p.id
@@ -273,6 +369,7 @@ RETURNS TABLE(patient_id text) AS $$
     WHERE EXTRACT(YEAR FROM AGE(p_mp_end, p.birth_date::date)) >= 66
         AND (ai.patient_id IS NOT NULL OR dm.patient_id IS NOT NULL)
         AND (p_subject IS NULL OR p.id = p_subject)
+        AND NOT shared_exclusion_mp_fresh(p_mp_start, p_mp_end)
 $$ LANGUAGE sql STABLE;
 
 -- ============================================================
@@ -284,6 +381,8 @@ CREATE OR REPLACE FUNCTION shared_nursing_home(
     p_subject text DEFAULT NULL
 )
 RETURNS TABLE(patient_id text) AS $$
+    SELECT patient_id FROM shared_exclusion_rows('nursing_home', p_mp_start, p_mp_end, p_subject)
+    UNION ALL
     SELECT o.patient_id
     FROM observation_flat o
     JOIN patient_flat p ON p.id = o.patient_id
@@ -293,6 +392,7 @@ RETURNS TABLE(patient_id text) AS $$
         AND o.status IN ('final', 'amended', 'corrected')
         AND o.effective_end <= p_mp_end
         AND (p_subject IS NULL OR o.patient_id = p_subject)
+        AND NOT shared_exclusion_mp_fresh(p_mp_start, p_mp_end)
 $$ LANGUAGE sql STABLE;
 
 -- ============================================================
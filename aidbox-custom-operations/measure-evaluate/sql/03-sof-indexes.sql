@@ -14,6 +14,17 @@ CREATE INDEX IF NOT EXISTS idx_sof_medicationrequest_patient ON sof.medicationre
 CREATE INDEX IF NOT EXISTS idx_sof_devicerequest_patient ON sof.devicerequest_flat(patient_id);
 CREATE INDEX IF NOT EXISTS idx_sof_bp_patient ON sof.observation_bp_flat(patient_id);
 
+-- resource id — tools/refresh_sof.py --delta deletes a re-projected resource's rows
+-- by id (patient_flat's is idx_sof_patient_id above)
+CREATE INDEX IF NOT EXISTS idx_sof_encounter_id ON sof.encounter_flat(id);
+CREATE INDEX IF NOT EXISTS idx_sof_condition_id ON sof.condition_flat(id);
+CREATE INDEX IF NOT EXISTS idx_sof_procedure_id ON sof.procedure_flat(id);
+CREATE INDEX IF NOT EXISTS idx_sof_observation_id ON sof.observation_flat(id);
+CREATE INDEX IF NOT EXISTS idx_sof_servicerequest_id ON sof.servicerequest_flat(id);
+CREATE INDEX IF NOT EXISTS idx_sof_medicationrequest_id ON sof.medicationrequest_flat(id);
+CREATE INDEX IF NOT EXISTS idx_sof_devicerequest_id ON sof.devicerequest_flat(id);
+CREATE INDEX IF NOT EXISTS idx_sof_bp_id ON sof.observation_bp_flat(id);
+
 -- code/system lookups (concepts JOIN per measure CTE)
 CREATE INDEX IF NOT EXISTS idx_sof_encounter_type ON sof.encounter_flat(type_system, type_code);
 CREATE INDEX IF NOT EXISTS idx_sof_condition_code ON sof.condition_flat(code_system, code);
@@ -0,0 +1,19 @@
+-- sof data version: a single-row counter bumped after every (re)materialization
+--
+-- The evaluate service caches $sqlquery-run results keyed by this version
+-- (app/sqlquery_transport.py). Bumping it is what invalidates those caches, so
+-- run this file LAST, after $materialize + wrapper views + indexes are in place:
+-- setup.py and tools/refresh_sof.py both do.
+--
+-- Safe to re-run: each run increments the version by one.
+
+CREATE TABLE IF NOT EXISTS sof.data_version (
+    id           int         PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version      bigint      NOT NULL,
+    refreshed_at timestamptz NOT NULL DEFAULT now()
+);
+
+INSERT INTO sof.data_version (id, version) VALUES (1, 1)
+ON CONFLICT (id) DO UPDATE
+    SET version = sof.data_version.version + 1,
+        refreshed_at = now();
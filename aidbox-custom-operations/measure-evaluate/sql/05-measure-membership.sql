@@ -0,0 +1,36 @@
+-- Precomputed measure membership: the <id>-per-patient output, one row per
+-- (measure, measurement period, patient), written by tools/build_membership.py.
+--
+-- The evaluate service answers reportType=subject and subject-list from this
+-- table (a primary-key btree probe / range scan) instead of running the measure
+-- SQL -- but only while the snapshot is fresh: sof.measure_membership_build
+-- records the sof.data_version each (measure, period) snapshot was built from,
+-- and a snapshot whose version no longer matches sof.data_version (i.e. sof.*
+-- was re-materialized since) is ignored until it is rebuilt.
+--
+-- Safe to re-run: creates only what is missing.
+
+CREATE TABLE IF NOT EXISTS sof.measure_membership (
+    measure      text    NOT NULL,
+    period_start date    NOT NULL,
+    period_end   date    NOT NULL,
+    patient_id   text    NOT NULL,
+    in_ip        boolean NOT NULL,
+    in_exc       boolean NOT NULL,
+    in_num       boolean NOT NULL,
+    -- multi-numerator measures: {"in_num_2": true, ...}; NULL otherwise
+    in_num_extra jsonb,
+    -- btree: subject lookups are an equality probe on all four columns,
+    -- subject-list a range scan on the (measure, period) prefix
+    PRIMARY KEY (measure, period_start, period_end, patient_id)
+);
+
+CREATE TABLE IF NOT EXISTS sof.measure_membership_build (
+    measure      text        NOT NULL,
+    period_start date        NOT NULL,
+    period_end   date        NOT NULL,
+    data_version bigint      NOT NULL,
+    built_at     timestamptz NOT NULL DEFAULT now(),
+    row_count    bigint,
+    PRIMARY KEY (measure, period_start, period_end)
+);
@@ -0,0 +1,62 @@
+-- Per-ViewDefinition high-water marks for tools/refresh_sof.py --delta.
+--
+-- A refresh records, for each sof.*_flat table, the highest txid / ts of its
+-- source resource table (encounter, observation, ...) read BEFORE the table was
+-- (re)projected. A delta refresh re-projects only the resources written after
+-- that mark -- created or updated (the resource table) or deleted (its _history
+-- tombstone) -- and moves the mark forward.
+--
+-- Safe to re-run: creates only what is missing.
+
+CREATE TABLE IF NOT EXISTS sof.refresh_mark (
+    vd_id        text        PRIMARY KEY,
+    txid         bigint      NOT NULL,
+    ts           timestamptz NOT NULL,
+    refreshed_at timestamptz NOT NULL DEFAULT now(),
+    mode         text        NOT NULL,  -- full | delta
+    changed      bigint                 -- resources whose rows the last delta changed
+);
+
+-- Delta lookups (refresh_sof.py --delta): the high-water mark is max(txid) /
+-- max(ts) of each source resource table, and the changed ids are those with
+-- txid above the mark or ts within DELTA_OVERLAP_SECONDS of it, in the table and
+-- in its _history table. Without these indexes both are sequential scans of the
+-- whole table and of an ever-growing history; with them, max() is an index
+-- endpoint probe and each predicate (queried separately, combined by UNION) an
+-- index range scan over the rows written since the last refresh.
+--
+-- Plain CREATE INDEX (this file runs as one /$sql transaction, so not
+-- CONCURRENTLY): the first run blocks writes to each table while its index is
+-- built; later runs find the indexes and do nothing.
+CREATE INDEX IF NOT EXISTS sof_delta_patient_txid ON patient(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_patient_ts ON patient(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_patient_history_txid ON patient_history(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_patient_history_ts ON patient_history(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_encounter_txid ON encounter(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_encounter_ts ON encounter(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_encounter_history_txid ON encounter_history(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_encounter_history_ts ON encounter_history(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_condition_txid ON condition(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_condition_ts ON condition(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_condition_history_txid ON condition_history(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_condition_history_ts ON condition_history(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_procedure_txid ON procedure(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_procedure_ts ON procedure(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_procedure_history_txid ON procedure_history(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_procedure_history_ts ON procedure_history(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_observation_txid ON observation(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_observation_ts ON observation(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_observation_history_txid ON observation_history(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_observation_history_ts ON observation_history(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_servicerequest_txid ON servicerequest(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_servicerequest_ts ON servicerequest(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_servicerequest_history_txid ON servicerequest_history(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_servicerequest_history_ts ON servicerequest_history(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_medicationrequest_txid ON medicationrequest(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_medicationrequest_ts ON medicationrequest(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_medicationrequest_history_txid ON medicationrequest_history(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_medicationrequest_history_ts ON medicationrequest_history(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_devicerequest_txid ON devicerequest(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_devicerequest_ts ON devicerequest(ts);
+CREATE INDEX IF NOT EXISTS sof_delta_devicerequest_history_txid ON devicerequest_history(txid);
+CREATE INDEX IF NOT EXISTS sof_delta_devicerequest_history_ts ON devicerequest_history(ts);
@@ -9,8 +9,14 @@
 --   * reads only the flat wrapper views + `concepts` (which map to depends-on
 --     ViewDefinitions) — no calls to other functions or SQLQueries, so every
 --     exclusion is a single-level SQLQuery (measure -> exclusion -> ViewDefinition)
---   * has NO p_subject push-down (population mode only; the SQLQuery transport does
---     not thread a per-patient filter through depends-on CTEs)
+--   * marks each subject column with a `-- $SUBJ$ <col-expr>` line (the same marker the
+--     measure SQL uses). build_exclusion_libraries.py strips the markers for the
+--     population excl-<name> Library and binds them to :subject for excl-<name>-subject,
+--     the variant the measures' <id>-per-patient-subject Libraries depend on
+--
+-- build_exclusion_libraries.py also puts a branch reading sof.shared_exclusion in front
+-- of each block, taken instead of the block while the period's materialized build is
+-- fresh (tools/build_shared_exclusions.py); the blocks here are only the derivation.
 --
 -- Block delimiter: a line `-- @@ <name>` starts a named block; the SQL until the next
 -- delimiter (or EOF) is that exclusion's body. <name> is also the CTE label the
@@ -35,6 +41,7 @@ SELECT DISTINCT patient_id FROM (
         AND e.period_end <= mp.e AND e.period_end >= mp.s
         AND (r.resource->'hospitalization'->'dischargeDisposition'->'coding'->0->>'code'
             IN ('428361000124107', '428371000124100'))
+        -- $SUBJ$ e.patient_id
     UNION ALL
     SELECT e.patient_id
     FROM encounter_flat e
@@ -44,6 +51,7 @@ SELECT DISTINCT patient_id FROM (
     WHERE e.status = 'finished'
         AND e.period_start <= mp.e
         AND (e.period_end IS NULL OR e.period_end >= mp.s)
+        -- $SUBJ$ e.patient_id
     UNION ALL
     SELECT o.patient_id
     FROM observation_flat o CROSS JOIN mp
@@ -52,6 +60,7 @@ SELECT DISTINCT patient_id FROM (
         AND o.status IN ('final', 'amended', 'corrected')
         AND o.effective_start <= mp.e
         AND (o.effective_end IS NULL OR o.effective_end >= mp.s)
+        -- $SUBJ$ o.patient_id
     UNION ALL
     SELECT sr.patient_id
     FROM servicerequest_flat sr
@@ -61,6 +70,7 @@ SELECT DISTINCT patient_id FROM (
     WHERE sr.status IN ('active', 'completed')
         AND sr.intent IN ('order', 'original-order', 'reflex-order', 'filler-order', 'instance-order')
         AND sr.authored_on >= mp.s AND sr.authored_on <= mp.e
+        -- $SUBJ$ sr.patient_id
     UNION ALL
     SELECT pr.patient_id
     FROM procedure_flat pr
@@ -70,6 +80,7 @@ SELECT DISTINCT patient_id FROM (
     WHERE pr.status = 'completed'
         AND pr.performed_start <= mp.e
         AND (pr.performed_end IS NULL OR pr.performed_end >= mp.s)
+        -- $SUBJ$ pr.patient_id
     UNION ALL
     SELECT c.patient_id
     FROM condition_flat c
@@ -80,6 +91,7 @@ SELECT DISTINCT patient_id FROM (
         OR c.verification_status IN ('confirmed', 'unconfirmed', 'provisional', 'differential'))
         AND c.onset_date <= mp.e
         AND (c.abatement_date IS NULL OR c.abatement_date >= mp.s)
+        -- $SUBJ$ c.patient_id
 ) sub
 
 -- @@ palliative
@@ -92,6 +104,7 @@ SELECT DISTINCT patient_id FROM (
         AND o.status IN ('final', 'amended', 'corrected')
         AND o.effective_start <= mp.e
         AND (o.effective_end IS NULL OR o.effective_end >= mp.s)
+        -- $SUBJ$ o.patient_id
     UNION ALL
     SELECT c.patient_id
     FROM condition_flat c
@@ -102,6 +115,7 @@ SELECT DISTINCT patient_id FROM (
         OR c.verification_status IN ('confirmed', 'unconfirmed', 'provisional', 'differential'))
         AND c.onset_date <= mp.e
         AND (c.abatement_date IS NULL OR c.abatement_date >= mp.s)
+        -- $SUBJ$ c.patient_id
     UNION ALL
     SELECT e.patient_id
     FROM encounter_flat e
@@ -111,6 +125,7 @@ SELECT DISTINCT patient_id FROM (
     WHERE e.status = 'finished'
         AND e.period_start <= mp.e
         AND (e.period_end IS NULL OR e.period_end >= mp.s)
+        -- $SUBJ$ e.patient_id
     UNION ALL
     SELECT pr.patient_id
     FROM procedure_flat pr
@@ -120,6 +135,7 @@ SELECT DISTINCT patient_id FROM (
     WHERE pr.status = 'completed'
         AND pr.performed_start <= mp.e
         AND (pr.performed_end IS NULL OR pr.performed_end >= mp.s)
+        -- $SUBJ$ pr.patient_id
 ) sub
 
 -- @@ nursing_home
@@ -133,6 +149,7 @@ WHERE EXTRACT(YEAR FROM AGE(mp.e, p.birth_date::date)) >= 66
     AND o.value_code = '160734000'
     AND o.status IN ('final', 'amended', 'corrected')
     AND o.effective_end <= mp.e
+    -- $SUBJ$ o.patient_id
 
 -- @@ advanced_illness_frailty
 -- Inlined composition of has_frailty + advanced_illness + dementia_meds (age >= 66).
@@ -147,6 +164,7 @@ WHERE EXTRACT(YEAR FROM AGE(mp.e, p.birth_date::date)) >= 66
         CROSS JOIN mp
         WHERE dr.status IN ('active', 'completed')
             AND dr.authored_on >= mp.s AND dr.authored_on <= mp.e
+            -- $SUBJ$ dr.patient_id
         UNION ALL
         SELECT c.patient_id FROM condition_flat c
         JOIN concepts vs ON vs.system = c.code_system AND vs.code = c.code
@@ -155,6 +173,7 @@ WHERE EXTRACT(YEAR FROM AGE(mp.e, p.birth_date::date)) >= 66
         WHERE (c.verification_status IS NULL
             OR c.verification_status IN ('confirmed', 'unconfirmed', 'provisional', 'differential'))
             AND c.onset_date <= mp.e AND (c.abatement_date IS NULL OR c.abatement_date >= mp.s)
+            -- $SUBJ$ c.patient_id
         UNION ALL
         SELECT e.patient_id FROM encounter_flat e
         JOIN concepts vs ON vs.system = e.type_system AND vs.code = e.type_code
@@ -162,6 +181,7 @@ WHERE EXTRACT(YEAR FROM AGE(mp.e, p.birth_date::date)) >= 66
         CROSS JOIN mp
         WHERE e.status = 'finished' AND e.period_start <= mp.e
             AND (e.period_end IS NULL OR e.period_end >= mp.s)
+            -- $SUBJ$ e.patient_id
         UNION ALL
         SELECT o.patient_id FROM observation_flat o
         JOIN concepts vs ON vs.system = o.code_system AND vs.code = o.code
@@ -169,6 +189,7 @@ WHERE EXTRACT(YEAR FROM AGE(mp.e, p.birth_date::date)) >= 66
         CROSS JOIN mp
         WHERE o.status IN ('preliminary', 'final', 'amended', 'corrected')
             AND o.effective_start <= mp.e AND (o.effective_end IS NULL OR o.effective_end >= mp.s)
+            -- $SUBJ$ o.patient_id
         UNION ALL
         SELECT o.patient_id FROM observation_flat o
         JOIN concepts vs ON vs.system = o.value_system AND vs.code = o.value_code
@@ -177,6 +198,7 @@ WHERE EXTRACT(YEAR FROM AGE(mp.e, p.birth_date::date)) >= 66
         WHERE o.code = '98181-1' AND o.code_system = 'http://loinc.org'
             AND o.status IN ('final', 'amended', 'corrected')
             AND o.effective_end >= mp.s AND o.effective_end <= mp.e
+            -- $SUBJ$ o.patient_id
     ) f
 )
 , advanced_illness AS (
@@ -187,6 +209,7 @@ WHERE EXTRACT(YEAR FROM AGE(mp.e, p.birth_date::date)) >= 66
     WHERE (c.verification_status IS NULL
         OR c.verification_status IN ('confirmed', 'unconfirmed', 'provisional', 'differential'))
         AND c.onset_date >= (mp.s - INTERVAL '1 year') AND c.onset_date <= mp.e
+        -- $SUBJ$ c.patient_id
 )
 , dementia_meds AS (
     SELECT mr.patient_id FROM medicationrequest_flat mr
@@ -197,6 +220,7 @@ WHERE EXTRACT(YEAR FROM AGE(mp.e, p.birth_date::date)) >= 66
         AND mr.intent IN ('order', 'original-order', 'reflex-order', 'filler-order', 'instance-order')
         AND COALESCE(mr.validity_start, mr.authored_on) <= mp.e
         AND COALESCE(mr.validity_end, mr.authored_on) >= (mp.s - INTERVAL '1 year')
+        -- $SUBJ$ mr.patient_id
 )
 SELECT p.id AS patient_id
 FROM patient_flat p
@@ -206,6 +230,7 @@ LEFT JOIN dementia_meds dm ON dm.patient_id = p.id
 CROSS JOIN mp
 WHERE EXTRACT(YEAR FROM AGE(mp.e, p.birth_date::date)) >= 66
     AND (ai.patient_id IS NOT NULL OR dm.patient_id IS NOT NULL)
+    -- $SUBJ$ p.id
 
 -- @@ advanced_illness
 , mp AS (SELECT ((:period_start)::text || 'T00:00:00Z')::timestamptz AS s,
@@ -218,6 +243,7 @@ CROSS JOIN mp
 WHERE (c.verification_status IS NULL
     OR c.verification_status IN ('confirmed', 'unconfirmed', 'provisional', 'differential'))
     AND c.onset_date >= (mp.s - INTERVAL '1 year') AND c.onset_date <= mp.e
+    -- $SUBJ$ c.patient_id
 
 -- @@ dementia_meds
 , mp AS (SELECT ((:period_start)::text || 'T00:00:00Z')::timestamptz AS s,
@@ -231,6 +257,7 @@ WHERE mr.status = 'active'
     AND mr.intent IN ('order', 'original-order', 'reflex-order', 'filler-order', 'instance-order')
     AND COALESCE(mr.validity_start, mr.authored_on) <= mp.e
     AND COALESCE(mr.validity_end, mr.authored_on) >= (mp.s - INTERVAL '1 year')
+    -- $SUBJ$ mr.patient_id
 
 -- @@ has_frailty
 , mp AS (SELECT ((:period_start)::text || 'T00:00:00Z')::timestamptz AS s,
@@ -241,6 +268,7 @@ SELECT DISTINCT patient_id FROM (
         AND vs.valueset_url = 'http://cts.nlm.nih.gov/fhir/ValueSet/2.16.840.1.113883.3.464.1003.118.12.1300'
     CROSS JOIN mp
     WHERE dr.status IN ('active', 'completed') AND dr.authored_on >= mp.s AND dr.authored_on <= mp.e
+        -- $SUBJ$ dr.patient_id
     UNION ALL
     SELECT c.patient_id FROM condition_flat c
     JOIN concepts vs ON vs.system = c.code_system AND vs.code = c.code
@@ -249,6 +277,7 @@ SELECT DISTINCT patient_id FROM (
     WHERE (c.verification_status IS NULL
         OR c.verification_status IN ('confirmed', 'unconfirmed', 'provisional', 'differential'))
         AND c.onset_date <= mp.e AND (c.abatement_date IS NULL OR c.abatement_date >= mp.s)
+        -- $SUBJ$ c.patient_id
     UNION ALL
     SELECT e.patient_id FROM encounter_flat e
     JOIN concepts vs ON vs.system = e.type_system AND vs.code = e.type_code
@@ -256,6 +285,7 @@ SELECT DISTINCT patient_id FROM (
     CROSS JOIN mp
     WHERE e.status = 'finished' AND e.period_start <= mp.e
         AND (e.period_end IS NULL OR e.period_end >= mp.s)
+        -- $SUBJ$ e.patient_id
     UNION ALL
     SELECT o.patient_id FROM observation_flat o
     JOIN concepts vs ON vs.system = o.code_system AND vs.code = o.code
@@ -263,6 +293,7 @@ SELECT DISTINCT patient_id FROM (
     CROSS JOIN mp
     WHERE o.status IN ('preliminary', 'final', 'amended', 'corrected')
         AND o.effective_start <= mp.e AND (o.effective_end IS NULL OR o.effective_end >= mp.s)
+        -- $SUBJ$ o.patient_id
     UNION ALL
     SELECT o.patient_id FROM observation_flat o
     JOIN concepts vs ON vs.system = o.value_system AND vs.code = o.value_code
@@ -271,4 +302,5 @@ SELECT DISTINCT patient_id FROM (
     WHERE o.code = '98181-1' AND o.code_system = 'http://loinc.org'
         AND o.status IN ('final', 'amended', 'corrected')
         AND o.effective_end >= mp.s AND o.effective_end <= mp.e
+        -- $SUBJ$ o.patient_id
 ) f
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""Build precomputed measure membership snapshots (sql/05-measure-membership.sql).
+
+Writes each measure's <id>-per-patient output for one measurement period into
+sof.measure_membership, entirely inside Postgres (INSERT ... SELECT over the
+per-patient SQL -- the cohort never leaves the database), and records the build
+in sof.measure_membership_build with the sof.data_version it was built from.
+The evaluate service serves reportType=subject and subject-list from a snapshot
+while that version still matches sof.data_version, and falls back to the
+SQLQuery Libraries otherwise -- so a snapshot that predates the last
+tools/refresh_sof.py run is never served.
+
+Each (measure, period) build is one /$sql call, i.e. one transaction: the build
+row (stamped with the data version read BEFORE the measure SQL runs), the delete
+of the previous snapshot and the insert of the new one become visible together.
+A refresh that lands mid-build leaves the snapshot stamped with the older
+version, so it is detected as stale rather than served.
+
+Usage:
+    python3 tools/build_membership.py                       # all measures, MP 2026
+    python3 tools/build_membership.py --measures cms130 cms165
+    python3 tools/build_membership.py --period-start 2025-01-01 --period-end 2025-12-31
+    python3 tools/build_membership.py --existing            # rebuild every recorded snapshot
+
+tools/refresh_sof.py runs the --existing rebuild as its last step, so snapshots
+that were built once are kept fresh by the regular refresh schedule.
+"""
+from __future__ import annotations
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "app"))
+import evaluate_measure as em  # noqa: E402
+
+MEMBERSHIP_SQL = os.path.join(REPO_ROOT, "sql", "05-measure-membership.sql")
+PERIOD_START = "2026-01-01"
+PERIOD_END = "2026-12-31"
+
+# Columns of the <id>-per-patient rows that have their own table column; anything
+# else (in_num_2, ...) goes into in_num_extra.
+BASE_COLUMNS = ("patient_id", "in_ip", "in_exc", "in_num")
+
+BUILDS_SQL = ("SELECT measure, period_start::text AS period_start, "
+              "period_end::text AS period_end, data_version, built_at, row_count "
+              "FROM sof.measure_membership_build ORDER BY measure, period_start")
+
+
+def auth_header(user: str, password: str) -> str:
+    return "Basic " + base64.b64encode(f"{user}:{password}".encode()).decode()
+
+
+def run_sql(sql: str, base_url: str, auth: str, timeout: int = 60):
+    req = urllib.request.Request(
+        f"{base_url}/$sql", method="POST",
+        data=json.dumps([sql]).encode(),
+    )
+    req.add_header("Authorization", auth)
+    req.add_header("Content-Type", "application/json")
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        body = resp.read().decode()
+        return json.loads(body) if body.strip() else []
+
+
+def build_sql(measure_id: str, period_start: str, period_end: str) -> str:
+    """The /$sql text that (re)builds one (measure, period) snapshot."""
+    path = os.path.join(REPO_ROOT, "sql", "measures", measure_id, f"02-{measure_id}-measure.sql")
+    with open(path) as fh:
+        measure_sql = fh.read()
+    per_patient = em.parameterize_sql(em.build_per_patient_sql(measure_sql),
+                                      period_start, period_end)
+    key = (f"measure = '{measure_id}' AND period_start = '{period_start}' "
+           f"AND period_end = '{period_end}'")
+    base_columns = ", ".join(f"'{c}'" for c in BASE_COLUMNS)
+    return f"""SET LOCAL lock_timeout = '60s';
+INSERT INTO sof.measure_membership_build (measure, period_start, period_end, data_version, built_at)
+SELECT '{measure_id}', '{period_start}', '{period_end}', version, now()
+FROM sof.data_version WHERE id = 1
+ON CONFLICT (measure, period_start, period_end) DO UPDATE
+    SET data_version = EXCLUDED.data_version, built_at = EXCLUDED.built_at, row_count = NULL;
+DELETE FROM sof.measure_membership WHERE {key};
+INSERT INTO sof.measure_membership
+    (measure, period_start, period_end, patient_id, in_ip, in_exc, in_num, in_num_extra)
+SELECT '{measure_id}', '{period_start}', '{period_end}',
+       s.patient_id, s.in_ip, s.in_exc, s.in_num,
+       NULLIF(to_jsonb(s) - ARRAY[{base_columns}], '{{}}'::jsonb)
+FROM (
+{per_patient}
+) s;
+UPDATE sof.measure_membership_build
+SET row_count = (SELECT COUNT(*) FROM sof.measure_membership WHERE {key})
+WHERE {key}"""
+
+
+def build_one(measure_id: str, period_start: str, period_end: str,
+              base_url: str, auth: str, timeout: int = 1800) -> tuple[bool, str]:
+    try:
+        run_sql(build_sql(measure_id, period_start, period_end), base_url, auth,
+                timeout=timeout)
+        return True, ""
+    except urllib.error.HTTPError as e:
+        return False, f"HTTP {e.code}: {e.read()[:200].decode(errors='replace')}"
+    except Exception as e:
+        return False, str(e)[:200]
+
+
+def recorded_builds(base_url: str, auth: str) -> list[dict]:
+    """Every snapshot in sof.measure_membership_build ([] if the table is missing)."""
+    try:
+        return run_sql(BUILDS_SQL, base_url, auth)
+    except Exception:
+        return []
+
+
+def build_snapshots(targets, base_url: str, auth: str) -> list[str]:
+    """Build each (measure, period_start, period_end) in `targets`, logging per-build
+    timing and row count. Returns the failed targets as 'measure period' labels."""
+    with open(MEMBERSHIP_SQL) as fh:
+        run_sql(fh.read(), base_url, auth)  # idempotent DDL
+    failed = []
+    for measure_id, period_start, period_end in targets:
+        label = f"{measure_id} {period_start}..{period_end}"
+        t0 = time.time()
+        ok, err = build_one(measure_id, period_start, period_end, base_url, auth)
+        dt = time.time() - t0
+        if ok:
+            print(f"  OK   {label:35s} {dt:>7.2f}s")
+        else:
+            failed.append(label)
+            print(f"  FAIL {label:35s} {dt:>7.2f}s  — {err}")
+    for b in recorded_builds(base_url, auth):
+        if (b["measure"], b["period_start"], b["period_end"]) in targets:
+            print(f"       {b['measure']:8s} {b['period_start']}..{b['period_end']}  "
+                  f"rows={b['row_count']}  data_version={b['data_version']}")
+    return failed
+
+
+def rebuild_existing(base_url: str, auth: str) -> list[str]:
+    """Rebuild every recorded snapshot (after sof.* was re-materialized)."""
+    targets = [(b["measure"], b["period_start"], b["period_end"])
+               for b in recorded_builds(base_url, auth)]
+    if not targets:
+        print("  No membership snapshots recorded — nothing to rebuild")
+        return []
+    return build_snapshots(targets, base_url, auth)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--base-url", default=os.environ.get("AIDBOX_URL", "http://localhost:8888"))
+    ap.add_argument("--user", default=os.environ.get("AIDBOX_USER", "root"))
+    ap.add_argument("--password", default=os.environ.get("AIDBOX_PASS", "secret"))
+    ap.add_argument("--measures", nargs="+", default=sorted(em.MEASURES),
+                    help="measure IDs to build (default: every registry measure)")
+    ap.add_argument("--period-start", default=PERIOD_START)
+    ap.add_argument("--period-end", default=PERIOD_END)
+    ap.add_argument("--existing", action="store_true",
+                    help="rebuild every snapshot already recorded instead")
+    args = ap.parse_args()
+
+    unknown = [m for m in args.measures if m not in em.MEASURES]
+    if unknown:
+        sys.exit(f"Unknown measure(s): {', '.join(unknown)}")
+
+    auth = auth_header(args.user, args.password)
+    print(f"[build_membership] target: {args.base_url}")
+    t0 = time.time()
+    if args.existing:
+        failed = rebuild_existing(args.base_url, auth)
+    else:
+        targets = [(m, args.period_start, args.period_end) for m in args.measures]
+        failed = build_snapshots(targets, args.base_url, auth)
+    print(f"\n[build_membership] Total: {time.time() - t0:.1f}s")
+    if failed:
+        print(f"[build_membership] FAILED: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
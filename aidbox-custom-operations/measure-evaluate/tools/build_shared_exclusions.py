@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Build the materialized shared exclusions (sql/02-shared-exclusions.sql).
+
+Writes the patient list of every shared exclusion (hospice, palliative, nursing
+home, advanced illness + frailty and its parts) for one measurement period into
+sof.shared_exclusion, entirely inside Postgres (INSERT ... SELECT over the shared_*
+functions), and records the build in sof.shared_exclusion_build with the
+sof.data_version it was built from. While that version is current the shared_*
+functions and the excl-* SQLQuery Libraries read those rows instead of deriving
+the exclusions per measure and per request -- so a build that predates the last
+tools/refresh_sof.py run is never read.
+
+Each period's build is one /$sql call, i.e. one transaction. The build row is
+written first with row_count NULL, which keeps the period un-fresh inside the
+transaction: the INSERT's shared_* calls derive the exclusions rather than read
+the rows being replaced. The row_count UPDATE at the end completes it; the delete
+of the previous rows and the new ones become visible together at commit. As in
+build_membership.py, the data version is read BEFORE the exclusions are derived,
+so a refresh that lands mid-build leaves the build stale rather than served.
+
+Usage:
+    python3 tools/build_shared_exclusions.py                  # MP 2026
+    python3 tools/build_shared_exclusions.py --period-start 2025-01-01 --period-end 2025-12-31
+    python3 tools/build_shared_exclusions.py --existing       # rebuild every recorded period
+
+tools/refresh_sof.py runs the --existing rebuild after bumping sof.data_version
+(before the membership snapshots, whose builds then read the fresh exclusions).
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+import time
+import urllib.error
+
+from build_membership import PERIOD_START, PERIOD_END, auth_header, run_sql
+
+# sof.shared_exclusion.name -> the shared_* function that derives it.
+EXCLUSIONS = ["hospice", "palliative", "nursing_home", "advanced_illness_frailty",
+              "advanced_illness", "dementia_meds", "has_frailty"]
+
+BUILDS_SQL = ("SELECT period_start::text AS period_start, period_end::text AS period_end, "
+              "data_version, built_at, row_count "
+              "FROM sof.shared_exclusion_build ORDER BY period_start, period_end")
+COUNTS_SQL = ("SELECT name, COUNT(*) AS n FROM sof.shared_exclusion "
+              "WHERE period_start = '{ps}' AND period_end = '{pe}' GROUP BY name ORDER BY name")
+
+
+def build_sql(period_start: str, period_end: str) -> str:
+    """The /$sql text that (re)builds one period's exclusions."""
+    key = f"period_start = '{period_start}' AND period_end = '{period_end}'"
+    # The measures' MP convention (whole days, UTC) -- the only bounds
+    # shared_exclusion_mp_fresh matches to a build.
+    mp = f"'{period_start}T00:00:00Z'::timestamptz, '{period_end}T23:59:59Z'::timestamptz"
+    derive = "\nUNION ALL\n".join(
+        f"SELECT DISTINCT '{name}', '{period_start}'::date, '{period_end}'::date, patient_id "
+        f"FROM shared_{name}({mp})" for name in EXCLUSIONS)
+    return f"""SET LOCAL lock_timeout = '60s';
+INSERT INTO sof.shared_exclusion_build (period_start, period_end, data_version, built_at)
+SELECT '{period_start}', '{period_end}', version, now()
+FROM sof.data_version WHERE id = 1
+ON CONFLICT (period_start, period_end) DO UPDATE
+    SET data_version = EXCLUDED.data_version, built_at = EXCLUDED.built_at, row_count = NULL;
+DELETE FROM sof.shared_exclusion WHERE {key};
+INSERT INTO sof.shared_exclusion (name, period_start, period_end, patient_id)
+{derive};
+UPDATE sof.shared_exclusion_build
+SET row_count = (SELECT COUNT(*) FROM sof.shared_exclusion WHERE {key})
+WHERE {key}"""
+
+
+def build_one(period_start: str, period_end: str, base_url: str, auth: str,
+              timeout: int = 1800) -> tuple[bool, str]:
+    try:
+        run_sql(build_sql(period_start, period_end), base_url, auth, timeout=timeout)
+        return True, ""
+    except urllib.error.HTTPError as e:
+        return False, f"HTTP {e.code}: {e.read()[:200].decode(errors='replace')}"
+    except Exception as e:
+        return False, str(e)[:200]
+
+
+def recorded_builds(base_url: str, auth: str) -> list[dict]:
+    """Every period in sof.shared_exclusion_build ([] if the table is missing)."""
+    try:
+        return run_sql(BUILDS_SQL, base_url, auth)
+    except Exception:
+        return []
+
+
+def build_periods(targets, base_url: str, auth: str) -> list[str]:
+    """Build each (period_start, period_end) in `targets`, logging per-build timing
+    and per-exclusion row counts. Returns the failed periods as labels."""
+    failed = []
+    for period_start, period_end in targets:
+        label = f"{period_start}..{period_end}"
+        t0 = time.time()
+        ok, err = build_one(period_start, period_end, base_url, auth)
+        dt = time.time() - t0
+        if not ok:
+            failed.append(label)
+            print(f"  FAIL {label:25s} {dt:>7.2f}s  — {err}")
+            continue
+        print(f"  OK   {label:25s} {dt:>7.2f}s")
+        try:
+            counts = run_sql(COUNTS_SQL.format(ps=period_start, pe=period_end), base_url, auth)
+        except Exception:
+            counts = []
+        for c in counts:
+            print(f"       {c['name']:25s} rows={c['n']}")
+    return failed
+
+
+def rebuild_existing(base_url: str, auth: str) -> list[str]:
+    """Rebuild every recorded period (after sof.* was re-materialized)."""
+    targets = [(b["period_start"], b["period_end"]) for b in recorded_builds(base_url, auth)]
+    if not targets:
+        print("  No shared exclusion builds recorded — nothing to rebuild")
+        return []
+    return build_periods(targets, base_url, auth)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--base-url", default=os.environ.get("AIDBOX_URL", "http://localhost:8888"))
+    ap.add_argument("--user", default=os.environ.get("AIDBOX_USER", "root"))
+    ap.add_argument("--password", default=os.environ.get("AIDBOX_PASS", "secret"))
+    ap.add_argument("--period-start", default=PERIOD_START)
+    ap.add_argument("--period-end", default=PERIOD_END)
+    ap.add_argument("--existing", action="store_true",
+                    help="rebuild every period already recorded instead")
+    args = ap.parse_args()
+
+    auth = auth_header(args.user, args.password)
+    print(f"[build_shared_exclusions] target: {args.base_url}")
+    t0 = time.time()
+    if args.existing:
+        failed = rebuild_existing(args.base_url, auth)
+    else:
+        failed = build_periods([(args.period_start, args.period_end)], args.base_url, auth)
+    print(f"\n[build_shared_exclusions] Total: {time.time() - t0:.1f}s")
+    if failed:
+        print(f"[build_shared_exclusions] FAILED: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,26 +2,76 @@
 """Refresh sof.*_flat materialized tables + re-apply indexes + ANALYZE.
 
 For production setups where Patient/Encounter/Condition data changes over time
-(bulk imports, new clinical events). $materialize does a full rebuild — there
-is no incremental refresh path today. Schedule this script from cron, or run
-it on demand after a bulk load.
+(bulk imports, new clinical events). $materialize does a full rebuild; --delta
+re-projects only what changed since the previous refresh (below). Schedule this
+script from cron, or run it on demand after a bulk load.
 
-What it does (idempotent, safe to re-run):
+What a full refresh does (idempotent, safe to re-run):
   1. DROP VIEW IF EXISTS for each wrapper view CASCADE. The $materialize
      operation drops sof.X then recreates it; PostgreSQL refuses to drop a
      table while a wrapper view depends on it, so we drop wrappers first.
   2. POST /fhir/ViewDefinition/{id}/$materialize for each of 9 ViewDefinitions
   3. Re-run measures/shared/sql/01-wrapper-views.sql (recreate wrappers)
-  4. Re-run measures/shared/sql/03-sof-indexes.sql (CREATE INDEX IF NOT EXISTS
-     plus ANALYZE — indexes are dropped on each $materialize because DROP TABLE)
-  5. Log per-table row counts and timings
-
-Exits non-zero if any $materialize call fails.
+  4. Create that table's measures/shared/sql/03-sof-indexes.sql indexes (CREATE
+     INDEX IF NOT EXISTS) and ANALYZE it — indexes are dropped on each
+     $materialize because DROP TABLE
+  5. Bump sof.data_version (sql/04-data-version.sql) — the evaluate service keys
+     its $sqlquery-run result cache on it, so cached results are dropped
+  6. Rebuild every recorded shared exclusion period (tools/build_shared_exclusions.py
+     --existing) against the new data version; --skip-exclusions skips it
+  7. Rebuild every recorded measure membership snapshot (tools/build_membership.py
+     --existing) against the new data version; --skip-membership skips it
+  8. Log per-table row counts and timings
+
+Steps 2 and 4 run as a per-table pipeline: up to --parallel (REFRESH_PARALLELISM,
+default 3) tables at once, each indexed and ANALYZEd as soon as its $materialize
+returns, while the others are still being built. Step 3 waits for all of them.
+The same bound applies to the delta and shadow steps below. The closing timings
+table shows each table's phases (materialize / index / analyze, or delta) and
+the wall time of each step.
+
+Every refresh records a per-ViewDefinition high-water mark in sof.refresh_mark
+(sql/06-sof-refresh-marks.sql): the max txid / ts of the VD's source resource
+table, read before the table is projected. A --delta refresh instead, per VD:
+  1. (re)creates sof.<name>_delta, a plain view of the same ViewDefinition
+     (PUT as <id>-delta, $materialize type=view) -- the live projection
+  2. in one transaction, collects the ids of the resources written after the
+     mark -- created/updated in the resource table, deleted (tombstoned) in its
+     _history table -- deletes their rows from sof.<name> and inserts them again
+     from sof.<name>_delta (a deleted resource, or one the VD's `where` no longer
+     matches, has none), then moves the mark and records how many of those
+     resources' rows actually differ from the ones they replaced
+  3. ANALYZEs the tables that changed
+Wrapper views and indexes stay in place (the rows go through the existing
+indexes). Steps 5-7 follow only if some rows changed -- resources merely
+re-read by the overlap window (DELTA_OVERLAP_SECONDS) do not count. A VD without a mark needs
+one full refresh first.
+
+During steps 1-4 of a full refresh the wrapper views are gone and the new tables
+unindexed, so evaluations fail or scan. A --shadow refresh keeps the live tables
+serving until the new ones are ready:
+  1. $materialize each VD under a shadow name (PUT as <id>-shadow, name
+     <name>_shadow) -- sof.<name> is not touched
+  2. index each shadow table (the 03-sof-indexes.sql indexes, suffixed _shadow)
+     and ANALYZE it; a table whose index build fails is not swapped in
+  3. swap them all in with one /$sql transaction: rename sof.<name> to
+     <name>_old and sof.<name>_shadow to <name>, re-run 01-wrapper-views.sql
+     (views are bound to the old tables, not their names), drop the old tables
+     and give the shadow indexes their canonical names
+The swap waits for in-flight queries on the old tables and queries arriving
+meanwhile wait for it, then resolve the names to the new, indexed tables; if it
+fails it rolls back and the live tables stay as they were. Steps 5-7 follow.
+
+Exits non-zero if any $materialize (or delta) call fails, or a refreshed table's
+CREATE INDEX / ANALYZE does.
 
 Usage:
     python3 scripts/refresh_sof.py
     python3 scripts/refresh_sof.py --base-url http://localhost:9999
     python3 scripts/refresh_sof.py --vds patient-flat encounter-flat
+    python3 scripts/refresh_sof.py --parallel 1          # one table at a time
+    python3 scripts/refresh_sof.py --delta
+    python3 scripts/refresh_sof.py --shadow
 
 Cron example (every 4 hours):
     0 */4 * * * /usr/bin/python3 /opt/measure-evaluate/tools/refresh_sof.py \\
@@ -33,10 +83,14 @@ import argparse
 import base64
 import json
 import os
+import re
 import sys
+import threading
 import time
 import urllib.error
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -48,6 +102,21 @@ VD_IDS = [
 
 WRAPPER_VIEWS_SQL = os.path.join(REPO_ROOT, "sql", "01-wrapper-views.sql")
 SOF_INDEXES_SQL = os.path.join(REPO_ROOT, "sql", "03-sof-indexes.sql")
+DATA_VERSION_SQL = os.path.join(REPO_ROOT, "sql", "04-data-version.sql")
+REFRESH_MARKS_SQL = os.path.join(REPO_ROOT, "sql", "06-sof-refresh-marks.sql")
+VD_DIR = os.path.join(REPO_ROOT, "viewdefinitions")
+
+# txid / ts are stamped when a transaction writes, not when it commits, so a write
+# committed after a mark was read can carry a lower txid than the mark. A delta
+# also re-reads the resources written this many seconds before the mark's ts.
+# The txid / ts indexes of sql/06-sof-refresh-marks.sql keep that lookup (and the
+# mark's max()) to the recently written rows; without them every delta scans each
+# source table and its whole _history table.
+DELTA_OVERLAP_SECONDS = 300
+
+# Tables refreshed at once. Each runs its own materialize -> index -> ANALYZE chain,
+# so this also bounds the concurrent CREATE INDEX / ANALYZE load on Postgres.
+REFRESH_PARALLELISM = int(os.environ.get("REFRESH_PARALLELISM", 3))
 
 # Wrapper view names that depend on sof.*_flat tables — must be dropped before
 # $materialize re-creates the underlying table. Recreated from 01-wrapper-views.sql
@@ -63,10 +132,11 @@ def auth_header(user: str, password: str) -> str:
     return "Basic " + base64.b64encode(f"{user}:{password}".encode()).decode()
 
 
-def materialize(vd_id: str, base_url: str, auth: str) -> tuple[bool, str]:
+def materialize(vd_id: str, base_url: str, auth: str,
+                type_: str = "table") -> tuple[bool, str]:
     body = json.dumps({
         "resourceType": "Parameters",
-        "parameter": [{"name": "type", "valueCode": "table"}],
+        "parameter": [{"name": "type", "valueCode": type_}],
     }).encode()
     req = urllib.request.Request(
         f"{base_url}/fhir/ViewDefinition/{vd_id}/$materialize",
@@ -95,8 +165,8 @@ def run_sql(sql: str, base_url: str, auth: str, timeout: int = 60):
         return json.loads(body) if body.strip() else []
 
 
-def table_count(vd_id: str, base_url: str, auth: str) -> int | None:
-    table = vd_id.replace("-", "_")  # 'patient-flat' → 'patient_flat'
+def table_count(vd_id: str, base_url: str, auth: str, suffix: str = "") -> int | None:
+    table = vd_id.replace("-", "_") + suffix  # 'patient-flat' → 'patient_flat'
     try:
         r = run_sql(f"SELECT COUNT(*) AS c FROM sof.{table}", base_url, auth)
         return r[0]["c"] if r else None
@@ -117,17 +187,13 @@ def apply_sql_file(path: str, base_url: str, auth: str, timeout: int = 1800) ->
         return 1
 
 
-def apply_sql_per_statement(path: str, base_url: str, auth: str, timeout: int = 1800) -> int:
+def run_statements(statements, base_url: str, auth: str, timeout: int = 1800) -> int:
     """Run each SQL statement separately, log per-statement timing.
 
     Useful for CREATE INDEX / ANALYZE on big tables, where one slow statement
     must not block our diagnostic view of the others, and where per-stmt
-    timing pinpoints the offender.
+    timing pinpoints the offender. Returns count of warnings.
     """
-    with open(path) as fh:
-        text = fh.read()
-    # naive split on ';' — fine for index/analyze files (no procedures, no $$ bodies)
-    statements = [s.strip() for s in text.split(';') if s.strip()]
     warnings = 0
     for stmt in statements:
         # short label = first non-comment, non-blank line, truncated
@@ -141,11 +207,11 @@ def apply_sql_per_statement(path: str, base_url: str, auth: str, timeout: int =
         try:
             run_sql(stmt, base_url, auth, timeout=timeout)
             dt = time.time() - t0
-            print(f"  OK   {dt:>7.2f}s  {short}")
+            log(f"  OK   {dt:>7.2f}s  {short}")
         except Exception as e:
             dt = time.time() - t0
             warnings += 1
-            print(f"  FAIL {dt:>7.2f}s  {short}  — {str(e)[:120]}")
+            log(f"  FAIL {dt:>7.2f}s  {short}  — {str(e)[:120]}")
     return warnings
 
 
@@ -158,13 +224,418 @@ def drop_wrapper_views(base_url: str, auth: str) -> None:
             print(f"  WARN: DROP VIEW {view} — {str(e)[:80]}")
 
 
+# --- high-water marks / delta refresh -------------------------------------------
+
+def load_vd(vd_id: str) -> dict:
+    with open(os.path.join(VD_DIR, f"{vd_id}.json")) as fh:
+        return json.load(fh)
+
+
+def source_table(vd_id: str) -> str:
+    """The Aidbox resource table a VD projects ('Observation' -> 'observation')."""
+    return load_vd(vd_id)["resource"].lower()
+
+
+def mark_sql(vd_id: str) -> str:
+    # Each max() is answered from the end of its index (sql/06-sof-refresh-marks.sql).
+    return (f"SELECT COALESCE(max(txid), 0) AS txid, "
+            f"COALESCE(max(ts), '-infinity') AS ts FROM {source_table(vd_id)}")
+
+
+def read_mark(vd_id: str, base_url: str, auth: str) -> dict | None:
+    """The VD's source table high-water mark now (None if it cannot be read)."""
+    try:
+        r = run_sql(mark_sql(vd_id), base_url, auth, timeout=600)
+        return r[0] if r else None
+    except Exception as e:
+        log(f"  WARN: high-water mark of {vd_id}: {str(e)[:120]}")
+        return None
+
+
+def save_mark(vd_id: str, mark: dict, base_url: str, auth: str) -> None:
+    """Record the mark a full refresh of vd_id was projected from."""
+    try:
+        run_sql(f"""INSERT INTO sof.refresh_mark (vd_id, txid, ts, refreshed_at, mode, changed)
+VALUES ('{vd_id}', {int(mark['txid'])}, '{mark['ts']}', now(), 'full', NULL)
+ON CONFLICT (vd_id) DO UPDATE
+    SET txid = EXCLUDED.txid, ts = EXCLUDED.ts, refreshed_at = EXCLUDED.refreshed_at,
+        mode = EXCLUDED.mode, changed = EXCLUDED.changed""", base_url, auth)
+    except Exception as e:
+        log(f"  WARN: recording the mark of {vd_id}: {str(e)[:120]}")
+
+
+def read_marks(base_url: str, auth: str) -> dict:
+    """{vd_id: {txid, ts, changed, ...}} ({} if none are recorded)."""
+    try:
+        rows = run_sql("SELECT vd_id, txid, ts, refreshed_at, mode, changed "
+                       "FROM sof.refresh_mark", base_url, auth)
+    except Exception:
+        return {}
+    return {r["vd_id"]: r for r in rows}
+
+
+def materialize_copy(vd_id: str, suffix: str, type_: str, base_url: str,
+                     auth: str) -> tuple[bool, str]:
+    """PUT a copy of the VD as <id>-<suffix> (projecting into sof.<name>_<suffix>) and
+    $materialize it -- sof.<name> itself is not touched."""
+    vd = load_vd(vd_id)
+    copy = dict(vd, id=f"{vd_id}-{suffix}", url=f"{vd['url']}-{suffix}",
+                name=f"{vd['name']}_{suffix}")
+    req = urllib.request.Request(
+        f"{base_url}/fhir/ViewDefinition/{copy['id']}", method="PUT",
+        data=json.dumps(copy).encode(),
+    )
+    req.add_header("Authorization", auth)
+    req.add_header("Content-Type", "application/json")
+    try:
+        urllib.request.urlopen(req, timeout=60)
+    except urllib.error.HTTPError as e:
+        return False, f"PUT {copy['id']}: HTTP {e.code}: {e.read()[:200].decode(errors='replace')}"
+    except Exception as e:
+        return False, f"PUT {copy['id']}: {str(e)[:200]}"
+    return materialize(copy["id"], base_url, auth, type_=type_)
+
+
+def ensure_delta_view(vd_id: str, base_url: str, auth: str) -> tuple[bool, str]:
+    """(Re)create sof.<name>_delta: the VD materialized as a plain view, i.e. the
+    projection of whatever the resource table holds now, read per changed id."""
+    return materialize_copy(vd_id, "delta", "view", base_url, auth)
+
+
+def delta_sql(vd_id: str, mark: dict, overlap: int = DELTA_OVERLAP_SECONDS) -> str:
+    """The /$sql text of one VD's delta: one transaction, so readers see the table
+    before or after it, and the mark moves only if the rows did.
+
+    The overlap window always re-reads the resources written around the mark, so the
+    mark's `changed` counts only the ids whose rows actually differ after the
+    re-projection (old and new rows compared as jsonb, both ways) -- a run with
+    nothing new records 0 and leaves the data version alone."""
+    table = source_table(vd_id)
+    name = vd_id.replace("-", "_")
+    txid, ts = int(mark["txid"]), mark["ts"]
+    # One predicate per SELECT, so each is a range scan of its own index (sql/06);
+    # an OR across the two columns would scan the table and its whole history.
+    changed = "\nUNION\n".join(
+        f"SELECT id FROM {t} WHERE {cond}"
+        for t in (table, f"{table}_history")
+        for cond in (f"txid > {txid}",
+                     f"ts > '{ts}'::timestamptz - interval '{overlap} seconds'"))
+    return f"""SET LOCAL lock_timeout = '60s';
+CREATE TEMP TABLE delta_mark ON COMMIT DROP AS
+{mark_sql(vd_id)};
+CREATE TEMP TABLE delta_ids ON COMMIT DROP AS
+{changed};
+CREATE TEMP TABLE delta_old ON COMMIT DROP AS
+SELECT * FROM sof.{name} LIMIT 0;
+WITH gone AS (DELETE FROM sof.{name} t USING delta_ids d WHERE t.id = d.id RETURNING t.*)
+INSERT INTO delta_old SELECT * FROM gone;
+INSERT INTO sof.{name}
+SELECT s.* FROM sof.{name}_delta s WHERE s.id IN (SELECT id FROM delta_ids);
+CREATE TEMP TABLE delta_new ON COMMIT DROP AS
+SELECT n.id, to_jsonb(n) AS r FROM sof.{name} n JOIN delta_ids d ON n.id = d.id;
+INSERT INTO sof.refresh_mark (vd_id, txid, ts, refreshed_at, mode, changed)
+SELECT '{vd_id}', GREATEST(m.txid, {txid}), GREATEST(m.ts, '{ts}'::timestamptz), now(), 'delta',
+       (SELECT COUNT(DISTINCT id) FROM (
+            (SELECT o.id, to_jsonb(o) AS r FROM delta_old o
+             EXCEPT ALL SELECT id, r FROM delta_new)
+            UNION ALL
+            (SELECT id, r FROM delta_new
+             EXCEPT ALL SELECT o.id, to_jsonb(o) FROM delta_old o)) diff)
+FROM delta_mark m
+ON CONFLICT (vd_id) DO UPDATE
+    SET txid = EXCLUDED.txid, ts = EXCLUDED.ts, refreshed_at = EXCLUDED.refreshed_at,
+        mode = EXCLUDED.mode, changed = EXCLUDED.changed"""
+
+
+# --- pipeline -------------------------------------------------------------------
+
+def log(line: str) -> None:
+    """print() for the pipeline's worker threads: whole lines, never interleaved."""
+    with _log_lock:
+        print(line, flush=True)
+
+
+_log_lock = threading.Lock()
+
+
+class Timings:
+    """Wall time per (table, phase) and per refresh step, reported at the end.
+
+    Table phases run concurrently, so their sum can exceed the `tables` step.
+    """
+
+    def __init__(self):
+        self.tables: dict[str, dict[str, float]] = {}
+        self.steps: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, vd_id: str, name: str):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                phases = self.tables.setdefault(vd_id, {})
+                phases[name] = phases.get(name, 0.0) + time.time() - t0
+
+    @contextmanager
+    def step(self, name: str):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.steps[name] = self.steps.get(name, 0.0) + time.time() - t0
+
+    def report(self) -> None:
+        print(f"\n[refresh_sof] Timings (seconds):")
+        names = []
+        for phases in self.tables.values():
+            names += [n for n in phases if n not in names]
+        if names:
+            print(f"  {'table':25s}" + "".join(f"{n:>12s}" for n in names) + f"{'total':>12s}")
+            for vd_id in sorted(self.tables, key=lambda v: (v not in VD_IDS, VD_IDS.index(v)
+                                                            if v in VD_IDS else v)):
+                phases = self.tables[vd_id]
+                cells = "".join(f"{phases[n]:>12.2f}" if n in phases else f"{'-':>12s}"
+                                for n in names)
+                print(f"  {vd_id:25s}{cells}{sum(phases.values()):>12.2f}")
+        for name, seconds in self.steps.items():
+            print(f"  step {name:20s}{seconds:>12.2f}")
+
+
+def run_pipeline(vds, chain, parallel: int) -> dict:
+    """chain(vd_id) for every VD, at most `parallel` at a time; {vd_id: result}.
+
+    The ViewDefinitions are independent of each other; the only ordering is within a
+    table (materialize, then index, then ANALYZE), which its chain runs back to back --
+    so each table is indexed and analyzed as soon as it is built, while others are
+    still being materialized. A chain that raises counts as failed (result None).
+    """
+    def guarded(vd_id):
+        try:
+            return chain(vd_id)
+        except Exception as e:
+            log(f"  FAIL {vd_id:25s}  — {str(e)[:200]}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel),
+                            thread_name_prefix="refresh") as pool:
+        futures = {vd_id: pool.submit(guarded, vd_id) for vd_id in vds}
+        return {vd_id: f.result() for vd_id, f in futures.items()}
+
+
+INDEX_RE = re.compile(r"CREATE INDEX IF NOT EXISTS (\w+) ON sof\.(\w+)\(([^)]*)\)")
+
+
+def table_indexes(vd_id: str, suffix: str = "") -> list[tuple[str, str]]:
+    """[(index name, CREATE INDEX)] -- the 03-sof-indexes.sql indexes of vd_id's
+    table. With a suffix they are built on sof.<name><suffix> and named
+    <index><suffix> (index names are per schema)."""
+    table = vd_id.replace("-", "_")
+    with open(SOF_INDEXES_SQL) as fh:
+        text = fh.read()
+    return [(name, f"CREATE INDEX IF NOT EXISTS {name}{suffix} ON sof.{table}{suffix}({cols})")
+            for name, on, cols in INDEX_RE.findall(text) if on == table]
+
+
+def index_and_analyze(vd_id: str, base_url: str, auth: str, timings: Timings,
+                      suffix: str = "") -> int:
+    """The index, then the ANALYZE phase of one table. Returns count of warnings."""
+    with timings.phase(vd_id, "index"):
+        warnings = run_statements([stmt for _, stmt in table_indexes(vd_id, suffix)],
+                                  base_url, auth)
+    with timings.phase(vd_id, "analyze"):
+        warnings += run_statements([f"ANALYZE sof.{vd_id.replace('-', '_')}{suffix}"],
+                                   base_url, auth)
+    return warnings
+
+
+def full_refresh(vds, base_url: str, auth: str, parallel: int,
+                 timings: Timings) -> list[str]:
+    """Steps 1-4: rebuild every VD table; returns the VDs that failed."""
+    # Step 1: drop wrapper views (CASCADE) — otherwise $materialize cannot DROP TABLE
+    print(f"\n[refresh_sof] Dropping wrapper views (CASCADE) ...")
+    with timings.step("drop-views"):
+        drop_wrapper_views(base_url, auth)
+
+    # Steps 2 + 4: $materialize each VD (recording the high-water mark read before
+    # it), then create its indexes and ANALYZE it — per-statement so a slow CREATE
+    # INDEX or ANALYZE on production-sized tables (10M+ observations) doesn't hide
+    # behind a single file-level timeout, and so each statement's runtime is
+    # visible in the log.
+    print(f"\n[refresh_sof] Materializing {len(vds)} ViewDefinitions, each then indexed "
+          f"+ ANALYZEd (parallelism {parallel}) ...")
+
+    def chain(vd_id):
+        t_vd = time.time()
+        with timings.phase(vd_id, "materialize"):
+            mark = read_mark(vd_id, base_url, auth)
+            ok, err = materialize(vd_id, base_url, auth)
+        dt = time.time() - t_vd
+        cnt = table_count(vd_id, base_url, auth) if ok else None
+        cnt_str = f" ({cnt:,} rows)" if cnt is not None else ""
+        status = "OK" if ok else "FAIL"
+        log(f"  {status:4s} {vd_id:25s} {dt:>6.2f}s{cnt_str}" + (f"  — {err}" if not ok else ""))
+        if not ok:
+            return False
+        # A table left without an index or statistics is a failure, and gets no mark:
+        # a later --delta must not treat it as a finished refresh.
+        warnings = index_and_analyze(vd_id, base_url, auth, timings)
+        if warnings:
+            log(f"  FAIL {vd_id:25s} {warnings} index / ANALYZE statement(s) failed")
+            return False
+        if mark is not None:
+            save_mark(vd_id, mark, base_url, auth)
+        return True
+
+    with timings.step("tables"):
+        results = run_pipeline(vds, chain, parallel)
+
+    # Step 3: recreate wrapper views — they read every table, so after the pipeline
+    print(f"\n[refresh_sof] Re-applying wrapper views from 01-wrapper-views.sql ...")
+    with timings.step("wrapper-views"):
+        warnings_w = apply_sql_file(WRAPPER_VIEWS_SQL, base_url, auth)
+    print(f"  Done in {timings.steps['wrapper-views']:.2f}s ({warnings_w} warnings)")
+    return [vd_id for vd_id, ok in results.items() if not ok]
+
+
+def delta_refresh(vds, base_url: str, auth: str, parallel: int,
+                  timings: Timings) -> tuple[list[str], int]:
+    """Re-project the resources changed since each VD's mark; returns the VDs that
+    failed and the number of resources whose rows changed."""
+    print(f"\n[refresh_sof] Delta refresh of {len(vds)} ViewDefinitions "
+          f"(parallelism {parallel}) ...")
+    marks = read_marks(base_url, auth)
+    # VDs whose delta committed but whose ANALYZE failed: failed, yet their changed
+    # rows still count, so the data version is bumped for them.
+    unanalyzed = []
+
+    def chain(vd_id):
+        if vd_id not in marks:
+            log(f"  FAIL {vd_id:25s}  — no high-water mark; run a full refresh first")
+            return None
+        t_vd = time.time()
+        with timings.phase(vd_id, "delta"):
+            ok, err = ensure_delta_view(vd_id, base_url, auth)
+            if ok:
+                try:
+                    run_sql(delta_sql(vd_id, marks[vd_id]), base_url, auth, timeout=1800)
+                except urllib.error.HTTPError as e:
+                    ok, err = False, f"HTTP {e.code}: {e.read()[:200].decode(errors='replace')}"
+                except Exception as e:
+                    ok, err = False, str(e)[:200]
+        dt = time.time() - t_vd
+        if not ok:
+            log(f"  FAIL {vd_id:25s} {dt:>6.2f}s  — {err}")
+            return None
+        n = read_marks(base_url, auth).get(vd_id, {}).get("changed") or 0
+        log(f"  OK   {vd_id:25s} {dt:>6.2f}s ({n:,} resources changed)")
+        # Keep the planner's statistics in step with a changed table; the indexes
+        # were maintained row by row.
+        if n:
+            with timings.phase(vd_id, "analyze"):
+                warnings = run_statements([f"ANALYZE sof.{vd_id.replace('-', '_')}"],
+                                          base_url, auth)
+            if warnings:
+                log(f"  FAIL {vd_id:25s} ANALYZE failed")
+                unanalyzed.append(vd_id)
+        return n
+
+    with timings.step("tables"):
+        results = run_pipeline(vds, chain, parallel)
+    failed = [vd_id for vd_id, n in results.items() if n is None or vd_id in unanalyzed]
+    return failed, sum(n or 0 for n in results.values())
+
+
+# --- shadow tables / atomic swap ------------------------------------------------
+
+def swap_sql(vds) -> str:
+    """The /$sql text swapping the shadow tables of `vds` in, as one transaction."""
+    tables = [vd_id.replace("-", "_") for vd_id in vds]
+    with open(WRAPPER_VIEWS_SQL) as fh:
+        wrapper_views = fh.read()
+    lines = ["SET LOCAL lock_timeout = '60s';"]
+    for t in tables:
+        lines += [f"DROP TABLE IF EXISTS sof.{t}_old;",
+                  f"ALTER TABLE IF EXISTS sof.{t} RENAME TO {t}_old;",
+                  f"ALTER TABLE sof.{t}_shadow RENAME TO {t};"]
+    # Re-point the wrapper views (bound to the renamed tables) at the new ones.
+    lines.append(wrapper_views.rstrip().rstrip(";") + ";")
+    for vd_id, t in zip(vds, tables):
+        lines.append(f"DROP TABLE IF EXISTS sof.{t}_old;")
+        lines += [f"ALTER INDEX sof.{name}_shadow RENAME TO {name};"
+                  for name, _ in table_indexes(vd_id, "_shadow")]
+    return "\n".join(lines).rstrip(";")
+
+
+def shadow_refresh(vds, base_url: str, auth: str, parallel: int,
+                   timings: Timings) -> list[str]:
+    """Build, index and ANALYZE shadow tables, then swap them in; returns the VDs
+    that failed (their live tables are left as they were)."""
+    print(f"\n[refresh_sof] Materializing {len(vds)} shadow tables, each then indexed "
+          f"+ ANALYZEd (parallelism {parallel}) ...")
+    marks = {}
+
+    def chain(vd_id):
+        t_vd = time.time()
+        with timings.phase(vd_id, "materialize"):
+            marks[vd_id] = read_mark(vd_id, base_url, auth)
+            ok, err = materialize_copy(vd_id, "shadow", "table", base_url, auth)
+        dt = time.time() - t_vd
+        cnt = table_count(vd_id, base_url, auth, suffix="_shadow") if ok else None
+        cnt_str = f" ({cnt:,} rows)" if cnt is not None else ""
+        status = "OK" if ok else "FAIL"
+        log(f"  {status:4s} {vd_id:25s} {dt:>6.2f}s{cnt_str}" + (f"  — {err}" if not ok else ""))
+        # never swap in a table missing an index
+        return ok and not index_and_analyze(vd_id, base_url, auth, timings, suffix="_shadow")
+
+    with timings.step("tables"):
+        results = run_pipeline(vds, chain, parallel)
+    failed = [vd_id for vd_id, ok in results.items() if not ok]
+    indexed = [vd_id for vd_id, ok in results.items() if ok]
+    if not indexed:
+        return failed
+
+    print(f"\n[refresh_sof] Swapping {len(indexed)} tables in (one transaction) ...")
+    t_swap = time.time()
+    try:
+        with timings.step("swap"):
+            run_sql(swap_sql(indexed), base_url, auth, timeout=600)
+    except urllib.error.HTTPError as e:
+        print(f"  FAIL {time.time()-t_swap:>7.2f}s  — HTTP {e.code}: "
+              f"{e.read()[:200].decode(errors='replace')}")
+        return failed + indexed
+    except Exception as e:
+        print(f"  FAIL {time.time()-t_swap:>7.2f}s  — {str(e)[:200]}")
+        return failed + indexed
+    print(f"  OK   {time.time()-t_swap:>7.2f}s  {', '.join(indexed)}")
+    for vd_id in indexed:
+        if marks.get(vd_id) is not None:
+            save_mark(vd_id, marks[vd_id], base_url, auth)
+    return failed
+
+
 def main():
-    ap = argparse.ArgumentParser(description=__doc__)
+    ap = argparse.ArgumentParser(description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
     ap.add_argument("--base-url", default=os.environ.get("AIDBOX_URL", "http://localhost:8888"))
     ap.add_argument("--user", default=os.environ.get("AIDBOX_USER", "root"))
     ap.add_argument("--password", default=os.environ.get("AIDBOX_PASS", "secret"))
     ap.add_argument("--vds", nargs="+", default=VD_IDS,
                     help="ViewDefinition IDs to materialize (default: all 9)")
+    ap.add_argument("--parallel", type=int, default=REFRESH_PARALLELISM,
+                    help="tables built at once (default: $REFRESH_PARALLELISM or "
+                         f"{REFRESH_PARALLELISM})")
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("--delta", action="store_true",
+                      help="re-project only the resources changed since the last refresh")
+    mode.add_argument("--shadow", action="store_true",
+                      help="rebuild under shadow names and swap the tables in atomically")
+    ap.add_argument("--skip-exclusions", action="store_true",
+                    help="do not rebuild the materialized shared exclusions")
+    ap.add_argument("--skip-membership", action="store_true",
+                    help="do not rebuild the measure membership snapshots")
     args = ap.parse_args()
 
     auth = auth_header(args.user, args.password)
@@ -172,44 +643,58 @@ def main():
     print(f"[refresh_sof] VDs: {len(args.vds)}")
 
     t0 = time.time()
-
-    # Step 1: drop wrapper views (CASCADE) — otherwise $materialize cannot DROP TABLE
-    print(f"\n[refresh_sof] Dropping wrapper views (CASCADE) ...")
-    drop_wrapper_views(args.base_url, auth)
-
-    # Step 2: $materialize each VD
-    print(f"\n[refresh_sof] Materializing {len(args.vds)} ViewDefinitions ...")
-    failed = []
-    for vd_id in args.vds:
-        t_vd = time.time()
-        ok, err = materialize(vd_id, args.base_url, auth)
-        dt = time.time() - t_vd
-        cnt = table_count(vd_id, args.base_url, auth) if ok else None
-        cnt_str = f" ({cnt:,} rows)" if cnt is not None else ""
-        status = "OK" if ok else "FAIL"
-        print(f"  {status:4s} {vd_id:25s} {dt:>6.2f}s{cnt_str}" + (f"  — {err}" if not ok else ""))
-        if not ok:
-            failed.append(vd_id)
-
-    # Step 3: recreate wrapper views
-    print(f"\n[refresh_sof] Re-applying wrapper views from 01-wrapper-views.sql ...")
-    t_wrap = time.time()
-    warnings_w = apply_sql_file(WRAPPER_VIEWS_SQL, args.base_url, auth)
-    print(f"  Done in {time.time()-t_wrap:.2f}s ({warnings_w} warnings)")
-
-    # Step 4: re-apply indexes + ANALYZE — per-statement so a slow CREATE INDEX
-    # or ANALYZE on production-sized tables (10M+ observations) doesn't hide
-    # behind a single file-level timeout, and so each statement's runtime
-    # is visible in the log.
-    print(f"\n[refresh_sof] Re-applying indexes + ANALYZE from 03-sof-indexes.sql ...")
-    t_idx = time.time()
-    warnings_i = apply_sql_per_statement(SOF_INDEXES_SQL, args.base_url, auth)
-    print(f"  Done in {time.time()-t_idx:.2f}s ({warnings_i} warnings)")
-
+    timings = Timings()
+    apply_sql_file(REFRESH_MARKS_SQL, args.base_url, auth)  # idempotent DDL
+
+    if args.delta:
+        failed, changed = delta_refresh(args.vds, args.base_url, auth, args.parallel, timings)
+        if not changed:
+            # Nothing to invalidate: keep the data version, caches and snapshots.
+            timings.report()
+            print(f"\n[refresh_sof] Total: {time.time() - t0:.1f}s, no resources changed")
+            if failed:
+                print(f"[refresh_sof] FAILED: {', '.join(failed)}")
+                sys.exit(1)
+            sys.exit(0)
+    elif args.shadow:
+        failed = shadow_refresh(args.vds, args.base_url, auth, args.parallel, timings)
+    else:
+        failed = full_refresh(args.vds, args.base_url, auth, args.parallel, timings)
+
+    # Step 5: bump the sof data version — invalidates the evaluate service's
+    # result cache. Bumped even when some $materialize failed: the tables that
+    # did rebuild changed, so anything cached against them is stale.
+    print(f"\n[refresh_sof] Bumping sof.data_version ...")
+    with timings.step("data-version"):
+        warnings_v = apply_sql_file(DATA_VERSION_SQL, args.base_url, auth)
+    print(f"  Done ({warnings_v} warnings)")
+
+    # Step 6: rebuild the materialized shared exclusions. Like the snapshots they
+    # went stale with the version bump (the shared_* functions and excl-* Libraries
+    # derive the exclusions again meanwhile); rebuilt first, so the membership
+    # builds below read them.
+    failed_x = []
+    if not args.skip_exclusions:
+        print(f"\n[refresh_sof] Rebuilding materialized shared exclusions ...")
+        from build_shared_exclusions import rebuild_existing as rebuild_exclusions
+        with timings.step("exclusions"):
+            failed_x = rebuild_exclusions(args.base_url, auth)
+
+    # Step 7: rebuild membership snapshots. The version bump above made every one
+    # of them stale (the service stops serving them); rebuilding puts them back.
+    failed_m = []
+    if not args.skip_membership:
+        print(f"\n[refresh_sof] Rebuilding measure membership snapshots ...")
+        from build_membership import rebuild_existing
+        with timings.step("membership"):
+            failed_m = rebuild_existing(args.base_url, auth)
+
+    timings.report()
     elapsed = time.time() - t0
-    print(f"\n[refresh_sof] Total: {elapsed:.1f}s, {len(args.vds) - len(failed)}/{len(args.vds)} materialized")
-    if failed:
-        print(f"[refresh_sof] FAILED: {', '.join(failed)}")
+    done = "refreshed (delta)" if args.delta else "refreshed"
+    print(f"\n[refresh_sof] Total: {elapsed:.1f}s, {len(args.vds) - len(failed)}/{len(args.vds)} {done}")
+    if failed or failed_x or failed_m:
+        print(f"[refresh_sof] FAILED: {', '.join(failed + failed_x + failed_m)}")
         sys.exit(1)
     sys.exit(0)
 